@@ -0,0 +1,104 @@
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection
+from datetime import date
+from time import perf_counter
+
+
+# Tables des archives, gelées après chaque archivage
+ARCHIVES = ["MENU_ARCHIVE", "REPAS_ARCHIVE", "CATEGORIE_ARCHIVE", "COMPOSITION_ARCHIVE"]
+
+
+def schoolYearStart(day: date) -> date:
+    """
+    Récupère le début de l'année scolaire (1er septembre) d'une date.
+
+    :param day: La date
+    :type day: date
+    :return: Le début de l'année scolaire
+    :rtype: date
+    """
+    return date(day.year if day.month >= 9 else day.year - 1, 9, 1)
+
+
+class MenuArchiver:
+    """
+    Archive les menus des années scolaires passées.
+
+    Les tables de l'arbre des menus (MENU, REPAS, CATEGORIE, COMPOSITION) ne gardent que les
+    ``schoolYears`` dernières années scolaires (en cours comprise) : les menus plus anciens sont
+    déplacés, par lots (voir ``archive_menus()`` dans schema.sql), dans les tables *_ARCHIVE,
+    partitionnées par année scolaire. Chaque lot est déplacé dans sa propre transaction. Les
+    archives sont ensuite gelées (``VACUUM FREEZE``) : l'autovacuum n'a plus à les parcourir.
+
+    L'historique complet reste lisible avec les vues v_menus, v_repas, v_categories et v_compositions.
+    """
+
+    def __init__(self, logger: Logger, pool: Pool, schoolYears: int = 2, batch: int = 1000) -> None:
+        """
+        Constructeur de la classe MenuArchiver.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param schoolYears: Le nombre d'années scolaires gardées dans les tables des menus (0 : pas d'archivage)
+        :type schoolYears: int
+        :param batch: Le nombre de menus archivés par transaction (complété par les autres menus du dernier jour)
+        :type batch: int
+        """
+        self.logger = logger
+        self.pool = pool
+        self.schoolYears = schoolYears
+        self.batch = batch
+
+    def horizon(self, today: date | None = None) -> date:
+        """
+        Récupère la date à partir de laquelle les menus sont gardés dans les tables des menus.
+
+        :param today: La date du jour
+        :type today: date | None
+        :return: Le début de la plus ancienne année scolaire gardée
+        :rtype: date
+        """
+        start = schoolYearStart(today or date.today())
+
+        return date(start.year - (self.schoolYears - 1), 9, 1)
+
+    async def run(self) -> int:
+        """
+        Archive les menus antérieurs à l'horizon. Une erreur est journalisée sans interrompre
+        la tâche : les lots déjà archivés le restent, les suivants le seront au prochain cycle.
+
+        :return: Le nombre de menus archivés
+        :rtype: int
+        """
+        if self.schoolYears <= 0:
+            return 0
+
+        horizon = self.horizon()
+        archived = 0
+        timer = perf_counter()
+
+        try:
+            async with self.pool.acquire() as connection:
+                connection: Connection
+
+                while True:
+                    async with connection.transaction():
+                        count = await connection.fetchval("SELECT archive_menus($1, $2)", horizon, self.batch)
+
+                    if not count:
+                        break
+
+                    archived += count
+                    self.logger.info(f"{archived} menus antérieurs au {horizon:%d/%m/%Y} archivés...")
+
+                if archived:
+                    await connection.execute(f"VACUUM (FREEZE, ANALYZE) {', '.join(ARCHIVES)};")
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'archivage des menus : {e}")
+
+        if archived:
+            self.logger.info(f"{archived} menus archivés en {perf_counter() - timer:.2f}s !")
+
+        return archived
@@ -0,0 +1,279 @@
+import asyncio
+
+from CROUStillant.logger import Logger
+from CROUStillant.dishes import DishCache
+from CROUStillant.menus import MenuTree, MenuPlan, CategoryNode, isValidDish, dishNames, planMenus, rowCount, countRows
+from asyncpg import Pool, Connection
+from collections import Counter
+
+
+class BulkWriter:
+    """
+    Écrit les menus par lots : les menus modifiés de plusieurs restaurants sont mis en
+    tampon, puis envoyés en une seule fois avec ``COPY`` dans des tables de transit
+    (``STAGING_*``, non journalisées) avant d'être déplacés dans les tables partitionnées
+    par quelques requêtes ensemblistes.
+
+    Les identifiants des repas et des catégories sont réservés à l'avance dans leurs
+    séquences, ce qui permet de construire les parties modifiées de l'arbre MENU -> REPAS ->
+    CATEGORIE -> COMPOSITION côté client, sans relire les identifiants générés.
+
+    Les lignes des tables de transit ne sont jamais validées : elles sont insérées puis
+    supprimées dans la même transaction, et restent donc invisibles pour les autres
+    transactions (plusieurs workers peuvent écrire en même temps).
+    """
+
+    def __init__(self, logger: Logger, pool: Pool, dishes: DishCache, rows: Counter, size: int = 500) -> None:
+        """
+        Constructeur de la classe BulkWriter.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param dishes: Le dictionnaire des plats
+        :type dishes: DishCache
+        :param rows: Le compteur des lignes écrites, partagé avec le worker
+        :type rows: Counter
+        :param size: Le nombre de menus à partir duquel le tampon est écrit
+        :type size: int
+        """
+        self.logger = logger
+        self.pool = pool
+        self.dishes = dishes
+        self.rows = rows
+        self.size = size
+
+        self.menus: list[tuple[int, MenuTree]] = []
+        self.lock = asyncio.Lock()
+
+    async def add(self, rid: int, tree: MenuTree) -> None:
+        """
+        Ajoute un menu modifié au tampon, et écrit le tampon s'il est plein.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :param tree: L'arbre du menu
+        :type tree: MenuTree
+        """
+        self.menus.append((rid, tree))
+
+        if len(self.menus) >= self.size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Écrit les menus en tampon dans la base de données.
+        """
+        async with self.lock:
+            menus, self.menus = self.menus, []
+
+            if not menus:
+                return
+
+            async with self.pool.acquire() as connection:
+                connection: Connection
+
+                async with connection.transaction():
+                    # Comparaison avec les repas et catégories enregistrés
+                    plans = await planMenus(connection, menus)
+
+                    nbRepas = sum(len(plan.newMeals) for plan in plans)
+                    nbCategories = sum(
+                        sum(len(meal.categories) for meal in plan.newMeals) + len(plan.newCategories)
+                        for plan in plans
+                    )
+
+                    # Réservation des identifiants des repas et des catégories
+                    rpids, catids = await connection.fetchrow(
+                        """
+                            SELECT
+                                ARRAY(SELECT nextval(pg_get_serial_sequence('repas', 'rpid')) FROM generate_series(1, $1)),
+                                ARRAY(SELECT nextval(pg_get_serial_sequence('categorie', 'catid')) FROM generate_series(1, $2))
+                        """,
+                        nbRepas,
+                        nbCategories,
+                    )
+
+                    # Résolution des plats : dictionnaire en mémoire, puis base de données pour les inconnus
+                    platids, resolved = await self.dishes.resolve(
+                        connection, dishNames([tree for _, tree in menus])
+                    )
+
+                    menuRecords = []
+                    repasRecords = []
+                    categorieRecords = []
+                    compositionRecords = []
+
+                    rpidIterator = iter(rpids)
+                    catidIterator = iter(catids)
+
+                    def stageCategory(rid: int, rpid: int, category: CategoryNode) -> None:
+                        catid = next(catidIterator)
+                        categorieRecords.append((catid, category.name, category.ordre, rpid, rid, category.hash))
+
+                        for ordreDish, dish in enumerate(category.dishes):
+                            if not isValidDish(self.logger, dish, f"RID: {rid}, RPID: {rpid}, CATID: {catid}"):
+                                # Ignore ce plat
+                                continue
+
+                            compositionRecords.append((catid, rid, ordreDish, platids[dish]))
+
+                    for plan in plans:
+                        menu = plan.tree.menu
+                        menuRecords.append((menu.id, plan.rid, menu.date, plan.tree.hash))
+
+                        for meal in plan.newMeals:
+                            rpid = next(rpidIterator)
+                            repasRecords.append((rpid, meal.name, menu.id, plan.rid, meal.hash))
+
+                            for category in meal.categories:
+                                stageCategory(plan.rid, rpid, category)
+
+                        for rpid, category in plan.newCategories:
+                            stageCategory(plan.rid, rpid, category)
+
+                    await connection.copy_records_to_table(
+                        "staging_menu",
+                        records=menuRecords,
+                        columns=["mid", "rid", "date", "menu_hash"],
+                    )
+                    await connection.copy_records_to_table(
+                        "staging_repas",
+                        records=repasRecords,
+                        columns=["rpid", "tpr", "mid", "rid", "repas_hash"],
+                    )
+                    await connection.copy_records_to_table(
+                        "staging_categorie",
+                        records=categorieRecords,
+                        columns=["catid", "tpcat", "ordre", "rpid", "rid", "categorie_hash"],
+                    )
+                    await connection.copy_records_to_table(
+                        "staging_composition",
+                        records=compositionRecords,
+                        columns=["catid", "rid", "ordre", "platid"],
+                    )
+
+                    written = await self._merge(connection, plans)
+
+                for libelle, platid in resolved.items():
+                    self.dishes.add(libelle, platid)
+
+            written += len(repasRecords) + len(categorieRecords)
+            kept = sum(plan.kept for plan in plans)
+
+            countRows(self.rows, written, plans)
+
+            self.logger.info(
+                f"{len(menus)} menus écrits par lot ({len(repasRecords)} repas, "
+                f"{len(categorieRecords)} catégories, {len(compositionRecords)} compositions, "
+                f"{kept} lignes conservées) !"
+            )
+
+    async def _merge(self, connection: Connection, plans: list[MenuPlan]) -> int:
+        """
+        Supprime les parties modifiées des menus, déplace le contenu des tables de transit
+        dans les tables définitives, puis vide les tables de transit.
+
+        :param connection: La connexion à la base de données, dans une transaction
+        :type connection: Connection
+        :param plans: Les modifications à apporter aux menus
+        :type plans: list[MenuPlan]
+        :return: Le nombre de lignes supprimées, mises à jour et de compositions insérées
+        :rtype: int
+        """
+        # Les identifiants sont uniques : filtrer aussi sur les restaurants des menus ne sert qu'à
+        # limiter la recherche à leurs partitions, dans le schéma partitionné par restaurant
+        rids = list({plan.rid for plan in plans})
+        deleteCategories = [catid for plan in plans for catid in plan.deleteCategories]
+        deleteRepas = [rpid for plan in plans for rpid in plan.deleteRepas]
+        updateRepas = [repas for plan in plans for repas in plan.updateRepas]
+
+        written = 0
+
+        # Suppression des repas et catégories modifiés, avec leurs compositions
+        if deleteCategories:
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM COMPOSITION WHERE RID = ANY($2::int[]) AND CATID = ANY($1::int[])",
+                    deleteCategories,
+                    rids,
+                )
+            )
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM CATEGORIE WHERE RID = ANY($2::int[]) AND CATID = ANY($1::int[])",
+                    deleteCategories,
+                    rids,
+                )
+            )
+
+        if deleteRepas:
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM REPAS WHERE RID = ANY($2::int[]) AND RPID = ANY($1::int[])",
+                    deleteRepas,
+                    rids,
+                )
+            )
+
+        # Insertion ou mise à jour des menus avec leur nouveau hash
+        await connection.execute(
+            """
+                INSERT INTO MENU (MID, RID, DATE, MENU_HASH)
+                SELECT MID, RID, DATE, MENU_HASH FROM STAGING_MENU
+                ON CONFLICT (RID, MID) DO UPDATE
+                SET MENU_HASH = EXCLUDED.MENU_HASH
+            """
+        )
+        written += len(plans)
+
+        # Mise à jour du hash des repas conservés
+        if updateRepas:
+            written += rowCount(
+                await connection.execute(
+                    """
+                        UPDATE REPAS
+                        SET REPAS_HASH = U.REPAS_HASH
+                        FROM unnest($1::int[], $2::varchar[]) AS U(RPID, REPAS_HASH)
+                        WHERE REPAS.RID = ANY($3::int[]) AND REPAS.RPID = U.RPID
+                    """,
+                    [rpid for rpid, _ in updateRepas],
+                    [repasHash for _, repasHash in updateRepas],
+                    rids,
+                )
+            )
+
+        # Insertion des repas et catégories
+        await connection.execute(
+            """
+                INSERT INTO REPAS (RPID, TPR, MID, RID, REPAS_HASH)
+                SELECT RPID, TPR, MID, RID, REPAS_HASH FROM STAGING_REPAS;
+
+                INSERT INTO CATEGORIE (CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH)
+                SELECT CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH FROM STAGING_CATEGORIE;
+            """
+        )
+
+        # Insertion des compositions
+        written += rowCount(
+            await connection.execute(
+                """
+                    INSERT INTO COMPOSITION (CATID, RID, ORDRE, PLATID)
+                    SELECT CATID, RID, ORDRE, PLATID FROM STAGING_COMPOSITION
+                    ON CONFLICT DO NOTHING
+                """
+            )
+        )
+
+        # Les lignes de transit ne doivent jamais être validées
+        await connection.execute(
+            """
+                DELETE FROM STAGING_COMPOSITION;
+                DELETE FROM STAGING_CATEGORIE;
+                DELETE FROM STAGING_REPAS;
+                DELETE FROM STAGING_MENU;
+            """
+        )
+
+        return written
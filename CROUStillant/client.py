@@ -0,0 +1,495 @@
+import asyncio
+import random
+
+from CrousPy import Crous, Region, RU, Menu
+from CROUStillant.logger import Logger
+from CROUStillant.metrics import Metrics
+from aiohttp import ClientSession
+from collections import defaultdict, deque
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, Iterable
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Levée lorsqu'une requête vise une région dont le disjoncteur est ouvert.
+    """
+
+
+class TokenBucket:
+    """
+    Limite le débit des requêtes : un jeton par requête, ``rate`` jetons par seconde,
+    au plus ``burst`` jetons en réserve.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        Constructeur de la classe TokenBucket.
+
+        :param rate: Le nombre de requêtes par seconde (``0`` pour ne pas limiter le débit)
+        :type rate: float
+        :param burst: Le nombre de requêtes pouvant partir en rafale
+        :type burst: int
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+
+        self.tokens = float(self.burst)
+        self.updated = monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Attend qu'un jeton soit disponible, puis le consomme.
+        """
+        if self.rate <= 0:
+            return
+
+        async with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimit:
+    """
+    Limite adaptative du nombre de requêtes en cours (AIMD) : la limite augmente d'environ
+    une requête à chaque fois que ``limit`` requêtes réussissent, et est divisée par deux à
+    chaque erreur ou dépassement de délai.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1) -> None:
+        """
+        Constructeur de la classe AdaptiveLimit.
+
+        :param maximum: La limite maximale
+        :type maximum: int
+        :param minimum: La limite minimale
+        :type minimum: int
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+
+        # Démarrage à mi-chemin : la limite monte si l'API suit
+        self.limit = float(max(self.minimum, self.maximum // 2))
+        self.inFlight = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        """
+        Attend qu'une place soit disponible sous la limite, puis l'occupe.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.inFlight < int(self.limit))
+            self.inFlight += 1
+
+    async def release(self, success: bool) -> None:
+        """
+        Libère une place et ajuste la limite.
+
+        :param success: ``True`` si la requête a réussi
+        :type success: bool
+        """
+        async with self.condition:
+            self.inFlight -= 1
+
+            if success:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit / 2)
+
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'une région : après ``threshold`` échecs consécutifs, les requêtes vers la
+    région échouent immédiatement pendant ``cooldown`` secondes. Passé ce délai, les requêtes
+    sont de nouveau tentées ; un nouvel échec rouvre le disjoncteur, un succès le referme.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0) -> None:
+        """
+        Constructeur de la classe CircuitBreaker.
+
+        :param threshold: Le nombre d'échecs consécutifs avant ouverture
+        :type threshold: int
+        :param cooldown: La durée d'ouverture (secondes)
+        :type cooldown: float
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.openedAt: float | None = None
+
+    @property
+    def open(self) -> bool:
+        """
+        Indique si les requêtes doivent échouer immédiatement.
+
+        :return: ``True`` si le disjoncteur est ouvert
+        :rtype: bool
+        """
+        return self.openedAt is not None and monotonic() - self.openedAt < self.cooldown
+
+    @property
+    def remaining(self) -> float:
+        """
+        Le temps restant avant que les requêtes soient de nouveau tentées.
+
+        :return: Le temps restant (secondes, ``0`` si le disjoncteur est fermé)
+        :rtype: float
+        """
+        if self.openedAt is None:
+            return 0.0
+
+        return max(0.0, self.cooldown - (monotonic() - self.openedAt))
+
+    def success(self) -> None:
+        self.failures = 0
+        self.openedAt = None
+
+    def failure(self) -> None:
+        self.failures += 1
+
+        if self.failures >= self.threshold:
+            self.openedAt = monotonic()
+
+
+class Latency:
+    """
+    Latences d'un point d'accès de l'API : compteurs et derniers échantillons.
+    """
+
+    def __init__(self, size: int = 1024) -> None:
+        """
+        Constructeur de la classe Latency.
+
+        :param size: Le nombre d'échantillons conservés pour les percentiles
+        :type size: int
+        """
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples: deque[float] = deque(maxlen=size)
+
+    def record(self, elapsed: float, success: bool) -> None:
+        """
+        Enregistre la durée d'une requête.
+
+        :param elapsed: La durée (secondes)
+        :type elapsed: float
+        :param success: ``True`` si la requête a réussi
+        :type success: bool
+        """
+        self.count += 1
+        self.total += elapsed
+        self.maximum = max(self.maximum, elapsed)
+        self.samples.append(elapsed)
+
+        if not success:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Calcule un percentile sur les derniers échantillons.
+
+        :param q: Le percentile, entre 0 et 1
+        :type q: float
+        :return: La durée (secondes)
+        :rtype: float
+        """
+        if not self.samples:
+            return 0.0
+
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class CrousClient:
+    """
+    Client de l'API du CROUS partagé par toutes les étapes du worker.
+
+    Chaque requête passe par :
+
+    - un seau à jetons, qui limite le débit global (``rate`` requêtes par seconde) ;
+    - une limite de requêtes par région (``regionConcurrency``) ;
+    - une limite adaptative (AIMD) du nombre total de requêtes en cours, qui diminue de
+      moitié à chaque erreur et remonte progressivement tant que les requêtes réussissent ;
+    - un disjoncteur par région, qui évite d'insister sur une région indisponible.
+
+    Les requêtes échouées sont retentées après une attente exponentielle avec gigue
+    (« full jitter »). L'attente se fait sans occuper de place dans les limites : les autres
+    requêtes continuent pendant ce temps.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        crous: Crous,
+        rate: float = 0,
+        concurrency: int = 8,
+        regionConcurrency: int = 4,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        maxBackoff: float = 10.0,
+        metrics: Metrics | None = None,
+    ) -> None:
+        """
+        Constructeur de la classe CrousClient.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param crous: Le client Crous
+        :type crous: Crous
+        :param rate: Le nombre maximal de requêtes par seconde (``0`` pour ne pas limiter le débit)
+        :type rate: float
+        :param concurrency: Le nombre maximal de requêtes en cours
+        :type concurrency: int
+        :param regionConcurrency: Le nombre maximal de requêtes en cours par région
+        :type regionConcurrency: int
+        :param timeout: Le délai maximal d'une requête (secondes)
+        :type timeout: float
+        :param retries: Le nombre de tentatives par requête
+        :type retries: int
+        :param backoff: L'attente de base avant une nouvelle tentative (secondes)
+        :type backoff: float
+        :param maxBackoff: L'attente maximale avant une nouvelle tentative (secondes)
+        :type maxBackoff: float
+        :param metrics: Les mesures, qui reçoivent la durée de chaque tentative
+        :type metrics: Metrics | None
+        """
+        self.logger = logger
+        self.crous = crous
+
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+        self.bucket = TokenBucket(rate, burst=concurrency)
+        self.limit = AdaptiveLimit(concurrency)
+        self.regionSemaphores: dict[int | None, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(regionConcurrency)
+        )
+        self.breakers: dict[int, CircuitBreaker] = defaultdict(CircuitBreaker)
+        self.latencies: dict[str, Latency] = defaultdict(Latency)
+        self.metrics = metrics or Metrics(logger)
+
+        self.requests = 0
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        La session HTTP du client Crous (utilisée pour télécharger les images).
+        """
+        return self.crous.client.session
+
+    def delay(self, attempt: int) -> float:
+        """
+        Calcule l'attente avant une nouvelle tentative (exponentielle, avec gigue complète).
+
+        :param attempt: Le numéro de la tentative échouée
+        :type attempt: int
+        :return: L'attente (secondes)
+        :rtype: float
+        """
+        return random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt))
+
+    async def request(
+        self,
+        endpoint: str,
+        path: str,
+        region: int | None,
+        call: Callable[[], Awaitable[Any]],
+        retries: int | None = None,
+    ) -> Any:
+        """
+        Exécute une requête avec limitation de débit, nouvelles tentatives et disjoncteur.
+
+        :param endpoint: Le nom du point d'accès (pour les latences)
+        :type endpoint: str
+        :param path: Le chemin de la requête (pour les logs)
+        :type path: str
+        :param region: L'identifiant de la région (``None`` pour la liste des régions)
+        :type region: int | None
+        :param call: La requête
+        :type call: Callable[[], Awaitable[Any]]
+        :param retries: Le nombre de tentatives (par défaut, celui du client)
+        :type retries: int | None
+        :return: Le résultat de la requête
+        :rtype: Any
+        :raises CircuitOpenError: Si le disjoncteur de la région est ouvert
+        :raises Exception: La dernière exception rencontrée si toutes les tentatives échouent
+        """
+        breaker = self.breakers[region] if region is not None else None
+        latency = self.latencies[endpoint]
+        retries = retries or self.retries
+        error: Exception | None = None
+
+        for attempt in range(1, retries + 1):
+            if breaker and breaker.open:
+                raise CircuitOpenError(f"Région {region} indisponible (disjoncteur ouvert) : GET {path}")
+
+            await self.bucket.acquire()
+
+            async with self.regionSemaphores[region]:
+                await self.limit.acquire()
+
+                self.logger.debug(f"GET {path} (tentative {attempt}/{retries})")
+
+                start = perf_counter()
+                success = False
+
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        result = await call()
+
+                    success = True
+                except Exception as e:
+                    error = e
+                finally:
+                    elapsed = perf_counter() - start
+                    latency.record(elapsed, success)
+                    self.metrics.observe("api", endpoint, elapsed, not success)
+                    await self.limit.release(success)
+
+            if success:
+                if breaker:
+                    breaker.success()
+
+                self.requests += 1
+                return result
+
+            if breaker:
+                breaker.failure()
+
+            self.logger.warning(
+                f"Échec de GET {path} (tentative {attempt}/{retries}) : {error!r}"
+            )
+
+            if attempt < retries:
+                await asyncio.sleep(self.delay(attempt))
+
+        self.logger.error(f"Échec de GET {path} après {retries} tentatives")
+
+        raise error
+
+    def reopening(self, regions: Iterable[int]) -> float:
+        """
+        Le temps restant avant que les disjoncteurs de quelques régions laissent de nouveau
+        passer des requêtes.
+
+        :param regions: Les identifiants des régions
+        :type regions: Iterable[int]
+        :return: Le plus long temps restant (secondes, ``0`` si tous les disjoncteurs sont fermés)
+        :rtype: float
+        """
+        return max((self.breakers[region].remaining for region in regions if region in self.breakers), default=0.0)
+
+    async def regions(self) -> list[Region]:
+        """
+        Récupère les régions.
+
+        :return: Les régions
+        :rtype: list[Region]
+        """
+        return await self.request(
+            "regions", "/regions", None, lambda: self.crous.region.get()
+        )
+
+    async def restaurants(self, region: int, retries: int | None = None) -> list[RU]:
+        """
+        Récupère les restaurants d'une région.
+
+        :param region: L'identifiant de la région
+        :type region: int
+        :param retries: Le nombre de tentatives (par défaut, celui du client)
+        :type retries: int | None
+        :return: Les restaurants
+        :rtype: list[RU]
+        """
+        return await self.request(
+            "restaurants",
+            f"/regions/{region}/restaurants",
+            region,
+            lambda: self.crous.ru.get(region),
+            retries,
+        )
+
+    async def menus(self, region: int, restaurant: int, retries: int | None = None) -> list[Menu]:
+        """
+        Récupère les menus d'un restaurant.
+
+        :param region: L'identifiant de la région
+        :type region: int
+        :param restaurant: L'identifiant du restaurant
+        :type restaurant: int
+        :param retries: Le nombre de tentatives (par défaut, celui du client)
+        :type retries: int | None
+        :return: Les menus
+        :rtype: list[Menu]
+        """
+        return await self.request(
+            "menus",
+            f"/regions/{region}/restaurants/{restaurant}/menus",
+            region,
+            lambda: self.crous.menu.get(region, restaurant),
+            retries,
+        )
+
+    def reset(self) -> None:
+        """
+        Remet à zéro les latences, le nombre de requêtes et les disjoncteurs, avant une nouvelle
+        tâche (mode démon). La limite de requêtes en cours, adaptée aux tâches précédentes, est gardée.
+        """
+        self.breakers.clear()
+        self.latencies.clear()
+        self.requests = 0
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Récupère les latences de chaque point d'accès.
+
+        :return: Les latences, par point d'accès
+        :rtype: dict[str, dict]
+        """
+        return {
+            endpoint: {
+                "count": latency.count,
+                "errors": latency.errors,
+                "mean": latency.total / latency.count if latency.count else 0.0,
+                "p50": latency.percentile(0.5),
+                "p95": latency.percentile(0.95),
+                "max": latency.maximum,
+            }
+            for endpoint, latency in self.latencies.items()
+        }
+
+    def report(self) -> None:
+        """
+        Journalise les latences de chaque point d'accès et l'état des limites.
+        """
+        for endpoint, stats in self.stats().items():
+            self.logger.info(
+                f"API {endpoint} : {stats['count']:,d} requêtes, {stats['errors']:,d} erreurs, "
+                f"moyenne {stats['mean'] * 1000:.0f} ms, p50 {stats['p50'] * 1000:.0f} ms, "
+                f"p95 {stats['p95'] * 1000:.0f} ms, max {stats['max'] * 1000:.0f} ms"
+            )
+
+        opened = [region for region, breaker in self.breakers.items() if breaker.open]
+
+        self.logger.info(
+            f"API : limite de requêtes en cours {self.limit.limit:.1f}/{self.limit.maximum}"
+            + (f", disjoncteurs ouverts : {opened}" if opened else "")
+        )
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+
+class Schedule:
+    """
+    Planification des cycles du mode démon (équivalent de la crontab).
+
+    Un cycle est lancé à chaque heure de ``hours`` (à la minute 0). Le premier cycle du jour
+    ``backfillDay`` est un rattrapage (voir ``--backfill``).
+    """
+
+    def __init__(self, hours: list[int], backfillDay: int | None = None) -> None:
+        """
+        Constructeur de la classe Schedule.
+
+        :param hours: Les heures des cycles (0 à 23)
+        :type hours: list[int]
+        :param backfillDay: Le jour du rattrapage hebdomadaire (0 : lundi, 6 : dimanche, ``None`` : jamais)
+        :type backfillDay: int | None
+        """
+        if not hours or any(not 0 <= hour <= 23 for hour in hours):
+            raise ValueError(f"Heures des cycles invalides : {hours}")
+
+        self.hours = sorted(set(hours))
+        self.backfillDay = backfillDay
+
+    def next(self, now: datetime) -> datetime:
+        """
+        Récupère la date du prochain cycle.
+
+        :param now: La date actuelle
+        :type now: datetime
+        :return: La date du prochain cycle, strictement après ``now``
+        :rtype: datetime
+        """
+        day = now.replace(minute=0, second=0, microsecond=0)
+
+        for hour in self.hours:
+            run = day.replace(hour=hour)
+
+            if run > now:
+                return run
+
+        return (day + timedelta(days=1)).replace(hour=self.hours[0])
+
+    def isBackfill(self, run: datetime) -> bool:
+        """
+        Indique si un cycle est un rattrapage.
+
+        :param run: La date du cycle
+        :type run: datetime
+        :return: ``True`` pour le premier cycle du jour du rattrapage
+        :rtype: bool
+        """
+        return run.weekday() == self.backfillDay and run.hour == self.hours[0]
@@ -0,0 +1,214 @@
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+
+from asyncpg import Connection
+
+
+class DishCache:
+    """
+    Dictionnaire en mémoire des plats (LIBELLE -> PLATID).
+
+    PLAT est partitionnée par HASH sur PLATID : une recherche par LIBELLE interroge l'index
+    des 30 partitions. Le dictionnaire est chargé une seule fois au démarrage, puis complété
+    au fil des insertions, afin que la résolution des plats déjà connus ne coûte aucun aller-retour
+    avec la base de données.
+
+    Les plats sont rangés par empreinte de leur libellé (64 bits, BLAKE2b), dans un tableau trié,
+    à côté de tableaux parallèles d'identifiants et de libellés : pas de table de hachage à
+    plusieurs centaines de milliers d'entrées. Les libellés sont conservés et comparés à chaque
+    recherche : deux libellés de même empreinte restent deux plats distincts, une collision
+    ne peut pas renvoyer l'identifiant d'un autre plat. Les plats ajoutés depuis le chargement
+    sont conservés dans un petit dictionnaire, fusionné dans les tableaux lorsqu'il grossit.
+    """
+
+    MERGE_THRESHOLD = 10_000
+
+    def __init__(self) -> None:
+        """
+        Constructeur de la classe DishCache.
+        """
+        self.keys = array("q")
+        self.ids = array("i")
+        self.labels: list[str] = []
+        self.recent: dict[str, int] = {}
+
+        # Plats résolus en mémoire, et plats cherchés (ou créés) en base
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.recent)
+
+    @staticmethod
+    def key(libelle: str) -> int:
+        """
+        Calcule l'empreinte d'un libellé. L'empreinte sert aussi de clé de verrou consultatif
+        (``pg_advisory_xact_lock``) lors de la création d'un plat.
+
+        :param libelle: Le libellé du plat
+        :type libelle: str
+        :return: L'empreinte signée sur 64 bits
+        :rtype: int
+        """
+        return int.from_bytes(
+            blake2b(libelle.encode("utf-8"), digest_size=8).digest(), "little", signed=True
+        )
+
+    def get(self, libelle: str) -> int | None:
+        """
+        Récupère l'identifiant d'un plat.
+
+        :param libelle: Le libellé du plat
+        :type libelle: str
+        :return: L'identifiant du plat, ou ``None`` s'il est inconnu
+        :rtype: int | None
+        """
+        platid = self.recent.get(libelle)
+        if platid is not None:
+            return platid
+
+        key = self.key(libelle)
+        index = bisect_left(self.keys, key)
+
+        # Les libellés de même empreinte (collision) se suivent dans les tableaux
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.labels[index] == libelle:
+                return self.ids[index]
+
+            index += 1
+
+        return None
+
+    def add(self, libelle: str, platid: int) -> None:
+        """
+        Ajoute un plat au dictionnaire. À n'appeler qu'une fois le plat validé en base.
+
+        :param libelle: Le libellé du plat
+        :type libelle: str
+        :param platid: L'identifiant du plat
+        :type platid: int
+        """
+        self.recent.setdefault(libelle, platid)
+
+        if len(self.recent) >= self.MERGE_THRESHOLD:
+            self._build(
+                list(zip(self.keys, self.labels, self.ids))
+                + [(self.key(libelle), libelle, platid) for libelle, platid in self.recent.items()]
+            )
+
+    def _build(self, entries: list[tuple[int, str, int]]) -> None:
+        """
+        Reconstruit les tableaux triés. Pour un même libellé, le plus petit identifiant est conservé.
+
+        :param entries: Les plats (empreinte, libellé, identifiant)
+        :type entries: list[tuple[int, str, int]]
+        """
+        entries.sort()
+
+        keys = array("q")
+        ids = array("i")
+        labels = []
+
+        for key, libelle, platid in entries:
+            if labels and keys[-1] == key and labels[-1] == libelle:
+                continue
+
+            keys.append(key)
+            ids.append(platid)
+            labels.append(libelle)
+
+        self.keys = keys
+        self.ids = ids
+        self.labels = labels
+        self.recent = {}
+
+    async def load(self, connection: Connection) -> None:
+        """
+        Charge tous les plats depuis la base de données avec un curseur.
+
+        :param connection: La connexion à la base de données
+        :type connection: Connection
+        """
+        entries = []
+
+        async with connection.transaction():
+            async for record in connection.cursor(
+                "SELECT PLATID, LIBELLE FROM PLAT", prefetch=10_000
+            ):
+                if record["libelle"] is not None:
+                    entries.append((self.key(record["libelle"]), record["libelle"], record["platid"]))
+
+        self._build(entries)
+
+    async def resolve(self, connection: Connection, libelles: set[str]) -> tuple[dict[str, int], dict[str, int]]:
+        """
+        Récupère les identifiants de plusieurs plats, en créant ceux qui n'existent pas.
+
+        Les plats connus sont résolus en mémoire. Pour les autres, LIBELLE n'étant pas unique
+        dans PLAT, la création est protégée par des verrous consultatifs sur les empreintes des
+        libellés, tenus jusqu'à la fin de la transaction : si deux workers créent le même plat en
+        même temps, le second attend la validation du premier puis retrouve son identifiant.
+        Les verrous sont pris en une seule requête, dans l'ordre des empreintes, pour éviter les
+        interblocages. La connexion doit donc être dans une transaction.
+
+        Le dictionnaire n'est pas mis à jour : les plats lus en base ne doivent y être ajoutés
+        (``add``) qu'après la validation de la transaction.
+
+        :param connection: La connexion à la base de données, dans une transaction
+        :type connection: Connection
+        :param libelles: Les libellés des plats
+        :type libelles: set[str]
+        :return: Les identifiants de tous les plats, puis ceux des plats lus ou créés en base, par libellé
+        :rtype: tuple[dict[str, int], dict[str, int]]
+        """
+        platids = {}
+        unknown = []
+
+        for libelle in libelles:
+            platid = self.get(libelle)
+
+            if platid is None:
+                unknown.append(libelle)
+            else:
+                platids[libelle] = platid
+
+        self.hits += len(platids)
+        self.misses += len(unknown)
+
+        if not unknown:
+            return platids, {}
+
+        await connection.execute(
+            "SELECT pg_advisory_xact_lock(k) FROM unnest($1::bigint[]) AS k",
+            sorted({self.key(libelle) for libelle in unknown}),
+        )
+
+        rows = await connection.fetch(
+            """
+                SELECT LIBELLE, MIN(PLATID) AS PLATID
+                FROM PLAT
+                WHERE LIBELLE = ANY($1::varchar[])
+                GROUP BY LIBELLE
+            """,
+            unknown,
+        )
+
+        resolved = {row["libelle"]: row["platid"] for row in rows}
+        missing = [libelle for libelle in unknown if libelle not in resolved]
+
+        if missing:
+            rows = await connection.fetch(
+                """
+                    INSERT INTO PLAT (LIBELLE)
+                    SELECT unnest($1::varchar[])
+                    RETURNING PLATID, LIBELLE
+                """,
+                missing,
+            )
+
+            resolved.update({row["libelle"]: row["platid"] for row in rows})
+
+        platids.update(resolved)
+
+        return platids, resolved
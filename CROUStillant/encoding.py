@@ -0,0 +1,85 @@
+import hashlib
+
+from functools import partial
+from json import dumps
+from json.encoder import encode_basestring
+
+
+# Fonctions de hash des menus, par mode :
+#  - compat : SHA256, identique aux hash déjà stockés dans MENU.MENU_HASH
+#  - fast : BLAKE2b (32 octets), plus rapide, mais tous les menus seront réécrits une fois
+HASH_MODES = {
+    "compat": hashlib.sha256,
+    "fast": partial(hashlib.blake2b, digest_size=32),
+}
+
+
+def encodeString(value: str | None) -> str:
+    """
+    Encode une valeur JSON simple exactement comme ``json.dumps(..., ensure_ascii=False)``.
+
+    :param value: La valeur (en pratique une chaîne, parfois ``None``)
+    :type value: str | None
+    :return: La valeur encodée
+    :rtype: str
+    """
+    if isinstance(value, str):
+        return encode_basestring(value)
+
+    if value is None:
+        return "null"
+
+    return dumps(value, ensure_ascii=False)
+
+
+def encodeCategory(name: str, dishes: list[str]) -> bytes:
+    """
+    Encode une catégorie sous sa forme JSON canonique, octet pour octet identique à
+    ``json.dumps({"name": name, "dishes": dishes}, sort_keys=True, ensure_ascii=False)``,
+    sans construire de dictionnaire intermédiaire.
+
+    :param name: Le nom de la catégorie
+    :type name: str
+    :param dishes: Les noms des plats
+    :type dishes: list[str]
+    :return: La catégorie encodée en UTF-8
+    :rtype: bytes
+    """
+    try:
+        # Cas courant : des chaînes uniquement, encodées directement par l'encodeur C de ``json``
+        encoded = ", ".join(map(encode_basestring, dishes))
+    except TypeError:
+        encoded = ", ".join(map(encodeString, dishes))
+
+    return ('{"dishes": [' + encoded + '], "name": ' + encodeString(name) + "}").encode("utf-8")
+
+
+def dumpsJSON(value) -> str:
+    """
+    Sérialise une valeur enregistrée en texte JSON (horaires, paiements et accès des
+    restaurants, notifications).
+
+    Les colonnes de RESTAURANT sont des VARCHAR : PostgreSQL enregistre le texte tel quel. Le
+    texte doit donc rester celui de ``json.dumps`` avec ses options par défaut (séparateurs
+    avec espaces, caractères non ASCII échappés), que lisent les clients de ces colonnes.
+
+    :param value: La valeur à sérialiser
+    :return: Le texte JSON
+    :rtype: str
+    """
+    return dumps(value)
+
+
+def fingerprint(values: list) -> str:
+    """
+    Calcule l'empreinte d'une liste de valeurs (par exemple les champs d'un restaurant), pour
+    détecter un changement sans relire la ligne enregistrée.
+
+    :param values: Les valeurs, sérialisables en JSON
+    :type values: list
+    :return: L'empreinte (SHA256, en hexadécimal)
+    :rtype: str
+    """
+    return hashlib.sha256(
+        dumps(values, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+
+from CROUStillant.logger import Logger
+from CROUStillant.storage import FileImageStore, VARIANTS
+from aiohttp import ClientSession
+from asyncpg import Pool, Connection
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image
+
+
+def encodeImage(data: bytes) -> bytes:
+    """
+    Décode une image et la réencode en JPEG. Fonction bloquante, exécutée hors de la boucle
+    d'événements.
+
+    :param data: Le contenu brut de l'image
+    :type data: bytes
+    :return: L'image au format JPEG
+    :rtype: bytes
+    :raises Exception: Si l'image n'est pas valide
+    """
+    image = Image.open(BytesIO(data))
+
+    if not image.mode == "RGB":
+        image = image.convert("RGB")
+
+    b = BytesIO()
+    image.save(b, format="JPEG", compress_level=1, quality=95)
+
+    return b.getvalue()
+
+
+def storeImage(data: bytes, store: FileImageStore) -> tuple[str, bool]:
+    """
+    Décode une image, calcule le hash de ses pixels et, si elle n'est pas encore dans le
+    stockage, y enregistre ses déclinaisons au format WebP. Fonction bloquante, exécutée hors
+    de la boucle d'événements.
+
+    :param data: Le contenu brut de l'image
+    :type data: bytes
+    :param store: Le stockage des images
+    :type store: FileImageStore
+    :return: Le hash du contenu, et ``True`` si des déclinaisons ont été encodées
+    :rtype: tuple[str, bool]
+    :raises Exception: Si l'image n'est pas valide
+    """
+    image = Image.open(BytesIO(data))
+
+    if not image.mode == "RGB":
+        image = image.convert("RGB")
+
+    # Le hash porte sur les pixels décodés : deux fichiers différents (métadonnées,
+    # compression) d'une même image ont le même hash
+    contentHash = hashlib.sha256(
+        f"{image.width}x{image.height}:".encode("utf-8") + image.tobytes()
+    ).hexdigest()
+
+    # Contenu inchangé, ou déjà enregistré sous une autre URL : aucun encodage
+    if store.exists(contentHash):
+        return contentHash, False
+
+    variants = {}
+
+    for variant, (size, quality) in VARIANTS.items():
+        resized = image
+
+        if size and max(image.size) > size:
+            resized = image.copy()
+            resized.thumbnail((size, size))
+
+        b = BytesIO()
+        resized.save(b, format="WEBP", quality=quality, method=4)
+        variants[variant] = b.getvalue()
+
+    store.write(contentHash, variants)
+
+    return contentHash, True
+
+
+class ImageLoader:
+    """
+    Charge les images des restaurants.
+
+    Les URL sont collectées pendant le chargement des restaurants : une image partagée par
+    plusieurs restaurants n'est traitée qu'une fois. Leur fraîcheur est ensuite vérifiée en
+    une seule requête, et seules les images de plus de ``maxAge`` jours sont téléchargées,
+    en parallèle, avec une requête conditionnelle (``If-None-Match`` / ``If-Modified-Since``)
+    à partir des validateurs enregistrés : une image inchangée (``304``) n'est ni téléchargée
+    ni réencodée.
+
+    Le décodage et l'encodage avec Pillow se font dans un pool de threads (Pillow libère le
+    GIL pendant ces opérations), pour ne jamais bloquer la boucle d'événements.
+
+    Avec un stockage des images (``store``), l'image n'est plus enregistrée dans RAW_IMAGE :
+    ses déclinaisons WebP sont enregistrées dans le stockage, sous le hash de ses pixels,
+    et seul ce hash (CONTENT_HASH) est enregistré dans la base de données.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        pool: Pool,
+        session: ClientSession,
+        concurrency: int = 4,
+        maxAge: int = 7,
+        store: FileImageStore | None = None,
+    ) -> None:
+        """
+        Constructeur de la classe ImageLoader.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param session: La session HTTP
+        :type session: ClientSession
+        :param concurrency: Le nombre d'images téléchargées et encodées en parallèle
+        :type concurrency: int
+        :param maxAge: L'âge (en jours) à partir duquel une image est de nouveau vérifiée
+        :type maxAge: int
+        :param store: Le stockage des images (``None`` pour enregistrer l'image en JPEG dans RAW_IMAGE)
+        :type store: FileImageStore | None
+        """
+        self.logger = logger
+        self.pool = pool
+        self.session = session
+        self.concurrency = concurrency
+        self.maxAge = maxAge
+        self.store = store
+
+        self.urls: set[str] = set()
+
+        # Images encore fraîches (non vérifiées), inchangées (304) et téléchargées
+        self.counts = Counter()
+
+    def add(self, url: str | None) -> None:
+        """
+        Ajoute l'image d'un restaurant à charger.
+
+        :param url: L'URL de l'image
+        :type url: str | None
+        """
+        if url:
+            self.urls.add(url)
+
+    async def load(self) -> None:
+        """
+        Vérifie la fraîcheur des images collectées, puis charge celles qui doivent l'être.
+        """
+        urls, self.urls = self.urls, set()
+
+        if not urls:
+            return
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            rows = await connection.fetch(
+                """
+                    SELECT IMAGE_URL, DERNIERE_MODIFICATION, ETAG, LAST_MODIFIED, CONTENT_HASH
+                    FROM RESTAURANT_IMAGE
+                    WHERE IMAGE_URL = ANY($1::varchar[])
+                """,
+                list(urls),
+            )
+
+        known = {row["image_url"]: row for row in rows}
+        limit = datetime.now() - timedelta(days=self.maxAge)
+
+        stale = [
+            url
+            for url in urls
+            if url not in known
+            or not known[url]["derniere_modification"]
+            or known[url]["derniere_modification"] <= limit
+        ]
+
+        self.counts["fraiches"] += len(urls) - len(stale)
+
+        self.logger.info(f"{len(urls)} images référencées, {len(stale)} à vérifier...")
+
+        if not stale:
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="images") as executor:
+            async with asyncio.TaskGroup() as group:
+                for url in stale:
+                    group.create_task(self.loadImage(url, known.get(url), semaphore, executor))
+
+    async def loadImage(self, url: str, known, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor) -> None:
+        """
+        Charge une image et l'enregistre dans la base de données.
+
+        :param url: L'URL de l'image
+        :type url: str
+        :param known: L'image enregistrée (validateurs), ou ``None``
+        :type known: Record | None
+        :param semaphore: Le sémaphore limitant le nombre d'images chargées en parallèle
+        :type semaphore: asyncio.Semaphore
+        :param executor: Le pool de threads pour l'encodage
+        :type executor: ThreadPoolExecutor
+        """
+        headers = {}
+
+        # Les validateurs ne sont enregistrés qu'avec une image valide. Ils ne sont utilisés que si
+        # l'image est enregistrée sous la forme attendue (stockage ou RAW_IMAGE) : sinon, une
+        # réponse 304 empêcherait de l'y enregistrer.
+        if known and (known["content_hash"] is not None) == (self.store is not None):
+            if known["etag"]:
+                headers["If-None-Match"] = known["etag"]
+            if known["last_modified"]:
+                headers["If-Modified-Since"] = known["last_modified"]
+
+        async with semaphore:
+            try:
+                self.logger.debug(f"GET {url}")
+
+                async with self.session.get(url, headers=headers) as resp:
+                    status = resp.status
+                    etag = resp.headers.get("ETag")
+                    lastModified = resp.headers.get("Last-Modified")
+                    data = await resp.read() if status == 200 else None
+            except Exception as e:
+                self.logger.error(f"Impossible de charger l'image {url} ({e}) !")
+                return
+
+            if status == 304:
+                self.counts["inchangees"] += 1
+                self.logger.debug(f"Image {url} inchangée !")
+                await self.touch(url)
+                return
+
+            if status >= 500:
+                self.logger.error(f"Impossible de charger l'image {url} (HTTP {status}) !")
+                return
+
+            self.counts["telechargees"] += 1
+            self.logger.info(f"Image {url} chargée !")
+
+            image = None
+            contentHash = None
+            encoded = False
+
+            if data:
+                loop = asyncio.get_running_loop()
+
+                try:
+                    if self.store:
+                        contentHash, encoded = await loop.run_in_executor(executor, storeImage, data, self.store)
+                    else:
+                        image = await loop.run_in_executor(executor, encodeImage, data)
+                except Exception as e:
+                    self.logger.error(f"Impossible de charger l'image {url} ({e}) !")
+            else:
+                self.logger.error(f"Impossible de charger l'image {url} (HTTP {status}) !")
+
+        await self.save(url, image, contentHash, etag, lastModified)
+
+        if contentHash and known and known["content_hash"] == contentHash:
+            self.logger.debug(f"Image {url} inchangée ({contentHash}) !")
+        elif contentHash:
+            self.logger.info(
+                f"Image {url} enregistrée ({contentHash}{'' if encoded else ', déjà présente dans le stockage'}) !"
+            )
+        elif image:
+            self.logger.info(f"Image {url} enregistrée !")
+
+    async def touch(self, url: str) -> None:
+        """
+        Met à jour la date de vérification d'une image inchangée.
+
+        :param url: L'URL de l'image
+        :type url: str
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            await connection.execute(
+                """
+                    UPDATE RESTAURANT_IMAGE
+                    SET DERNIERE_MODIFICATION = $2
+                    WHERE IMAGE_URL = $1
+                """,
+                url,
+                datetime.now(),
+            )
+
+    async def save(
+        self,
+        url: str,
+        image: bytes | None,
+        contentHash: str | None,
+        etag: str | None,
+        lastModified: str | None,
+    ) -> None:
+        """
+        Enregistre une image et ses validateurs.
+
+        :param url: L'URL de l'image
+        :type url: str
+        :param image: L'image au format JPEG, sans stockage des images
+        :type image: bytes | None
+        :param contentHash: Le hash du contenu de l'image, avec le stockage des images
+        :type contentHash: str | None
+        :param etag: L'en-tête ``ETag`` de la réponse
+        :type etag: str | None
+        :param lastModified: L'en-tête ``Last-Modified`` de la réponse
+        :type lastModified: str | None
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            if image is None and contentHash is None:
+                # Enregistre l'image sans le contenu brut si l'image n'est pas valide
+                await connection.execute(
+                    """
+                        INSERT INTO RESTAURANT_IMAGE (
+                            IMAGE_URL, RAW_IMAGE, DERNIERE_MODIFICATION
+                        )
+                        VALUES (
+                            $1, NULL, $2
+                        )
+                        ON CONFLICT (IMAGE_URL) DO UPDATE SET
+                            DERNIERE_MODIFICATION = $2
+                    """,
+                    url,
+                    datetime.now(),
+                )
+
+                return
+
+            await connection.execute(
+                """
+                    INSERT INTO RESTAURANT_IMAGE (
+                        IMAGE_URL, RAW_IMAGE, CONTENT_HASH, DERNIERE_MODIFICATION, ETAG, LAST_MODIFIED
+                    )
+                    VALUES (
+                        $1, $2, $3, $4, $5, $6
+                    )
+                    ON CONFLICT (IMAGE_URL) DO UPDATE SET
+                        RAW_IMAGE = $2,
+                        CONTENT_HASH = $3,
+                        DERNIERE_MODIFICATION = $4,
+                        ETAG = $5,
+                        LAST_MODIFIED = $6
+                """,
+                url,
+                image,
+                contentHash,
+                datetime.now(),
+                etag,
+                lastModified,
+            )
@@ -0,0 +1,547 @@
+"""
+Migration en ligne de l'arbre des menus vers le schéma co-partitionné.
+
+Dans schema.sql, MENU, REPAS, CATEGORIE et COMPOSITION sont partitionnées par HASH sur leur
+propre clé primaire : une jointure sur l'arbre d'un restaurant parcourt les 30 partitions de
+chaque table. Le schéma co-partitionné partitionne les quatre tables par HASH(RID), avec le
+même nombre de partitions, et des clés primaires et étrangères préfixées par RID : toutes les
+requêtes du worker (qui filtrent sur RID) ne lisent qu'une partition par table, et PostgreSQL
+peut joindre les tables partition par partition (``enable_partitionwise_join``).
+
+La migration se fait sans arrêter le worker :
+
+1. ``prepare`` : crée les tables co-partitionnées (suffixe ``_COPART``) et des déclencheurs qui
+   notent les restaurants dont l'arbre est modifié pendant la migration (table LAYOUT_RID) ;
+2. ``copy`` : copie l'arbre de chaque restaurant, par lots, chaque lot dans sa propre transaction ;
+3. ``catchup`` : recopie les restaurants modifiés depuis leur copie, jusqu'à ce qu'il n'en reste plus ;
+4. ``swap`` : dans une seule transaction courte, verrouille les tables, recopie les derniers
+   restaurants modifiés et échange les tables (les anciennes sont renommées avec le suffixe ``_ANCIEN``) ;
+5. ``drop`` : supprime les anciennes tables, une fois le nouveau schéma validé.
+
+Utilisation (depuis la racine du projet) :
+
+    python -m CROUStillant.layout status|prepare|copy|catchup|swap|drop
+"""
+
+import asyncio
+import sys
+
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection, create_pool
+from os import environ
+from dotenv import load_dotenv
+
+
+# Tables de l'arbre des menus, parents avant enfants
+TABLES = ["MENU", "REPAS", "CATEGORIE", "COMPOSITION"]
+
+# Vues qui lisent ces tables : elles les référencent par leur OID, et sont recréées après l'échange
+VIEWS = ["v_stats_estimation", "v_menus", "v_repas", "v_categories", "v_compositions"]
+
+PARTITIONS = 30
+
+
+def copartitionedTables(rpidSequence: str, catidSequence: str) -> str:
+    """
+    Génère la définition des tables co-partitionnées.
+
+    :param rpidSequence: La séquence des identifiants des repas (partagée avec l'ancienne table)
+    :type rpidSequence: str
+    :param catidSequence: La séquence des identifiants des catégories (partagée avec l'ancienne table)
+    :type catidSequence: str
+    :return: Les requêtes de création des tables, de leurs partitions et de leurs index
+    :rtype: str
+    """
+    tables = f"""
+        CREATE TABLE MENU_COPART(
+            MID INT NOT NULL,
+            DATE DATE,
+            RID INT NOT NULL,
+            MENU_HASH VARCHAR(64),
+            INGESTION_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            LAST_CHECKED TIMESTAMP,
+            CONSTRAINT PK_MENU_COPART PRIMARY KEY (RID, MID),
+            CONSTRAINT FK_MENU_COPART_RESTAURANT FOREIGN KEY (RID) REFERENCES RESTAURANT (RID)
+        ) PARTITION BY HASH(RID);
+
+        CREATE TABLE REPAS_COPART(
+            RPID INT NOT NULL DEFAULT nextval('{rpidSequence}'),
+            TPR VARCHAR(10),
+            MID INT,
+            RID INT NOT NULL,
+            REPAS_HASH VARCHAR(64),
+            CONSTRAINT PK_REPAS_COPART PRIMARY KEY (RID, RPID),
+            CONSTRAINT FK_REPAS_COPART_MENU FOREIGN KEY (RID, MID) REFERENCES MENU_COPART (RID, MID),
+            CONSTRAINT CK_REPAS_COPART_TPR CHECK (TPR IN ('matin', 'midi', 'soir'))
+        ) PARTITION BY HASH(RID);
+
+        CREATE TABLE CATEGORIE_COPART(
+            CATID INT NOT NULL DEFAULT nextval('{catidSequence}'),
+            TPCAT VARCHAR(500),
+            ORDRE INT,
+            RPID INT,
+            RID INT NOT NULL,
+            CATEGORIE_HASH VARCHAR(64),
+            CONSTRAINT PK_CATEGORIE_COPART PRIMARY KEY (RID, CATID),
+            CONSTRAINT FK_CATEGORIE_COPART_REPAS FOREIGN KEY (RID, RPID) REFERENCES REPAS_COPART (RID, RPID)
+        ) PARTITION BY HASH(RID);
+
+        CREATE TABLE COMPOSITION_COPART(
+            CATID INT NOT NULL,
+            RID INT NOT NULL,
+            ORDRE INT,
+            PLATID INT NOT NULL,
+            CONSTRAINT PK_COMPOSITION_COPART PRIMARY KEY (RID, CATID, PLATID),
+            CONSTRAINT FK_COMPOSITION_COPART_CATEGORIE FOREIGN KEY (RID, CATID) REFERENCES CATEGORIE_COPART (RID, CATID),
+            CONSTRAINT FK_COMPOSITION_COPART_PLAT FOREIGN KEY (PLATID) REFERENCES PLAT (PLATID)
+        ) PARTITION BY HASH(RID);
+    """
+
+    partitions = "\n".join(
+        f"CREATE TABLE {table.lower()}_copart_partition_{i} PARTITION OF {table}_COPART "
+        f"FOR VALUES WITH (modulus {PARTITIONS}, remainder {i});"
+        for table in TABLES
+        for i in range(PARTITIONS)
+    )
+
+    indexes = """
+        CREATE INDEX idx_menu_copart_rid_date ON MENU_COPART (RID, DATE);
+        CREATE INDEX idx_menu_copart_date ON MENU_COPART (DATE);
+        CREATE INDEX idx_repas_copart_rid_mid ON REPAS_COPART (RID, MID);
+        CREATE INDEX idx_repas_copart_tpr ON REPAS_COPART (TPR);
+        CREATE INDEX idx_categorie_copart_rid_rpid ON CATEGORIE_COPART (RID, RPID);
+        CREATE INDEX idx_categorie_copart_tpcat ON CATEGORIE_COPART (TPCAT);
+        CREATE INDEX idx_composition_copart_platid ON COMPOSITION_COPART (PLATID);
+    """
+
+    return tables + partitions + indexes
+
+
+# Journal des restaurants dont l'arbre a été modifié depuis sa copie
+CHANGE_LOG = """
+    CREATE TABLE IF NOT EXISTS LAYOUT_RID(
+        RID INT PRIMARY KEY
+    );
+
+    CREATE OR REPLACE FUNCTION log_layout_change()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO LAYOUT_RID (RID)
+            SELECT DISTINCT RID FROM anciennes WHERE RID IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        ELSIF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'menu' THEN
+            -- LAST_CHECKED est mis à jour à chaque cycle : seul un changement de hash compte
+            INSERT INTO LAYOUT_RID (RID)
+            SELECT DISTINCT N.RID
+            FROM nouvelles N
+            JOIN anciennes A ON A.MID = N.MID
+            WHERE A.MENU_HASH IS DISTINCT FROM N.MENU_HASH
+            ON CONFLICT DO NOTHING;
+        ELSE
+            INSERT INTO LAYOUT_RID (RID)
+            SELECT DISTINCT RID FROM nouvelles WHERE RID IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def changeLogTriggers() -> str:
+    """
+    Génère les déclencheurs qui alimentent le journal LAYOUT_RID sur les tables actuelles.
+
+    :return: Les requêtes de création des déclencheurs
+    :rtype: str
+    """
+    triggers = []
+
+    for table in TABLES:
+        triggers.append(
+            f"""
+                CREATE OR REPLACE TRIGGER logLayoutInsert
+                AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS nouvelles
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION log_layout_change();
+
+                CREATE OR REPLACE TRIGGER logLayoutDelete
+                AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS anciennes
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION log_layout_change();
+            """
+        )
+
+    for table in ["MENU", "REPAS"]:
+        triggers.append(
+            f"""
+                CREATE OR REPLACE TRIGGER logLayoutUpdate
+                AFTER UPDATE ON {table}
+                REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION log_layout_change();
+            """
+        )
+
+    return "\n".join(triggers)
+
+
+def countTriggers(table: str) -> str:
+    """
+    Génère les déclencheurs des compteurs de lignes (voir ``count_rows`` dans schema.sql).
+
+    :param table: La table
+    :type table: str
+    :return: Les requêtes de création des déclencheurs
+    :rtype: str
+    """
+    return f"""
+        CREATE OR REPLACE TRIGGER countRowsInsert
+        AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS nouvelles
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION count_rows();
+
+        CREATE OR REPLACE TRIGGER countRowsDelete
+        AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS anciennes
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION count_rows();
+    """
+
+
+async def isCopartitioned(connection: Connection) -> bool:
+    """
+    Indique si l'arbre des menus utilise le schéma co-partitionné (MENU partitionnée par RID).
+
+    :param connection: La connexion à la base de données
+    :type connection: Connection
+    :return: ``True`` si le schéma est co-partitionné
+    :rtype: bool
+    """
+    key = await connection.fetchval("SELECT pg_get_partkeydef('menu'::regclass)")
+
+    return key is not None and "rid" in key.lower()
+
+
+class LayoutMigration:
+    """
+    Migration en ligne de l'arbre des menus vers le schéma co-partitionné (voir le module).
+    """
+
+    def __init__(self, logger: Logger, pool: Pool, batch: int = 20, lockTimeout: float = 10.0) -> None:
+        """
+        Constructeur de la classe LayoutMigration.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param batch: Le nombre de restaurants copiés par transaction
+        :type batch: int
+        :param lockTimeout: Le temps d'attente maximal des verrous lors de l'échange des tables (secondes)
+        :type lockTimeout: float
+        """
+        self.logger = logger
+        self.pool = pool
+        self.batch = batch
+        self.lockTimeout = lockTimeout
+
+    async def status(self) -> None:
+        """
+        Journalise l'état de la migration.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            copartitioned = await isCopartitioned(connection)
+            prepared = await connection.fetchval("SELECT to_regclass('menu_copart') IS NOT NULL")
+            pending = await connection.fetchval(
+                "SELECT CASE WHEN to_regclass('layout_rid') IS NULL THEN NULL ELSE (SELECT COUNT(*) FROM LAYOUT_RID) END"
+            )
+            old = await connection.fetchval("SELECT to_regclass('menu_ancien') IS NOT NULL")
+
+        self.logger.info(
+            f"Schéma {'co-partitionné' if copartitioned else 'partitionné par clé primaire'}, "
+            f"tables co-partitionnées {'créées' if prepared else 'absentes'}, "
+            f"{pending if pending is not None else 'aucun'} restaurants à recopier, "
+            f"anciennes tables {'présentes' if old else 'absentes'}."
+        )
+
+    async def prepare(self) -> None:
+        """
+        Crée les tables co-partitionnées et le journal des restaurants modifiés.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            if await isCopartitioned(connection):
+                raise RuntimeError("Le schéma est déjà co-partitionné !")
+
+            rpidSequence = await connection.fetchval("SELECT pg_get_serial_sequence('repas', 'rpid')")
+            catidSequence = await connection.fetchval("SELECT pg_get_serial_sequence('categorie', 'catid')")
+
+            async with connection.transaction():
+                await connection.execute(copartitionedTables(rpidSequence, catidSequence))
+                await connection.execute(CHANGE_LOG)
+                await connection.execute(changeLogTriggers())
+
+        self.logger.info("Tables co-partitionnées créées, modifications journalisées !")
+
+    async def copyRestaurants(self, connection: Connection, rids: list[int]) -> None:
+        """
+        Copie (ou recopie) l'arbre des menus de quelques restaurants dans les tables co-partitionnées.
+        Le RID est toujours lu dans MENU, en suivant les index de l'ancien schéma.
+
+        Le journal LAYOUT_RID n'est pas modifié ici : voir ``copyBatch``.
+
+        :param connection: La connexion à la base de données, dans une transaction
+        :type connection: Connection
+        :param rids: Les restaurants
+        :type rids: list[int]
+        """
+        for table in reversed(TABLES):
+            await connection.execute(f"DELETE FROM {table}_COPART WHERE RID = ANY($1::int[])", rids)
+
+        await connection.execute(
+            """
+                INSERT INTO MENU_COPART (MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED)
+                SELECT M.MID, M.DATE, M.RID, M.MENU_HASH, M.INGESTION_AT, M.LAST_CHECKED
+                FROM MENU M
+                WHERE M.RID = ANY($1::int[])
+            """,
+            rids,
+        )
+
+        await connection.execute(
+            """
+                INSERT INTO REPAS_COPART (RPID, TPR, MID, RID, REPAS_HASH)
+                SELECT R.RPID, R.TPR, R.MID, M.RID, R.REPAS_HASH
+                FROM MENU M
+                JOIN REPAS R ON R.MID = M.MID
+                WHERE M.RID = ANY($1::int[])
+            """,
+            rids,
+        )
+
+        await connection.execute(
+            """
+                INSERT INTO CATEGORIE_COPART (CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH)
+                SELECT C.CATID, C.TPCAT, C.ORDRE, C.RPID, M.RID, C.CATEGORIE_HASH
+                FROM MENU M
+                JOIN REPAS R ON R.MID = M.MID
+                JOIN CATEGORIE C ON C.RPID = R.RPID
+                WHERE M.RID = ANY($1::int[])
+            """,
+            rids,
+        )
+
+        await connection.execute(
+            """
+                INSERT INTO COMPOSITION_COPART (CATID, RID, ORDRE, PLATID)
+                SELECT CO.CATID, M.RID, CO.ORDRE, CO.PLATID
+                FROM MENU M
+                JOIN REPAS R ON R.MID = M.MID
+                JOIN CATEGORIE C ON C.RPID = R.RPID
+                JOIN COMPOSITION CO ON CO.CATID = C.CATID
+                WHERE M.RID = ANY($1::int[])
+            """,
+            rids,
+        )
+
+    async def copyBatch(self, connection: Connection, rids: list[int]) -> None:
+        """
+        Retire quelques restaurants du journal, puis copie leur arbre dans sa propre transaction.
+
+        Le journal est vidé dans une transaction validée avant l'instantané de la copie : une
+        modification validée après le début de la copie (donc absente de l'instantané) note de
+        nouveau le restaurant dans le journal, qui sera recopié. Vider le journal dans la
+        transaction de la copie effacerait cette note (``ON CONFLICT DO NOTHING`` sur une ligne
+        encore présente), et la modification serait perdue. Si la copie échoue, les restaurants
+        sont remis dans le journal.
+
+        :param connection: La connexion à la base de données, hors transaction
+        :type connection: Connection
+        :param rids: Les restaurants
+        :type rids: list[int]
+        """
+        await connection.execute("DELETE FROM LAYOUT_RID WHERE RID = ANY($1::int[])", rids)
+
+        try:
+            async with connection.transaction(isolation="repeatable_read"):
+                await self.copyRestaurants(connection, rids)
+        except BaseException:
+            await connection.execute(
+                "INSERT INTO LAYOUT_RID (RID) SELECT UNNEST($1::int[]) ON CONFLICT DO NOTHING", rids
+            )
+            raise
+
+    async def copy(self) -> None:
+        """
+        Copie l'arbre des menus de tous les restaurants, par lots. Chaque lot est copié dans sa
+        propre transaction (instantané cohérent) : le worker peut continuer à écrire, les
+        restaurants qu'il modifie sont notés dans le journal et recopiés par ``catchup``.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            rids = [row["rid"] for row in await connection.fetch("SELECT RID FROM RESTAURANT ORDER BY RID")]
+
+            for i in range(0, len(rids), self.batch):
+                await self.copyBatch(connection, rids[i:i + self.batch])
+
+                self.logger.info(f"{min(i + self.batch, len(rids))}/{len(rids)} restaurants copiés...")
+
+        self.logger.info("Arbre des menus copié !")
+
+    async def catchup(self, threshold: int = 0) -> int:
+        """
+        Recopie les restaurants modifiés depuis leur copie, jusqu'à ce qu'il en reste au plus ``threshold``.
+
+        :param threshold: Le nombre de restaurants restants à partir duquel s'arrêter
+        :type threshold: int
+        :return: Le nombre de restaurants recopiés
+        :rtype: int
+        """
+        copied = 0
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            while await connection.fetchval("SELECT COUNT(*) FROM LAYOUT_RID") > threshold:
+                rids = [
+                    row["rid"]
+                    for row in await connection.fetch("SELECT RID FROM LAYOUT_RID ORDER BY RID LIMIT $1", self.batch)
+                ]
+
+                await self.copyBatch(connection, rids)
+
+                copied += len(rids)
+
+        self.logger.info(f"{copied} restaurants recopiés !")
+
+        return copied
+
+    async def swap(self) -> None:
+        """
+        Échange les tables, dans une seule transaction : verrouillage des tables actuelles
+        (les écritures du worker attendent), copie des derniers restaurants modifiés, puis
+        renommage. Les séquences des identifiants et les déclencheurs des compteurs sont repris
+        par les nouvelles tables.
+        """
+        # Réduit la copie à faire sous verrou
+        await self.catchup(self.batch)
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                await connection.execute(f"SET LOCAL lock_timeout = '{int(self.lockTimeout * 1000)}ms'")
+                await connection.execute(
+                    f"LOCK TABLE {', '.join(TABLES)} IN ACCESS EXCLUSIVE MODE"
+                )
+
+                # Les tables sont verrouillées : aucune modification ne peut être notée pendant la copie
+                rids = [row["rid"] for row in await connection.fetch("DELETE FROM LAYOUT_RID RETURNING RID")]
+
+                if rids:
+                    await self.copyRestaurants(connection, rids)
+
+                rpidSequence = await connection.fetchval("SELECT pg_get_serial_sequence('repas', 'rpid')")
+                catidSequence = await connection.fetchval("SELECT pg_get_serial_sequence('categorie', 'catid')")
+
+                views = {
+                    view: await connection.fetchval("SELECT pg_get_viewdef(to_regclass($1))", view)
+                    for view in VIEWS
+                }
+
+                for table in TABLES:
+                    await connection.execute(
+                        f"""
+                            DROP TRIGGER IF EXISTS logLayoutInsert ON {table};
+                            DROP TRIGGER IF EXISTS logLayoutDelete ON {table};
+                            DROP TRIGGER IF EXISTS logLayoutUpdate ON {table};
+                            ALTER TABLE {table} RENAME TO {table}_ANCIEN;
+                            ALTER TABLE {table}_COPART RENAME TO {table};
+                        """
+                    )
+                    await connection.execute(countTriggers(table))
+
+                # Les séquences suivent les nouvelles tables (et ne sont pas supprimées avec les anciennes)
+                await connection.execute(
+                    f"""
+                        ALTER SEQUENCE {rpidSequence} OWNED BY REPAS.RPID;
+                        ALTER SEQUENCE {catidSequence} OWNED BY CATEGORIE.CATID;
+                        DROP TABLE LAYOUT_RID;
+                        DROP FUNCTION log_layout_change();
+                    """
+                )
+
+                for view, definition in views.items():
+                    if definition:
+                        await connection.execute(f"CREATE OR REPLACE VIEW {view} AS {definition}")
+
+        self.logger.info(f"Tables échangées ({len(rids)} restaurants recopiés sous verrou) !")
+
+    async def drop(self) -> None:
+        """
+        Supprime les anciennes tables.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            if not await isCopartitioned(connection):
+                raise RuntimeError("Le schéma n'est pas co-partitionné, les tables actuelles ne sont pas supprimées !")
+
+            await connection.execute(
+                "DROP TABLE IF EXISTS " + ", ".join(f"{table}_ANCIEN" for table in reversed(TABLES))
+            )
+
+        self.logger.info("Anciennes tables supprimées !")
+
+
+async def main(command: str) -> None:
+    """
+    Lance une étape de la migration.
+
+    :param command: L'étape (``status``, ``prepare``, ``copy``, ``catchup``, ``swap`` ou ``drop``)
+    :type command: str
+    """
+    load_dotenv(dotenv_path="/CROUStillant/.env")
+
+    logger = Logger("layout")
+
+    pool = await create_pool(
+        database=environ["POSTGRES_DATABASE"],
+        user=environ["POSTGRES_USER"],
+        password=environ["POSTGRES_PASSWORD"],
+        host=environ["POSTGRES_HOST"],
+        port=environ["POSTGRES_PORT"],
+        min_size=1,
+        max_size=2,
+    )
+
+    migration = LayoutMigration(
+        logger=logger,
+        pool=pool,
+        batch=int(environ.get("LAYOUT_BATCH", 20)),
+    )
+
+    try:
+        await getattr(migration, command)()
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    commands = ["status", "prepare", "copy", "catchup", "swap", "drop"]
+
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        Logger("layout").error(f"Utilisation : python -m CROUStillant.layout {'|'.join(commands)}")
+        sys.exit(1)
+
+    asyncio.run(main(sys.argv[1]))
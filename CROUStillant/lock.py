@@ -0,0 +1,71 @@
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection
+
+
+class RunLock:
+    """
+    Verrou d'exécution : une seule tâche à la fois.
+
+    Le verrou est un verrou consultatif de session (``pg_try_advisory_lock``), tenu par une
+    connexion réservée pendant toute la tâche : une tâche lancée alors que la précédente n'est
+    pas terminée (par exemple par la crontab) est abandonnée au lieu de charger les mêmes
+    données en même temps. Le verrou est libéré automatiquement si le processus s'arrête.
+
+    Les workers d'une tâche répartie ne prennent pas ce verrou : ils la rejoignent tous (voir
+    ``ShardCoordinator.join``).
+    """
+
+    KEY = "croustillant.run"
+
+    def __init__(self, logger: Logger, pool: Pool) -> None:
+        """
+        Constructeur de la classe RunLock.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        """
+        self.logger = logger
+        self.pool = pool
+
+        self.connection: Connection | None = None
+
+    async def acquire(self) -> bool:
+        """
+        Prend le verrou, sans attendre.
+
+        :return: ``True`` si le verrou a été pris, ``False`` si une autre tâche est en cours
+        :rtype: bool
+        """
+        connection = await self.pool.acquire()
+
+        try:
+            acquired = await connection.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", self.KEY)
+        except Exception:
+            await self.pool.release(connection)
+            raise
+
+        if not acquired:
+            await self.pool.release(connection)
+
+            self.logger.warning("Une autre tâche est en cours : tâche abandonnée !")
+
+            return False
+
+        self.connection = connection
+
+        return True
+
+    async def release(self) -> None:
+        """
+        Libère le verrou.
+        """
+        if self.connection is None:
+            return
+
+        try:
+            await self.connection.execute("SELECT pg_advisory_unlock(hashtext($1))", self.KEY)
+        finally:
+            await self.pool.release(self.connection)
+            self.connection = None
@@ -0,0 +1,348 @@
+from CrousPy import Menu
+from CROUStillant.logger import Logger
+from CROUStillant.encoding import HASH_MODES, encodeString, encodeCategory
+from asyncpg import Connection
+from collections import Counter
+from typing import Iterable
+
+
+# Longueur maximale d'un nom de plat (PLAT.LIBELLE est un VARCHAR(500))
+MAX_DISH_LENGTH = 498
+
+
+def isStorableDish(name: str) -> bool:
+    """
+    Vérifie, sans journaliser, qu'un plat peut être enregistré dans la base de données.
+
+    :param name: Le nom du plat
+    :type name: str
+    :return: ``True`` si le plat est valide
+    :rtype: bool
+    """
+    return len(name) <= MAX_DISH_LENGTH and bool(name.strip())
+
+
+def isValidDish(logger: Logger, name: str, debug: str) -> bool:
+    """
+    Vérifie qu'un plat peut être enregistré dans la base de données.
+
+    :param logger: Le logger
+    :type logger: Logger
+    :param name: Le nom du plat
+    :type name: str
+    :param debug: Les informations de débogage à ajouter aux logs (ex: "RID: 1, RPID: 2")
+    :type debug: str
+    :return: ``True`` si le plat est valide, ``False`` s'il doit être ignoré
+    :rtype: bool
+    """
+    # Vérifie la longueur du nom du plat pour éviter les erreurs de dépassement de capacité de la base de données
+    if len(name) > MAX_DISH_LENGTH:
+        logger.critical(
+            f"Le plat '{name}' est trop long ({len(name)} caractères). Debug: [{debug}]"
+        )
+        return False
+
+    if not name.strip():
+        logger.critical(
+            f"Le plat a un nom vide. Debug: [{debug}]"
+        )
+        return False
+
+    return True
+
+
+def dishNames(trees: list["MenuTree"]) -> set[str]:
+    """
+    Récupère les noms des plats valides de plusieurs menus, sans les journaliser.
+
+    :param trees: Les arbres des menus
+    :type trees: list[MenuTree]
+    :return: Les noms des plats
+    :rtype: set[str]
+    """
+    return {
+        dish
+        for tree in trees
+        for meal in tree.meals
+        for category in meal.categories
+        for dish in category.dishes
+        if isStorableDish(dish)
+    }
+
+
+def rowCount(status: str) -> int:
+    """
+    Récupère le nombre de lignes touchées à partir du statut d'une commande (ex: "DELETE 12").
+
+    :param status: Le statut renvoyé par ``Connection.execute``
+    :type status: str
+    :return: Le nombre de lignes
+    :rtype: int
+    """
+    return int(status.rsplit(" ", 1)[-1])
+
+
+def countRows(rows: Counter, written: int, plans: Iterable["MenuPlan"]) -> None:
+    """
+    Comptabilise les lignes écrites pour des menus modifiés (``ecrites``), et celles qu'une
+    réécriture complète de ces menus aurait écrites (``reecriture``).
+
+    :param rows: Les compteurs de lignes
+    :type rows: Counter
+    :param written: Le nombre de lignes écrites (supprimées, mises à jour et insérées)
+    :type written: int
+    :param plans: Les modifications apportées aux menus
+    :type plans: Iterable[MenuPlan]
+    """
+    rows["ecrites"] += written
+    # Une réécriture complète aurait aussi supprimé puis recréé les repas mis à jour et les lignes conservées
+    rows["reecriture"] += written + sum(len(plan.updateRepas) + 2 * plan.kept for plan in plans)
+
+
+class CategoryNode:
+    """
+    Catégorie d'un repas, avec le hash de son contenu (nom et plats).
+    """
+
+    def __init__(self, name: str, ordre: int, dishes: list[str], hash: str) -> None:
+        """
+        Constructeur de la classe CategoryNode.
+
+        :param name: Le nom de la catégorie
+        :type name: str
+        :param ordre: La position de la catégorie dans le repas
+        :type ordre: int
+        :param dishes: Les noms des plats
+        :type dishes: list[str]
+        :param hash: Le hash de la catégorie
+        :type hash: str
+        """
+        self.name = name
+        self.ordre = ordre
+        self.dishes = dishes
+        self.hash = hash
+
+    @property
+    def rows(self) -> int:
+        """
+        Lignes écrites pour cette catégorie : la catégorie et ses compositions (uniques par plat).
+        Calculé à la demande, uniquement pour les menus modifiés.
+
+        :return: Le nombre de lignes
+        :rtype: int
+        """
+        return 1 + len({dish for dish in self.dishes if isStorableDish(dish)})
+
+
+class MealNode:
+    """
+    Repas d'un menu, avec le hash de son contenu (nom et catégories).
+    """
+
+    def __init__(self, name: str, categories: list[CategoryNode], hash: str) -> None:
+        """
+        Constructeur de la classe MealNode.
+
+        :param name: Le type de repas (matin, midi, soir)
+        :type name: str
+        :param categories: Les catégories du repas
+        :type categories: list[CategoryNode]
+        :param hash: Le hash du repas
+        :type hash: str
+        """
+        self.name = name
+        self.categories = categories
+        self.hash = hash
+
+    @property
+    def rows(self) -> int:
+        """
+        Lignes écrites pour ce repas : le repas et ses catégories.
+
+        :return: Le nombre de lignes
+        :rtype: int
+        """
+        return 1 + sum(category.rows for category in self.categories)
+
+
+class MenuTree:
+    """
+    Arbre de hash d'un menu : un hash par catégorie, par repas et pour le menu entier.
+
+    Chaque hash porte sur la forme JSON canonique du nœud (clés triées, séparateurs par défaut,
+    sans échappement ASCII) : ``{"date": ..., "meals": [{"categories": [{"dishes": [...],
+    "name": ...}], "name": ...}]}``. Cette forme est produite en un seul parcours du menu et
+    envoyée directement aux fonctions de hash des trois niveaux, sans dictionnaire ni
+    ``json.dumps`` intermédiaire.
+
+    En mode ``compat``, le hash du menu est identique à celui historiquement stocké dans
+    MENU.MENU_HASH. Les hash des repas et des catégories sont stockés dans REPAS.REPAS_HASH et
+    CATEGORIE.CATEGORIE_HASH, ce qui permet de ne réécrire que les parties d'un menu modifié
+    qui ont réellement changé.
+    """
+
+    def __init__(self, menu: Menu, mode: str = "compat") -> None:
+        """
+        Constructeur de la classe MenuTree.
+
+        :param menu: Le menu
+        :type menu: Menu
+        :param mode: Le mode de hash (voir ``HASH_MODES``)
+        :type mode: str
+        """
+        new = HASH_MODES[mode]
+
+        self.menu = menu
+        self.meals: list[MealNode] = []
+
+        # Note: On n'inclut pas l'ID car on compare par ID, uniquement le contenu
+        root = new()
+        root.update(b'{"date": ' + encodeString(str(menu.date)).encode("utf-8") + b', "meals": [')
+
+        for indexMeal, meal in enumerate(menu.meals):
+            categories = []
+
+            # Chaque catégorie n'est encodée qu'une fois : ses octets servent aux hash des trois niveaux
+            parts = [b'{"categories": [']
+
+            for ordre, category in enumerate(meal.categories):
+                dishes = [dish.name for dish in category.dishes]
+                encoded = encodeCategory(category.name, dishes)
+
+                if ordre:
+                    parts.append(b", ")
+                parts.append(encoded)
+
+                categories.append(
+                    CategoryNode(category.name, ordre, dishes, new(encoded).hexdigest())
+                )
+
+            parts.append(b'], "name": ' + encodeString(meal.name).encode("utf-8") + b"}")
+
+            encoded = b"".join(parts)
+
+            if indexMeal:
+                root.update(b", ")
+            root.update(encoded)
+
+            self.meals.append(MealNode(meal.name, categories, new(encoded).hexdigest()))
+
+        root.update(b"]}")
+
+        self.hash = root.hexdigest()
+
+
+class MenuPlan:
+    """
+    Modifications à apporter à un menu modifié pour que la base de données corresponde à son arbre.
+    """
+
+    def __init__(self, rid: int, tree: MenuTree) -> None:
+        """
+        Constructeur de la classe MenuPlan.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :param tree: L'arbre du menu
+        :type tree: MenuTree
+        """
+        self.rid = rid
+        self.tree = tree
+
+        # Repas et catégories à supprimer (avec leurs compositions)
+        self.deleteRepas: list[int] = []
+        self.deleteCategories: list[int] = []
+
+        # Repas conservés dont seul le hash change
+        self.updateRepas: list[tuple[int, str]] = []
+
+        # Repas à créer, et catégories à créer dans des repas conservés
+        self.newMeals: list[MealNode] = []
+        self.newCategories: list[tuple[int, CategoryNode]] = []
+
+        # Lignes conservées telles quelles, qu'une réécriture complète aurait supprimées puis recréées
+        self.kept = 0
+
+
+async def planMenus(connection: Connection, menus: list[tuple[int, MenuTree]]) -> list[MenuPlan]:
+    """
+    Compare l'arbre de plusieurs menus modifiés avec les repas et catégories enregistrés, en une
+    seule requête, et calcule les modifications à apporter.
+
+    Un repas est associé au premier repas enregistré du même type. S'il a le même hash, il est
+    conservé entièrement ; sinon, chacune de ses catégories est associée à la catégorie enregistrée
+    à la même position, et seules celles dont le hash diffère sont recréées. Les repas et catégories
+    enregistrés sans hash sont considérés comme modifiés.
+
+    :param connection: La connexion à la base de données
+    :type connection: Connection
+    :param menus: Les menus modifiés, avec l'identifiant de leur restaurant
+    :type menus: list[tuple[int, MenuTree]]
+    :return: Les modifications à apporter, dans le même ordre
+    :rtype: list[MenuPlan]
+    """
+    rows = await connection.fetch(
+        """
+            SELECT R.MID, R.RPID, R.TPR, R.REPAS_HASH, C.CATID, C.ORDRE, C.CATEGORIE_HASH
+            FROM REPAS R
+            LEFT JOIN CATEGORIE C ON C.RID = R.RID AND C.RPID = R.RPID
+            WHERE R.RID = ANY($2::int[]) AND R.MID = ANY($1::int[])
+            ORDER BY R.RPID, C.ORDRE
+        """,
+        [tree.menu.id for _, tree in menus],
+        list({rid for rid, _ in menus}),
+    )
+
+    # MID -> RPID -> (TPR, REPAS_HASH, CATID -> (ORDRE, CATEGORIE_HASH))
+    existing: dict[int, dict[int, tuple[str, str | None, dict[int, tuple[int, str | None]]]]] = {}
+
+    for row in rows:
+        repas = existing.setdefault(row["mid"], {})
+        if row["rpid"] not in repas:
+            repas[row["rpid"]] = (row["tpr"], row["repas_hash"], {})
+
+        if row["catid"] is not None:
+            repas[row["rpid"]][2][row["catid"]] = (row["ordre"], row["categorie_hash"])
+
+    plans = []
+
+    for rid, tree in menus:
+        plan = MenuPlan(rid, tree)
+        available = existing.get(tree.menu.id, {})
+
+        for meal in tree.meals:
+            rpid = next((rpid for rpid, repas in available.items() if repas[0] == meal.name), None)
+
+            if rpid is None:
+                plan.newMeals.append(meal)
+                continue
+
+            _, repasHash, categories = available.pop(rpid)
+
+            if repasHash == meal.hash:
+                plan.kept += meal.rows
+                continue
+
+            plan.updateRepas.append((rpid, meal.hash))
+
+            for category in meal.categories:
+                catid = next((catid for catid, old in categories.items() if old[0] == category.ordre), None)
+
+                if catid is not None and categories.pop(catid)[1] == category.hash:
+                    plan.kept += category.rows
+                    continue
+
+                if catid is not None:
+                    plan.deleteCategories.append(catid)
+
+                plan.newCategories.append((rpid, category))
+
+            plan.deleteCategories.extend(categories)
+
+        for rpid, (_, _, categories) in available.items():
+            plan.deleteRepas.append(rpid)
+            plan.deleteCategories.extend(categories)
+
+        plans.append(plan)
+
+    return plans
@@ -0,0 +1,448 @@
+import os
+import re
+
+from CROUStillant.logger import Logger
+from aiohttp import web
+from asyncpg import Pool, Connection
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Iterator
+
+
+# Bornes des histogrammes de latence (secondes), comme les bornes par défaut des clients Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Table (ou fonction) visée par une requête SQL, selon son type : le premier motif reconnu l'emporte
+STATEMENTS = [
+    re.compile(r"^\s*(INSERT)\s+INTO\s+(\w+)", re.IGNORECASE),
+    re.compile(r"^\s*(UPDATE)\s+(\w+)", re.IGNORECASE),
+    re.compile(r"^\s*(DELETE)\s+FROM\s+(\w+)", re.IGNORECASE),
+    re.compile(r"^\s*(COPY)\s+(\w+)", re.IGNORECASE),
+    re.compile(r"^\s*(REFRESH)\s+MATERIALIZED\s+VIEW\s+(?:CONCURRENTLY\s+)?(\w+)", re.IGNORECASE),
+    re.compile(r"^\s*(SELECT)\b.*?\bFROM\s+(\w+)", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^\s*(SELECT)\s+(\w+)\s*\(", re.IGNORECASE),
+]
+
+
+def statementName(query: str) -> str:
+    """
+    Nomme une requête SQL par son type et la table (ou la fonction) visée, par exemple
+    ``insert menu`` ou ``select rollup_menus`` : le nombre de noms reste borné, quels que
+    soient les paramètres de la requête.
+
+    :param query: La requête SQL
+    :type query: str
+    :return: Le nom de la requête
+    :rtype: str
+    """
+    for pattern in STATEMENTS:
+        match = pattern.match(query)
+
+        if match:
+            return f"{match.group(1)} {match.group(2)}".lower()
+
+    words = query.split(maxsplit=1)
+
+    return words[0].lower() if words else "autre"
+
+
+class Histogram:
+    """
+    Histogramme cumulatif de durées, au format Prometheus (bornes ``BUCKETS``).
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructeur de la classe Histogram.
+        """
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Enregistre une durée.
+
+        :param value: La durée (secondes)
+        :type value: float
+        """
+        self.count += 1
+        self.sum += value
+
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """
+    Mesures du worker : durée de chaque phase de la tâche, latence de chaque point d'accès de
+    l'API du CROUS et de chaque requête SQL (voir ``statementName``), lignes écrites et
+    efficacité des caches (plats, empreintes des restaurants, hash des menus, images).
+
+    Les requêtes SQL sont mesurées par un journal de requêtes (``add_query_logger``) ajouté à
+    chaque connexion du pool (voir ``instrument``), les requêtes à l'API par ``CrousClient``.
+
+    Les mesures sont gardées à deux niveaux :
+
+    - par tâche, remises à zéro au début de chaque tâche (``reset``) et enregistrées dans
+      TACHE_METRIQUE (``save``) ;
+    - depuis le démarrage du processus, exposées au format Prometheus (``render``), dans un
+      fichier pour le collecteur textfile de node_exporter (``write``), ou sur un point
+      d'accès HTTP en mode démon (``serve``).
+    """
+
+    def __init__(self, logger: Logger) -> None:
+        """
+        Constructeur de la classe Metrics.
+
+        :param logger: Le logger
+        :type logger: Logger
+        """
+        self.logger = logger
+
+        # Depuis le démarrage : (famille, nom) -> histogramme ou compteur
+        self.histograms: dict[tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.counters: dict[tuple[str, str], float] = defaultdict(float)
+        self.gauges: dict[tuple[str, str], float] = {}
+
+        # Tâche en cours : (type, nom) -> [nombre, durée totale, durée maximale], et mesures déjà enregistrées
+        self.task: dict[tuple[str, str], list] = {}
+        self.saved: dict[tuple[str, str], list] = {}
+
+        self.runner: web.AppRunner | None = None
+
+    def reset(self) -> None:
+        """
+        Remet à zéro les mesures de la tâche, avant une nouvelle tâche.
+        """
+        self.task = {}
+        self.saved = {}
+
+    def record(self, kind: str, name: str, count: int = 1, elapsed: float = 0.0) -> None:
+        """
+        Enregistre une mesure de la tâche.
+
+        :param kind: Le type de mesure (``phase``, ``api``, ``sql``, ``lignes``, ``cache``)
+        :type kind: str
+        :param name: Le nom de la mesure
+        :type name: str
+        :param count: Le nombre d'occurrences
+        :type count: int
+        :param elapsed: La durée (secondes)
+        :type elapsed: float
+        """
+        entry = self.task.setdefault((kind, name), [0, 0.0, 0.0])
+        entry[0] += count
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+    def observe(self, kind: str, name: str, elapsed: float, error: bool = False) -> None:
+        """
+        Enregistre la durée d'une requête (API ou SQL).
+
+        :param kind: Le type de requête (``api`` ou ``sql``)
+        :type kind: str
+        :param name: Le point d'accès ou le nom de la requête
+        :type name: str
+        :param elapsed: La durée (secondes)
+        :type elapsed: float
+        :param error: ``True`` si la requête a échoué
+        :type error: bool
+        """
+        self.histograms[(kind, name)].observe(elapsed)
+        self.record(kind, name, 1, elapsed)
+
+        if error:
+            self.counters[(f"{kind}_errors", name)] += 1
+            self.record(f"{kind}_erreurs", name)
+
+    def count(self, kind: str, name: str, value: int) -> None:
+        """
+        Ajoute une valeur à un compteur (lignes écrites, accès à un cache).
+
+        :param kind: Le type de compteur (``lignes`` ou ``cache``)
+        :type kind: str
+        :param name: Le nom du compteur
+        :type name: str
+        :param value: La valeur ajoutée
+        :type value: int
+        """
+        if not value:
+            return
+
+        self.counters[(kind, name)] += value
+        self.record(kind, name, value)
+
+    def cache(self, name: str, hits: int, misses: int) -> None:
+        """
+        Enregistre les accès à un cache.
+
+        :param name: Le nom du cache
+        :type name: str
+        :param hits: Le nombre d'accès trouvés dans le cache
+        :type hits: int
+        :param misses: Le nombre d'accès absents du cache
+        :type misses: int
+        """
+        self.count("cache", f"{name}:hit", hits)
+        self.count("cache", f"{name}:miss", misses)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Mesure la durée d'une phase de la tâche (bloc ``with``, y compris autour de code asynchrone).
+
+        :param name: Le nom de la phase
+        :type name: str
+        """
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+
+            self.gauges[("phase", name)] = elapsed
+            self.record("phase", name, 1, elapsed)
+
+    def stages(self, stats: dict[str, dict]) -> None:
+        """
+        Enregistre le temps de traitement et le nombre d'éléments traités de chaque étape d'un pipeline.
+
+        :param stats: Les compteurs du pipeline, par étape (voir ``Pipeline.stats``)
+        :type stats: dict[str, dict]
+        """
+        for name, stage in stats.items():
+            self.record("etape", name, stage["processed"], stage["busy"])
+            self.gauges[("etape", name)] = self.task[("etape", name)][1]
+
+    async def instrument(self, connection: Connection) -> None:
+        """
+        Ajoute le journal de requêtes à une connexion (paramètre ``init`` de ``create_pool``).
+
+        :param connection: La connexion
+        :type connection: Connection
+        """
+        connection.add_query_logger(self.logQuery)
+
+    def logQuery(self, query) -> None:
+        """
+        Journal de requêtes : enregistre la durée d'une requête SQL.
+
+        :param query: La requête exécutée
+        :type query: LoggedQuery
+        """
+        self.observe("sql", statementName(query.query), query.elapsed, query.exception is not None)
+
+    def summary(self) -> None:
+        """
+        Journalise les phases de la tâche et les requêtes SQL les plus coûteuses.
+        """
+        phases = [(name, entry) for (kind, name), entry in self.task.items() if kind == "phase"]
+
+        if phases:
+            self.logger.info(
+                "Phases : " + ", ".join(f"{name} {entry[1]:.1f}s" for name, entry in phases)
+            )
+
+        statements = sorted(
+            ((name, entry) for (kind, name), entry in self.task.items() if kind == "sql"),
+            key=lambda item: item[1][1],
+            reverse=True,
+        )
+
+        for name, (count, total, maximum) in statements[:10]:
+            self.logger.info(
+                f"SQL {name} : {count:,d} requêtes, {total:.2f}s au total, "
+                f"moyenne {total / count * 1000:.1f} ms, max {maximum * 1000:.0f} ms"
+            )
+
+    async def save(self, pool: Pool, taskId: int) -> None:
+        """
+        Enregistre les mesures de la tâche dans TACHE_METRIQUE. Un nouvel enregistrement n'ajoute
+        que les mesures prises depuis le précédent. Les mesures des workers d'une tâche répartie
+        sont additionnées. Un enregistrement qui échoue est journalisé, et repris par le suivant
+        avec l'écart cumulé depuis le dernier enregistrement réussi.
+
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param taskId: L'identifiant de la tâche
+        :type taskId: int
+        """
+        # Instantané pris avant l'enregistrement : les mesures prises pendant (dont la requête
+        # d'enregistrement elle-même) seront enregistrées la fois suivante
+        snapshot = {key: list(entry) for key, entry in self.task.items()}
+        deltas = {}
+
+        for key, (count, total, maximum) in snapshot.items():
+            saved = self.saved.get(key, [0, 0.0, 0.0])
+
+            if count != saved[0] or total != saved[1]:
+                deltas[key] = (count - saved[0], total - saved[1], maximum)
+
+        if deltas:
+            keys = list(deltas)
+
+            try:
+                async with pool.acquire() as connection:
+                    connection: Connection
+
+                    await connection.execute(
+                        """
+                            INSERT INTO TACHE_METRIQUE (IDTACHE, TYPE, NOM, NOMBRE, DUREE, MAXIMUM)
+                            SELECT $1, U.TYPE, U.NOM, U.NOMBRE, U.DUREE, U.MAXIMUM
+                            FROM unnest($2::varchar[], $3::varchar[], $4::bigint[], $5::float[], $6::float[])
+                                AS U(TYPE, NOM, NOMBRE, DUREE, MAXIMUM)
+                            ON CONFLICT (IDTACHE, TYPE, NOM) DO UPDATE SET
+                                NOMBRE = TACHE_METRIQUE.NOMBRE + EXCLUDED.NOMBRE,
+                                DUREE = TACHE_METRIQUE.DUREE + EXCLUDED.DUREE,
+                                MAXIMUM = GREATEST(TACHE_METRIQUE.MAXIMUM, EXCLUDED.MAXIMUM)
+                        """,
+                        taskId,
+                        [kind for kind, _ in keys],
+                        [name[:100] for _, name in keys],
+                        [deltas[key][0] for key in keys],
+                        [deltas[key][1] for key in keys],
+                        [deltas[key][2] for key in keys],
+                    )
+
+                # En cas d'échec, ``saved`` n'est pas modifié : l'écart sera repris par l'enregistrement suivant
+                self.saved = snapshot
+            except Exception as e:
+                self.logger.error(f"Impossible d'enregistrer les mesures de la tâche : {e}")
+
+    def render(self) -> str:
+        """
+        Exporte les mesures au format texte de Prometheus.
+
+        :return: Les mesures
+        :rtype: str
+        """
+        lines = []
+
+        def label(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"')
+
+        histograms = {
+            "api": ("croustillant_api_request_duration_seconds", "endpoint", "Durée des requêtes à l'API du CROUS"),
+            "sql": ("croustillant_sql_query_duration_seconds", "statement", "Durée des requêtes SQL"),
+        }
+
+        for kind, (metric, key, help) in histograms.items():
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} histogram"]
+
+            for (family, name), histogram in sorted(self.histograms.items()):
+                if family != kind:
+                    continue
+
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f'{metric}_bucket{{{key}="{label(name)}",le="{bound}"}} {count}')
+
+                lines.append(f'{metric}_bucket{{{key}="{label(name)}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{key}="{label(name)}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{{key}="{label(name)}"}} {histogram.count}')
+
+        counters = {
+            "api_errors": ("croustillant_api_errors_total", "endpoint", "Requêtes à l'API du CROUS en échec"),
+            "sql_errors": ("croustillant_sql_errors_total", "statement", "Requêtes SQL en échec"),
+            "lignes": ("croustillant_rows_total", "kind", "Lignes écrites et restaurants traités, par type"),
+        }
+
+        for kind, (metric, key, help) in counters.items():
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+
+            for (family, name), value in sorted(self.counters.items()):
+                if family == kind:
+                    lines.append(f'{metric}{{{key}="{label(name)}"}} {value}')
+
+        metric = "croustillant_cache_lookups_total"
+        lines += [f"# HELP {metric} Accès aux caches (plats, restaurants, menus, images)", f"# TYPE {metric} counter"]
+
+        for (family, name), value in sorted(self.counters.items()):
+            if family == "cache":
+                cache, result = name.rsplit(":", 1)
+                lines.append(f'{metric}{{cache="{label(cache)}",result="{result}"}} {value}')
+
+        gauges = {
+            "phase": ("croustillant_phase_duration_seconds", "phase", "Durée de chaque phase de la dernière tâche"),
+            "etape": ("croustillant_pipeline_busy_seconds", "stage", "Temps de traitement de chaque étape du pipeline, dernière tâche"),
+        }
+
+        for kind, (metric, key, help) in gauges.items():
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} gauge"]
+
+            for (family, name), value in sorted(self.gauges.items()):
+                if family == kind:
+                    lines.append(f'{metric}{{{key}="{label(name)}"}} {value}')
+
+        task = {
+            "id": ("croustillant_last_task_id", "Identifiant de la dernière tâche"),
+            "fin": ("croustillant_last_task_end_timestamp_seconds", "Fin de la dernière tâche"),
+            "duree": ("croustillant_last_task_duration_seconds", "Durée de la dernière tâche"),
+        }
+
+        for name, (metric, help) in task.items():
+            if ("tache", name) in self.gauges:
+                lines += [f"# HELP {metric} {help}", f"# TYPE {metric} gauge", f"{metric} {self.gauges[('tache', name)]}"]
+
+        return "\n".join(lines) + "\n"
+
+    def finish(self, taskId: int, elapsed: float) -> None:
+        """
+        Enregistre la fin d'une tâche (identifiant, fin et durée), pour l'export Prometheus.
+
+        :param taskId: L'identifiant de la tâche
+        :type taskId: int
+        :param elapsed: La durée de la tâche (secondes)
+        :type elapsed: float
+        """
+        self.gauges[("tache", "id")] = taskId
+        self.gauges[("tache", "fin")] = time()
+        self.gauges[("tache", "duree")] = elapsed
+
+    def write(self, path: str) -> None:
+        """
+        Écrit les mesures dans un fichier (collecteur textfile de node_exporter). Le fichier est
+        remplacé d'un seul coup : le collecteur ne lit jamais un fichier à moitié écrit.
+
+        :param path: Le chemin du fichier (``.prom``)
+        :type path: str
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+
+        try:
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(self.render())
+
+            os.replace(temporary, path)
+        except OSError as e:
+            self.logger.error(f"Impossible d'écrire les mesures dans {path} : {e}")
+
+    async def serve(self, port: int) -> None:
+        """
+        Expose les mesures sur ``/metrics`` (mode démon).
+
+        :param port: Le port HTTP
+        :type port: int
+        """
+        async def handler(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, port=port).start()
+
+        self.logger.info(f"Mesures exposées sur le port {port} (/metrics) !")
+
+    async def close(self) -> None:
+        """
+        Arrête le point d'accès HTTP.
+        """
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,256 @@
+import asyncio
+
+from CROUStillant.logger import Logger
+from time import perf_counter
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable
+
+
+# Marqueur de fin, envoyé à chaque consommateur d'une étape une fois sa file vidée
+STOP = object()
+
+
+class Stage:
+    """
+    Étape d'un pipeline : une file bornée, consommée par un nombre fixe de tâches.
+
+    Le traitement d'un élément renvoie les éléments à transmettre à l'étape suivante. Si la
+    file de l'étape suivante est pleine, le consommateur attend qu'elle se libère avant de
+    reprendre un élément : une étape lente ralentit les étapes en amont au lieu d'accumuler
+    des éléments en mémoire.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[Iterable[Any] | None]],
+        concurrency: int = 1,
+        size: int = 0,
+    ) -> None:
+        """
+        Constructeur de la classe Stage.
+
+        :param name: Le nom de l'étape
+        :type name: str
+        :param handler: La fonction de traitement d'un élément, qui renvoie les éléments à transmettre à l'étape suivante
+        :type handler: Callable[[Any], Awaitable[Iterable[Any] | None]]
+        :param concurrency: Le nombre d'éléments traités en parallèle
+        :type concurrency: int
+        :param size: La taille maximale de la file (``0`` pour une file non bornée)
+        :type size: int
+        """
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+
+        self.next: Stage | None = None
+
+        # Compteurs
+        self.received = 0
+        self.processed = 0
+        self.peak = 0
+        self.busy = 0.0  # Temps passé à traiter des éléments (secondes, cumulé sur les consommateurs)
+        self.blocked = 0.0  # Temps passé à attendre de la place dans la file de l'étape suivante
+
+    @property
+    def depth(self) -> int:
+        """
+        Nombre d'éléments en attente dans la file.
+
+        :return: La profondeur de la file
+        :rtype: int
+        """
+        return self.queue.qsize()
+
+    async def put(self, item: Any) -> None:
+        """
+        Ajoute un élément à la file, en attendant qu'elle ait de la place.
+
+        :param item: L'élément
+        :type item: Any
+        """
+        await self.queue.put(item)
+
+        self.received += 1
+        self.peak = max(self.peak, self.queue.qsize())
+
+    async def consume(self) -> None:
+        """
+        Consomme les éléments de la file jusqu'au marqueur de fin.
+        """
+        while True:
+            item = await self.queue.get()
+
+            try:
+                if item is STOP:
+                    return
+
+                start = perf_counter()
+                results = await self.handler(item)
+                self.busy += perf_counter() - start
+                self.processed += 1
+
+                if results and self.next:
+                    start = perf_counter()
+                    for result in results:
+                        await self.next.put(result)
+                    self.blocked += perf_counter() - start
+            finally:
+                self.queue.task_done()
+
+    def stats(self, elapsed: float) -> dict:
+        """
+        Récupère les compteurs de l'étape.
+
+        :param elapsed: La durée d'exécution du pipeline (secondes)
+        :type elapsed: float
+        :return: Les compteurs
+        :rtype: dict
+        """
+        return {
+            "concurrency": self.concurrency,
+            "depth": self.depth,
+            "peak": self.peak,
+            "received": self.received,
+            "processed": self.processed,
+            "throughput": self.processed / elapsed if elapsed else 0.0,
+            "busy": self.busy,
+            "blocked": self.blocked,
+            # Part du temps où les consommateurs traitaient un élément
+            "occupation": self.busy / (elapsed * self.concurrency) if elapsed else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Enchaînement d'étapes reliées par des files bornées.
+
+    Les étapes sont arrêtées dans l'ordre : une étape n'est arrêtée qu'une fois sa file
+    vidée et tous ses éléments traités, donc une fois que l'étape précédente, déjà arrêtée,
+    ne peut plus rien lui transmettre. Une erreur dans une étape annule tout le pipeline.
+    """
+
+    def __init__(self, logger: Logger, stages: list[Stage], interval: float = 30.0) -> None:
+        """
+        Constructeur de la classe Pipeline.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param stages: Les étapes, dans l'ordre
+        :type stages: list[Stage]
+        :param interval: L'intervalle entre deux journalisations de l'état des files (secondes)
+        :type interval: float
+        """
+        self.logger = logger
+        self.stages = stages
+        self.interval = interval
+
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+
+        self.start: float | None = None
+        self.elapsed = 0.0
+
+    def __getitem__(self, name: str) -> Stage:
+        return next(stage for stage in self.stages if stage.name == name)
+
+    @property
+    def backlog(self) -> int:
+        """
+        Nombre d'éléments en attente dans les files de toutes les étapes.
+
+        :return: Le nombre d'éléments en attente
+        :rtype: int
+        """
+        return sum(stage.depth for stage in self.stages)
+
+    async def run(
+        self,
+        items: Iterable[Any] | AsyncIterable[Any],
+        seeds: dict[str, Iterable[Any]] | None = None,
+    ) -> None:
+        """
+        Lance le pipeline sur les éléments donnés, et attend que toutes les étapes aient terminé.
+
+        :param items: Les éléments de la première étape, éventuellement produits au fil du pipeline (itérable asynchrone)
+        :type items: Iterable[Any] | AsyncIterable[Any]
+        :param seeds: Des éléments à ajouter directement à d'autres étapes, par nom d'étape
+        :type seeds: dict[str, Iterable[Any]] | None
+        """
+        self.start = perf_counter()
+
+        async with asyncio.TaskGroup() as group:
+            monitor = group.create_task(self.monitor())
+
+            for stage in self.stages:
+                for _ in range(stage.concurrency):
+                    group.create_task(stage.consume())
+
+            if isinstance(items, AsyncIterable):
+                async for item in items:
+                    await self.stages[0].put(item)
+            else:
+                for item in items:
+                    await self.stages[0].put(item)
+
+            for name, stageItems in (seeds or {}).items():
+                for item in stageItems:
+                    await self[name].put(item)
+
+            for stage in self.stages:
+                await stage.queue.join()
+
+                for _ in range(stage.concurrency):
+                    await stage.queue.put(STOP)
+
+            monitor.cancel()
+
+        self.elapsed = perf_counter() - self.start
+
+        self.report()
+
+    async def monitor(self) -> None:
+        """
+        Journalise régulièrement la profondeur des files et l'avancement des étapes.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+
+            self.logger.info(
+                "Pipeline : "
+                + ", ".join(
+                    f"{stage.name} {stage.depth} en attente / {stage.processed} traités"
+                    for stage in self.stages
+                )
+            )
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Récupère les compteurs de toutes les étapes.
+
+        :return: Les compteurs, par étape
+        :rtype: dict[str, dict]
+        """
+        elapsed = self.elapsed or (perf_counter() - self.start if self.start else 0.0)
+
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+    def report(self) -> None:
+        """
+        Journalise le bilan du pipeline : débit et occupation de chaque étape.
+
+        L'étape la plus occupée est le goulot d'étranglement ; les étapes en amont passent
+        alors du temps bloquées à attendre de la place dans sa file.
+        """
+        stats = self.stats()
+
+        for name, stage in stats.items():
+            self.logger.info(
+                f"Étape {name} ({stage['concurrency']} en parallèle) : {stage['processed']:,d} traités "
+                f"({stage['throughput']:.2f}/s), occupation {stage['occupation']:.0%}, "
+                f"file max {stage['peak']}, bloquée {stage['blocked']:.1f}s"
+            )
+
+        if stats:
+            bottleneck = max(stats, key=lambda name: stats[name]["occupation"])
+            self.logger.info(f"Étape la plus occupée : {bottleneck}")
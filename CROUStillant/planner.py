@@ -0,0 +1,247 @@
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection
+from datetime import datetime, timedelta
+
+
+class RefreshPlanner:
+    """
+    Planification des vérifications des menus, restaurant par restaurant.
+
+    Chaque restaurant a son propre intervalle de vérification (PLANIFICATION.INTERVALLE), appris
+    à partir de ses changements : divisé par deux quand une vérification trouve un menu nouveau
+    ou modifié, multiplié par ``growth`` sinon, entre ``minInterval`` et ``maxInterval``. Un
+    restaurant qui publie ses menus une fois par semaine n'est ainsi vérifié qu'une fois par
+    ``maxInterval``, un restaurant qui les modifie plusieurs fois par matinée à chaque tâche.
+    Le premier intervalle d'un restaurant est estimé à partir de l'historique de ses menus
+    (nombre d'heures distinctes d'ajout de menus, MENU.INGESTION_AT, sur les ``history`` derniers jours).
+
+    Seuls les restaurants dont la prochaine vérification est passée sont vérifiés (menus
+    récupérés à l'API du CROUS) ; la liste des restaurants de chaque région est toujours
+    chargée, et les restaurants toujours enregistrés.
+
+    Les restaurants désactivés (ou inconnus) présents dans la liste d'une région sont sondés
+    une fois par ``probeInterval`` : s'ils ont de nouveau des menus, ils sont réactivés.
+
+    Une vérification dont la requête a échoué n'est pas enregistrée : le restaurant reste à vérifier.
+    """
+
+    # Marge retirée de la prochaine vérification : les tâches démarrent à heure fixe, mais
+    # un restaurant est vérifié quelques minutes après le début de la tâche
+    SLACK = timedelta(minutes=5)
+
+    def __init__(
+        self,
+        logger: Logger,
+        pool: Pool,
+        minInterval: int = 60,
+        maxInterval: int = 1440,
+        growth: float = 1.5,
+        probeInterval: int = 1440,
+        history: int = 56,
+    ) -> None:
+        """
+        Constructeur de la classe RefreshPlanner.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param minInterval: L'intervalle minimal entre deux vérifications d'un restaurant (minutes)
+        :type minInterval: int
+        :param maxInterval: L'intervalle maximal entre deux vérifications d'un restaurant (minutes)
+        :type maxInterval: int
+        :param growth: Le facteur appliqué à l'intervalle après une vérification sans changement
+        :type growth: float
+        :param probeInterval: L'intervalle entre deux sondages d'un restaurant désactivé (minutes)
+        :type probeInterval: int
+        :param history: Le nombre de jours d'historique des menus pour estimer le premier intervalle
+        :type history: int
+        """
+        self.logger = logger
+        self.pool = pool
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.growth = growth
+        self.probeInterval = probeInterval
+        self.history = history
+
+        # Rattrapage : tous les restaurants actifs sont vérifiés
+        self.everything = False
+
+        self.start = datetime.now()
+        self.intervals: dict[int, int] = {}
+        self.initial: dict[int, int] = {}
+        self.waiting: set[int] = set()
+
+        # Vérifications de la tâche (restaurant -> changement trouvé) et restaurants sondés
+        self.checks: dict[int, bool] = {}
+        self.probes: set[int] = set()
+        self.reactivated: set[int] = set()
+
+    async def load(self, restaurants: set[int]) -> None:
+        """
+        Charge la planification des restaurants, en début de tâche.
+
+        :param restaurants: Les restaurants actifs
+        :type restaurants: set[int]
+        """
+        self.start = datetime.now()
+        self.checks = {}
+        self.probes = set()
+        self.reactivated = set()
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            rows = await connection.fetch("SELECT RID, INTERVALLE, PROCHAINE FROM PLANIFICATION")
+
+            self.intervals = {row["rid"]: row["intervalle"] for row in rows}
+            self.waiting = {row["rid"] for row in rows if row["prochaine"] > self.start}
+
+            # Premier intervalle des restaurants actifs jamais planifiés, d'après l'historique de leurs menus
+            unknown = [rid for rid in restaurants if rid not in self.intervals]
+
+            if unknown:
+                counts = {
+                    row["rid"]: row["changements"]
+                    for row in await connection.fetch(
+                        """
+                            SELECT RID, COUNT(DISTINCT DATE_TRUNC('hour', INGESTION_AT)) AS changements
+                            FROM MENU
+                            WHERE RID = ANY($1::int[]) AND INGESTION_AT > $2
+                            GROUP BY RID
+                        """,
+                        unknown,
+                        self.start - timedelta(days=self.history),
+                    )
+                }
+            else:
+                counts = {}
+
+        # Intervalle moyen entre deux changements, divisé par deux : un changement est vu au plus
+        # une demi-période après sa publication
+        self.initial = {
+            rid: self.clamp(self.history * 24 * 60 / (counts.get(rid, 0) + 1) / 2)
+            for rid in unknown
+        }
+
+        due = sum(1 for rid in restaurants if self.isDue(rid))
+
+        self.logger.info(f"{due}/{len(restaurants)} restaurants à vérifier !")
+
+    def clamp(self, interval: float) -> int:
+        """
+        Limite un intervalle entre ``minInterval`` et ``maxInterval``.
+
+        :param interval: L'intervalle (minutes)
+        :type interval: float
+        :return: L'intervalle limité (minutes)
+        :rtype: int
+        """
+        return int(min(self.maxInterval, max(self.minInterval, interval)))
+
+    def isDue(self, rid: int) -> bool:
+        """
+        Indique si un restaurant doit être vérifié pendant cette tâche.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :return: ``True`` si la prochaine vérification est passée (ou n'a jamais été planifiée)
+        :rtype: bool
+        """
+        return self.everything or rid not in self.waiting
+
+    def probe(self, rid: int) -> bool:
+        """
+        Indique si un restaurant désactivé doit être sondé pendant cette tâche, et le note comme sondé.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :return: ``True`` si le restaurant doit être sondé
+        :rtype: bool
+        """
+        if rid in self.waiting:
+            return False
+
+        self.probes.add(rid)
+
+        return True
+
+    def record(self, rid: int, changed: bool) -> None:
+        """
+        Enregistre la vérification d'un restaurant.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :param changed: ``True`` si un menu nouveau ou modifié a été trouvé
+        :type changed: bool
+        """
+        self.checks[rid] = self.checks.get(rid, False) or changed
+
+    def interval(self, rid: int, changed: bool) -> int:
+        """
+        Calcule le prochain intervalle de vérification d'un restaurant.
+
+        :param rid: L'identifiant du restaurant
+        :type rid: int
+        :param changed: ``True`` si la vérification a trouvé un changement
+        :type changed: bool
+        :return: L'intervalle (minutes)
+        :rtype: int
+        """
+        # Restaurant désactivé, toujours sans menu : sondé de nouveau plus tard
+        if rid in self.probes and rid not in self.reactivated:
+            return self.probeInterval
+
+        # Restaurant réactivé : vérifié à chaque tâche, le temps d'apprendre son rythme
+        if rid in self.reactivated:
+            return self.minInterval
+
+        previous = self.intervals.get(rid) or self.initial.get(rid) or self.minInterval
+
+        if changed:
+            return self.clamp(previous / 2)
+
+        return self.clamp(previous * self.growth)
+
+    async def save(self) -> None:
+        """
+        Enregistre les vérifications de la tâche et planifie les suivantes, en une seule requête.
+        """
+        if not self.checks:
+            return
+
+        rids = sorted(self.checks)
+        intervals = [self.interval(rid, self.checks[rid]) for rid in rids]
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            await connection.execute(
+                """
+                    INSERT INTO PLANIFICATION (
+                        RID, INTERVALLE, PROCHAINE, DERNIERE_VERIFICATION, DERNIER_CHANGEMENT, VERIFICATIONS, CHANGEMENTS
+                    )
+                    SELECT U.RID, U.INTERVALLE, U.PROCHAINE, $4, CASE WHEN U.CHANGEMENT THEN $4 END, 1, U.CHANGEMENT::INT
+                    FROM unnest($1::int[], $2::int[], $3::timestamp[], $5::bool[]) AS U(RID, INTERVALLE, PROCHAINE, CHANGEMENT)
+                    ON CONFLICT (RID) DO UPDATE SET
+                        INTERVALLE = EXCLUDED.INTERVALLE,
+                        PROCHAINE = EXCLUDED.PROCHAINE,
+                        DERNIERE_VERIFICATION = EXCLUDED.DERNIERE_VERIFICATION,
+                        DERNIER_CHANGEMENT = COALESCE(EXCLUDED.DERNIER_CHANGEMENT, PLANIFICATION.DERNIER_CHANGEMENT),
+                        VERIFICATIONS = PLANIFICATION.VERIFICATIONS + 1,
+                        CHANGEMENTS = PLANIFICATION.CHANGEMENTS + EXCLUDED.CHANGEMENTS
+                """,
+                rids,
+                intervals,
+                [self.start + timedelta(minutes=interval) - self.SLACK for interval in intervals],
+                self.start,
+                [self.checks[rid] for rid in rids],
+            )
+
+        changed = sum(1 for rid in rids if self.checks[rid])
+
+        self.logger.info(
+            f"Planification enregistrée : {len(rids)} restaurants vérifiés, {changed} avec des changements, "
+            f"{len(self.probes)} sondés, {len(self.reactivated)} réactivés !"
+        )
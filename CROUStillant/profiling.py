@@ -0,0 +1,299 @@
+import asyncio
+import os
+import random
+import sys
+import threading
+
+from CROUStillant.logger import Logger
+from collections import Counter, defaultdict
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+
+def collapse(frame) -> list[str]:
+    """
+    Décrit la pile d'appels d'un thread, de la racine au cadre en cours (format « collapsed »
+    des flamegraphs : un cadre par fonction, ``fichier:fonction``).
+
+    :param frame: Le cadre en cours du thread
+    :type frame: FrameType
+    :return: Les cadres, de la racine au cadre en cours
+    :rtype: list[str]
+    """
+    stack = []
+
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename).removesuffix('.py')}:{code.co_qualname}")
+        frame = frame.f_back
+
+    stack.reverse()
+
+    return stack
+
+
+class Profiler:
+    """
+    Profilage d'une tâche, activé pour une tâche sur ``every`` en moyenne (ou pour chaque tâche
+    avec ``--profile``), avec un surcoût assez faible pour rester activé en production :
+
+    - échantillonnage des piles d'appels de tous les threads (boucle d'événements, encodage des
+      images) toutes les ``interval`` secondes, par un thread séparé : aucune instrumentation
+      des fonctions, contrairement à cProfile ;
+    - détection des blocages de la boucle d'événements : une tâche note l'heure toutes les
+      ``stall / 4`` secondes ; si elle n'a pas pu le faire depuis plus de ``stall`` secondes,
+      la boucle est bloquée (encodage d'une image avec Pillow, ``dumpsJSON`` d'un gros menu...),
+      et la pile de la boucle est relevée pendant le blocage. Moins coûteux que le mode debug
+      d'asyncio (``slow_callback_duration``), qui trace chaque coroutine ;
+    - durée passée sur chaque restaurant, à chaque étape du pipeline.
+
+    Les résultats sont écrits à côté des logs, dans ``logs/profiles`` : piles échantillonnées
+    et piles des blocages au format « collapsed » (``flamegraph.pl``, speedscope), et durées par
+    restaurant en CSV. Seuls les ``keep`` derniers profils sont gardés.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        every: int = 1,
+        interval: float = 0.01,
+        stall: float = 0.1,
+        keep: int = 20,
+    ) -> None:
+        """
+        Constructeur de la classe Profiler.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param every: Une tâche profilée sur ``every``, en moyenne (``1`` : toutes les tâches)
+        :type every: int
+        :param interval: L'intervalle entre deux échantillons (secondes)
+        :type interval: float
+        :param stall: La durée à partir de laquelle la boucle d'événements est considérée comme bloquée (secondes)
+        :type stall: float
+        :param keep: Le nombre de profils gardés
+        :type keep: int
+        """
+        self.logger = logger
+        self.every = max(1, every)
+        self.interval = interval
+        self.stall = stall
+        self.keep = keep
+
+        self.directory = os.path.join(os.getcwd(), "logs", "profiles")
+
+        self.active = False
+        self.name = ""
+
+        self.samples: Counter = Counter()
+        self.stalls: Counter = Counter()
+        self.restaurants: dict[int, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.titles: dict[int, str] = {}
+
+        # Blocages : nombre, durée cumulée et plus long blocage (secondes)
+        self.stallCount = 0
+        self.stallTime = 0.0
+        self.stallMax = 0.0
+
+        self.beat = 0.0
+        self.loopThread: int | None = None
+        self.thread: threading.Thread | None = None
+        self.stopping = threading.Event()
+        self.heartbeat: asyncio.Task | None = None
+
+    def start(self, name: str) -> bool:
+        """
+        Démarre le profilage d'une tâche, si elle est tirée au sort. À appeler depuis la boucle d'événements.
+
+        :param name: Le nom du profil (préfixe des fichiers)
+        :type name: str
+        :return: ``True`` si la tâche est profilée
+        :rtype: bool
+        """
+        if random.randrange(self.every) != 0:
+            return False
+
+        self.active = True
+        self.name = name
+        self.samples = Counter()
+        self.stalls = Counter()
+        self.restaurants.clear()
+        self.titles = {}
+        self.stallCount = 0
+        self.stallTime = 0.0
+        self.stallMax = 0.0
+
+        self.beat = perf_counter()
+        self.loopThread = threading.get_ident()
+        self.stopping.clear()
+
+        self.heartbeat = asyncio.create_task(self.keepBeating())
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+        self.thread.start()
+
+        self.logger.info(f"Profilage de la tâche activé ({name}) !")
+
+        return True
+
+    async def keepBeating(self) -> None:
+        """
+        Note l'heure à intervalle régulier : un retard signale une boucle d'événements bloquée.
+        """
+        while True:
+            self.beat = perf_counter()
+            await asyncio.sleep(self.stall / 4)
+
+    def sample(self) -> None:
+        """
+        Thread d'échantillonnage : relève les piles de tous les threads, et celle de la boucle
+        d'événements pendant ses blocages.
+        """
+        own = threading.get_ident()
+        stalled = None
+        since = 0.0
+
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+
+                stack = collapse(frame)
+                self.samples[";".join([names.get(ident, str(ident)), *stack])] += 1
+
+            late = perf_counter() - self.beat
+
+            if late > self.stall and self.loopThread in frames:
+                stack = collapse(frames[self.loopThread])
+                self.stalls[";".join(stack)] += 1
+
+                if stalled is None:
+                    stalled = stack
+                    since = self.beat
+            elif stalled is not None:
+                # Le battement a repris : l'écart entre les deux battements, moins la pause
+                # normale, donne la durée du blocage
+                self.recordStall(stalled, self.beat - since - self.stall / 4)
+                stalled = None
+
+    def recordStall(self, stack: list[str], elapsed: float) -> None:
+        """
+        Enregistre la fin d'un blocage de la boucle d'événements.
+
+        :param stack: La pile de la boucle au début du blocage
+        :type stack: list[str]
+        :param elapsed: La durée du blocage (secondes)
+        :type elapsed: float
+        """
+        self.stallCount += 1
+        self.stallTime += elapsed
+        self.stallMax = max(self.stallMax, elapsed)
+
+        self.logger.warning(
+            f"Boucle d'événements bloquée pendant environ {elapsed * 1000:.0f} ms : {' < '.join(reversed(stack[-5:]))}"
+        )
+
+    def timed(self, stage: str, handler: Callable[[Any], Awaitable[Any]], restaurant: Callable[[Any], Any]) -> Callable[[Any], Awaitable[Any]]:
+        """
+        Mesure la durée passée sur chaque restaurant par une étape du pipeline.
+
+        :param stage: Le nom de l'étape
+        :type stage: str
+        :param handler: La fonction de traitement de l'étape
+        :type handler: Callable[[Any], Awaitable[Any]]
+        :param restaurant: La fonction qui récupère le restaurant (``RU``) d'un élément de l'étape
+        :type restaurant: Callable[[Any], Any]
+        :return: La fonction de traitement, mesurée
+        :rtype: Callable[[Any], Awaitable[Any]]
+        """
+        async def wrapper(item: Any) -> Any:
+            start = perf_counter()
+
+            try:
+                return await handler(item)
+            finally:
+                ru = restaurant(item)
+
+                self.restaurants[ru.id][stage] += perf_counter() - start
+                self.titles[ru.id] = ru.title
+
+        return wrapper
+
+    async def stop(self) -> None:
+        """
+        Arrête le profilage et écrit les résultats.
+        """
+        if not self.active:
+            return
+
+        self.active = False
+        self.stopping.set()
+
+        if self.heartbeat:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+
+        if self.thread:
+            await asyncio.to_thread(self.thread.join)
+            self.thread = None
+
+        try:
+            await asyncio.to_thread(self.write)
+        except OSError as e:
+            self.logger.error(f"Impossible d'écrire le profil {self.name} : {e}")
+
+    def write(self) -> None:
+        """
+        Écrit les piles échantillonnées, les piles des blocages et les durées par restaurant, puis
+        supprime les profils les plus anciens.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        prefix = os.path.join(self.directory, f"{datetime.now():%Y%m%d-%H%M%S}-{self.name}")
+
+        for suffix, samples in ((".folded", self.samples), ("-blocages.folded", self.stalls)):
+            with open(prefix + suffix, "w", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        stages = ["restaurants", "menus", "diff", "write"]
+        totals = sorted(
+            ((rid, sum(times.values())) for rid, times in self.restaurants.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+
+        with open(prefix + "-restaurants.csv", "w", encoding="utf-8") as f:
+            f.write(",".join(["rid", "nom", *stages, "total"]) + "\n")
+
+            for rid, total in totals:
+                title = self.titles.get(rid, "").replace('"', '""')
+                times = self.restaurants[rid]
+
+                f.write(",".join([str(rid), f'"{title}"', *(f"{times[stage]:.4f}" for stage in stages), f"{total:.4f}"]) + "\n")
+
+        self.logger.info(
+            f"Profil {self.name} écrit ({sum(self.samples.values()):,d} échantillons) : {prefix}.folded !"
+        )
+        self.logger.info(
+            f"Boucle d'événements bloquée {self.stallCount} fois, {self.stallTime:.2f}s au total, "
+            f"au plus {self.stallMax * 1000:.0f} ms !"
+        )
+
+        for rid, total in totals[:5]:
+            self.logger.info(f"Restaurant {self.titles.get(rid, rid)} : {total:.2f}s")
+
+        # Rotation : seuls les ``keep`` derniers profils sont gardés (trois fichiers par profil)
+        profiles = sorted(file for file in os.listdir(self.directory) if file.endswith("-restaurants.csv"))
+
+        for old in profiles[:-self.keep] if self.keep > 0 else []:
+            stamp = old.removesuffix("-restaurants.csv")
+
+            for suffix in (".folded", "-blocages.folded", "-restaurants.csv"):
+                path = os.path.join(self.directory, stamp + suffix)
+
+                if os.path.exists(path):
+                    os.remove(path)
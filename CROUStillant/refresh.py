@@ -0,0 +1,205 @@
+import asyncio
+
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection
+from datetime import datetime, timedelta
+from time import perf_counter
+
+
+class MaterializedView:
+    """
+    Vue matérialisée rafraîchie en fin de cycle d'ingestion.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sources: set[str],
+        interval: timedelta = timedelta(0),
+        stale: str | None = None,
+    ) -> None:
+        """
+        Constructeur de la classe MaterializedView.
+
+        :param name: Le nom de la vue
+        :type name: str
+        :param sources: Les tables lues par la vue : la vue n'est rafraîchie que si l'une d'elles a été modifiée
+        :type sources: set[str]
+        :param interval: Le délai minimal entre deux rafraîchissements (``0`` : à chaque cycle)
+        :type interval: timedelta
+        :param stale: Une requête qui renvoie ``TRUE`` si la vue doit être rafraîchie même sans modification (ex: période dépassée)
+        :type stale: str | None
+        """
+        self.name = name
+        self.sources = sources
+        self.interval = interval
+        self.stale = stale
+
+
+class RefreshScheduler:
+    """
+    Rafraîchit les vues matérialisées en fin de cycle d'ingestion.
+
+    Les vues sont indépendantes : chacune est rafraîchie (``REFRESH MATERIALIZED VIEW
+    CONCURRENTLY``) en parallèle, sur sa propre connexion du pool. Une vue n'est rafraîchie
+    que si l'une de ses tables sources a été modifiée pendant le cycle, et au plus une fois
+    par ``interval`` : un rafraîchissement repoussé est enregistré (statut ``differe``) et
+    effectué à un cycle suivant, même sans nouvelle modification.
+
+    Chaque rafraîchissement est chronométré et enregistré dans VUE_RAFRAICHISSEMENT.
+    """
+
+    def __init__(self, logger: Logger, pool: Pool, views: list[MaterializedView]) -> None:
+        """
+        Constructeur de la classe RefreshScheduler.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param views: Les vues à rafraîchir
+        :type views: list[MaterializedView]
+        """
+        self.logger = logger
+        self.pool = pool
+        self.views = views
+
+    async def run(self, written: set[str], taskId: int | None = None) -> dict[str, str]:
+        """
+        Rafraîchit les vues dont les tables sources ont été modifiées.
+
+        :param written: Les tables modifiées pendant le cycle
+        :type written: set[str]
+        :param taskId: L'identifiant de la tâche, enregistré avec chaque rafraîchissement
+        :type taskId: int | None
+        :return: Le statut de chaque vue (``ok``, ``differe``, ``erreur`` ou ``inchangee``)
+        :rtype: dict[str, str]
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            rows = await connection.fetch(
+                """
+                    SELECT
+                        VUE,
+                        MAX(DEBUT) FILTER (WHERE STATUT = 'ok') AS dernier,
+                        (ARRAY_AGG(STATUT ORDER BY DEBUT DESC))[1] AS statut
+                    FROM VUE_RAFRAICHISSEMENT
+                    WHERE VUE = ANY($1::varchar[])
+                    GROUP BY VUE
+                """,
+                [view.name for view in self.views],
+            )
+
+            last = {row["vue"]: row for row in rows}
+
+            pending = []
+
+            for view in self.views:
+                previous = last.get(view.name)
+
+                # Rafraîchissement différé ou en erreur au cycle précédent : toujours à faire
+                changed = bool(view.sources & written) or (
+                    previous is not None and previous["statut"] in ("differe", "erreur")
+                )
+
+                if not changed and view.stale:
+                    changed = await connection.fetchval(view.stale)
+
+                pending.append((view, changed, previous["dernier"] if previous else None))
+
+        now = datetime.now()
+        statuses = {}
+
+        async with asyncio.TaskGroup() as group:
+            for view, changed, lastRefresh in pending:
+                if not changed:
+                    self.logger.info(f"Vue {view.name} inchangée, aucun rafraîchissement !")
+                    statuses[view.name] = "inchangee"
+                    continue
+
+                if lastRefresh and now - lastRefresh < view.interval:
+                    self.logger.info(
+                        f"Vue {view.name} rafraîchie le {lastRefresh:%d/%m/%Y %H:%M}, rafraîchissement différé !"
+                    )
+                    statuses[view.name] = "differe"
+                    group.create_task(self.record(view, taskId, now, None, "differe"))
+                    continue
+
+                group.create_task(self.refresh(view, taskId, statuses))
+
+        return statuses
+
+    async def refresh(self, view: MaterializedView, taskId: int | None, statuses: dict[str, str]) -> None:
+        """
+        Rafraîchit une vue, sur sa propre connexion, et enregistre la durée du rafraîchissement.
+        Une erreur est journalisée et enregistrée, sans interrompre le rafraîchissement des autres vues.
+
+        :param view: La vue
+        :type view: MaterializedView
+        :param taskId: L'identifiant de la tâche
+        :type taskId: int | None
+        :param statuses: Le statut de chaque vue, complété avec celui de cette vue
+        :type statuses: dict[str, str]
+        """
+        self.logger.info(f"Rafraîchissement de la vue {view.name}...")
+
+        start = datetime.now()
+        timer = perf_counter()
+
+        try:
+            async with self.pool.acquire() as connection:
+                connection: Connection
+
+                await connection.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view.name};")
+        except Exception as e:
+            duration = perf_counter() - timer
+            self.logger.error(f"Erreur lors du rafraîchissement de la vue {view.name} ({duration:.2f}s) : {e}")
+            statuses[view.name] = "erreur"
+        else:
+            duration = perf_counter() - timer
+            self.logger.info(f"Vue {view.name} rafraîchie en {duration:.2f}s !")
+            statuses[view.name] = "ok"
+
+        await self.record(view, taskId, start, duration, statuses[view.name])
+
+    async def record(
+        self,
+        view: MaterializedView,
+        taskId: int | None,
+        start: datetime,
+        duration: float | None,
+        status: str,
+    ) -> None:
+        """
+        Enregistre un rafraîchissement (effectué, différé ou en erreur). Une erreur est journalisée
+        sans interrompre les rafraîchissements des autres vues, lancés dans le même groupe de tâches.
+
+        :param view: La vue
+        :type view: MaterializedView
+        :param taskId: L'identifiant de la tâche
+        :type taskId: int | None
+        :param start: La date du rafraîchissement
+        :type start: datetime
+        :param duration: La durée du rafraîchissement (secondes), ``None`` s'il a été différé
+        :type duration: float | None
+        :param status: Le statut (``ok``, ``differe`` ou ``erreur``)
+        :type status: str
+        """
+        try:
+            async with self.pool.acquire() as connection:
+                connection: Connection
+
+                await connection.execute(
+                    """
+                        INSERT INTO VUE_RAFRAICHISSEMENT (IDTACHE, VUE, DEBUT, DUREE, STATUT)
+                        VALUES ($1, $2, $3, $4, $5)
+                    """,
+                    taskId,
+                    view.name,
+                    start,
+                    duration,
+                    status,
+                )
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'enregistrement du rafraîchissement de la vue {view.name} : {e}")
@@ -0,0 +1,472 @@
+import asyncio
+
+from CROUStillant.logger import Logger
+from asyncpg import Pool, Connection
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable
+
+
+class ShardCoordinator:
+    """
+    Répartition d'une tâche entre plusieurs workers, sur une ou plusieurs machines.
+
+    Les workers lancés pour un même cycle (même heure de la crontab, ou même tâche du mode
+    démon) partagent une seule tâche, identifiée par TACHE.CYCLE : le premier worker crée la
+    tâche, sous un verrou consultatif (``pg_advisory_xact_lock``), les suivants la rejoignent
+    (TACHE_SHARD).
+
+    Les régions de la tâche sont inscrites dans TACHE_REGION, puis réclamées une à une
+    (``FOR UPDATE SKIP LOCKED``) : chaque worker prend d'abord les régions de sa part
+    (``IDREG % shards = index``), puis, une fois sa part terminée, celles des autres workers
+    qui n'ont pas encore été prises. Une région est réclamée pour un bail de ``lease``
+    secondes, renouvelé tant que le worker est actif : les régions d'un worker arrêté sont
+    reprises par les autres à l'expiration du bail.
+
+    Le dernier worker à terminer termine la tâche (archivage, compteurs, vues matérialisées,
+    statistiques finales), avec les compteurs cumulés de tous les workers : un worker dont la
+    part est terminée attend les autres, ou l'expiration de leur bail (voir ``close``).
+
+    Un worker ne rejoint pas la tâche d'un cycle tant que la tâche d'un autre cycle a encore
+    des workers actifs : deux tâches ne se chevauchent pas.
+    """
+
+    # Clé du verrou consultatif qui sérialise la création et la fin des tâches partagées
+    LOCK = "croustillant.tache"
+
+    def __init__(
+        self,
+        logger: Logger,
+        pool: Pool,
+        name: str,
+        shards: int,
+        index: int = 0,
+        lease: float = 120.0,
+    ) -> None:
+        """
+        Constructeur de la classe ShardCoordinator.
+
+        :param logger: Le logger
+        :type logger: Logger
+        :param pool: Le pool de connexions
+        :type pool: Pool
+        :param name: Le nom du worker, unique pour une tâche (par exemple ``machine-pid``)
+        :type name: str
+        :param shards: Le nombre de parts (workers prévus)
+        :type shards: int
+        :param index: La part du worker (``0`` à ``shards - 1``)
+        :type index: int
+        :param lease: La durée du bail d'une région réclamée (secondes)
+        :type lease: float
+        """
+        if not 0 <= index < shards:
+            raise ValueError(f"Part invalide : {index} (sur {shards})")
+
+        self.logger = logger
+        self.pool = pool
+        self.name = name
+        self.shards = shards
+        self.index = index
+        self.lease = lease
+
+        self.taskId: int | None = None
+
+        # Régions réclamées par ce worker pendant la tâche
+        self.claimed: list[int] = []
+
+        self.heartbeat: asyncio.Task | None = None
+
+    async def join(self, cycle: datetime, create: Callable[[Connection], Awaitable[int]]) -> tuple[int | None, bool]:
+        """
+        Rejoint la tâche d'un cycle, en la créant si ce worker est le premier.
+
+        :param cycle: Le cycle (heure prévue de la tâche)
+        :type cycle: datetime
+        :param create: La fonction de création de la tâche, qui renvoie son identifiant
+        :type create: Callable[[Connection], Awaitable[int]]
+        :return: L'identifiant de la tâche (``None`` si elle est déjà terminée, ou si une autre tâche est en cours) et ``True`` si elle a été créée
+        :rtype: tuple[int | None, bool]
+        """
+        self.taskId = None
+        self.claimed = []
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.LOCK)
+
+                row = await connection.fetchrow(
+                    "SELECT ID, FIN, STATUT FROM TACHE WHERE CYCLE = $1 ORDER BY ID LIMIT 1",
+                    cycle,
+                )
+
+                # Une tâche en cours de clôture (dernier worker désigné) est considérée comme terminée
+                if row and (row["fin"] or row["statut"] == "cloture"):
+                    self.logger.info(f"La tâche #{row['id']} du cycle du {cycle:%d/%m/%Y à %H:%M} est déjà terminée !")
+                    return None, False
+
+                running = await connection.fetchval(
+                    """
+                        SELECT T.ID
+                        FROM TACHE T
+                        JOIN TACHE_SHARD S ON S.IDTACHE = T.ID
+                        WHERE T.CYCLE <> $1 AND T.FIN IS NULL AND S.FIN IS NULL AND S.EXPIRATION > NOW()
+                        LIMIT 1
+                    """,
+                    cycle,
+                )
+
+                if running:
+                    self.logger.warning(f"La tâche #{running} d'un autre cycle est en cours : tâche abandonnée !")
+                    return None, False
+
+                created = row is None
+                taskId = await create(connection) if created else row["id"]
+
+                await connection.execute(
+                    """
+                        INSERT INTO TACHE_SHARD (IDTACHE, SHARD, PART, DEBUT, EXPIRATION)
+                        VALUES ($1, $2, $3, NOW(), NOW() + make_interval(secs => $4))
+                        ON CONFLICT (IDTACHE, SHARD) DO UPDATE SET
+                            FIN = NULL,
+                            EXPIRATION = EXCLUDED.EXPIRATION
+                    """,
+                    taskId,
+                    self.name,
+                    self.index,
+                    self.lease,
+                )
+
+        self.taskId = taskId
+        self.heartbeat = asyncio.create_task(self.keepAlive())
+
+        self.logger.info(
+            f"Worker {self.name} (part {self.index + 1}/{self.shards}) : tâche #{taskId} "
+            f"{'créée' if created else 'rejointe'} !"
+        )
+
+        return taskId, created
+
+    async def register(self, regions: list[int]) -> None:
+        """
+        Inscrit les régions de la tâche. Chaque worker inscrit les régions qu'il a chargées :
+        une région déjà inscrite (ou déjà terminée) n'est pas modifiée.
+
+        :param regions: Les identifiants des régions
+        :type regions: list[int]
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            await connection.execute(
+                """
+                    INSERT INTO TACHE_REGION (IDTACHE, IDREG)
+                    SELECT $1, U.IDREG
+                    FROM unnest($2::int[]) AS U(IDREG)
+                    ON CONFLICT (IDTACHE, IDREG) DO NOTHING
+                """,
+                self.taskId,
+                regions,
+            )
+
+    async def claim(self, priority: Iterable[int] = ()) -> int | None:
+        """
+        Réclame une région : une région de la part du worker si possible, sinon une région
+        d'un autre worker, libre ou dont le bail a expiré. Dans chaque part, les régions
+        prioritaires (reportées par la tâche précédente) sont réclamées en premier.
+
+        :param priority: Les régions prioritaires
+        :type priority: Iterable[int]
+        :return: L'identifiant de la région (``None`` s'il n'en reste plus)
+        :rtype: int | None
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            idreg = await connection.fetchval(
+                """
+                    UPDATE TACHE_REGION T
+                    SET SHARD = $2, PRISE = NOW(), EXPIRATION = NOW() + make_interval(secs => $5)
+                    FROM (
+                        SELECT IDREG
+                        FROM TACHE_REGION
+                        WHERE IDTACHE = $1 AND FIN IS NULL AND (SHARD IS NULL OR EXPIRATION < NOW())
+                        ORDER BY IDREG % $3 = $4 DESC, IDREG = ANY($6::int[]) DESC, IDREG
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ) C
+                    WHERE T.IDTACHE = $1 AND T.IDREG = C.IDREG
+                    RETURNING T.IDREG
+                """,
+                self.taskId,
+                self.name,
+                self.shards,
+                self.index,
+                self.lease,
+                list(priority),
+            )
+
+        if idreg is not None:
+            self.claimed.append(idreg)
+
+            if idreg % self.shards != self.index:
+                self.logger.info(f"Région {idreg} reprise d'une autre part !")
+
+        return idreg
+
+    async def complete(self) -> None:
+        """
+        Marque comme terminées les régions réclamées par ce worker.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            await connection.execute(
+                """
+                    UPDATE TACHE_REGION
+                    SET FIN = NOW()
+                    WHERE IDTACHE = $1 AND SHARD = $2 AND FIN IS NULL
+                """,
+                self.taskId,
+                self.name,
+            )
+
+    async def pending(self) -> bool:
+        """
+        Indique s'il reste des régions à réclamer, par exemple celles d'un worker arrêté dont le bail a expiré.
+
+        :return: ``True`` s'il reste des régions libres
+        :rtype: bool
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            return await connection.fetchval(
+                """
+                    SELECT EXISTS (
+                        SELECT 1
+                        FROM TACHE_REGION
+                        WHERE IDTACHE = $1 AND FIN IS NULL AND (SHARD IS NULL OR EXPIRATION < NOW())
+                    )
+                """,
+                self.taskId,
+            )
+
+    async def keepAlive(self) -> None:
+        """
+        Renouvelle le bail du worker et de ses régions en cours, jusqu'à la fin de la tâche.
+        """
+        while True:
+            await asyncio.sleep(self.lease / 3)
+
+            try:
+                async with self.pool.acquire() as connection:
+                    connection: Connection
+
+                    await connection.execute(
+                        """
+                            UPDATE TACHE_SHARD
+                            SET EXPIRATION = NOW() + make_interval(secs => $3)
+                            WHERE IDTACHE = $1 AND SHARD = $2
+                        """,
+                        self.taskId,
+                        self.name,
+                        self.lease,
+                    )
+                    await connection.execute(
+                        """
+                            UPDATE TACHE_REGION
+                            SET EXPIRATION = NOW() + make_interval(secs => $3)
+                            WHERE IDTACHE = $1 AND SHARD = $2 AND FIN IS NULL
+                        """,
+                        self.taskId,
+                        self.name,
+                        self.lease,
+                    )
+            except Exception as e:
+                self.logger.warning(f"Impossible de renouveler le bail du worker {self.name} : {e}")
+
+    def stop(self) -> None:
+        """
+        Arrête le renouvellement du bail.
+        """
+        if self.heartbeat:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+
+    async def abort(self) -> dict | None:
+        """
+        Quitte la tâche après une erreur : les régions non terminées de ce worker sont
+        libérées, pour être reprises par les autres workers. Si ce worker est le dernier, il
+        termine la tâche (voir ``close``) : les régions libérées sont alors reportées.
+
+        :return: Les compteurs cumulés de tous les workers si ce worker termine la tâche, ``None`` sinon
+        :rtype: dict | None
+        """
+        self.stop()
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.LOCK)
+
+                await connection.execute(
+                    """
+                        UPDATE TACHE_REGION
+                        SET SHARD = NULL, PRISE = NULL, EXPIRATION = NULL
+                        WHERE IDTACHE = $1 AND SHARD = $2 AND FIN IS NULL
+                    """,
+                    self.taskId,
+                    self.name,
+                )
+                await connection.execute(
+                    "UPDATE TACHE_SHARD SET FIN = NOW(), REGIONS = $3 WHERE IDTACHE = $1 AND SHARD = $2",
+                    self.taskId,
+                    self.name,
+                    len(self.claimed),
+                )
+
+        return await self.close()
+
+    async def finish(
+        self,
+        requests: int,
+        restaurants: int,
+        rows: int,
+        tables: set[str],
+        postponed: set[int],
+    ) -> dict | None:
+        """
+        Enregistre les compteurs du worker, puis termine la tâche s'il est le dernier (voir ``close``).
+
+        :param requests: Le nombre de requêtes réussies à l'API du CROUS
+        :type requests: int
+        :param restaurants: Le nombre de restaurants enregistrés
+        :type restaurants: int
+        :param rows: Le nombre de lignes écrites
+        :type rows: int
+        :param tables: Les tables modifiées
+        :type tables: set[str]
+        :param postponed: Les régions reportées à la tâche suivante (temps alloué écoulé)
+        :type postponed: set[int]
+        :return: Les compteurs cumulés de tous les workers si ce worker termine la tâche, ``None`` sinon
+        :rtype: dict | None
+        """
+        self.stop()
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            await connection.execute(
+                """
+                    UPDATE TACHE_SHARD
+                    SET FIN = NOW(), REGIONS = $3, REQUETES = $4, RESTAURANTS_ECRITS = $5,
+                        LIGNES_ECRITES = $6, TABLES = $7, REPORTEES = $8
+                    WHERE IDTACHE = $1 AND SHARD = $2
+                """,
+                self.taskId,
+                self.name,
+                len(self.claimed),
+                requests,
+                restaurants,
+                rows,
+                sorted(tables),
+                sorted(postponed),
+            )
+
+        return await self.close()
+
+    async def close(self) -> dict | None:
+        """
+        Termine la tâche si ce worker (dont la part est terminée) est le dernier.
+
+        Tant que d'autres workers sont actifs (part non terminée, bail en cours), le worker
+        attend : un worker arrêté sans avoir quitté la tâche (processus tué, machine arrêtée)
+        est considéré comme actif jusqu'à l'expiration de son bail. Le dernier worker à sortir
+        de l'attente termine la tâche ; les régions non terminées (celles d'un worker arrêté,
+        ou libérées après une erreur) sont reportées à la tâche suivante, qui les charge en premier.
+
+        :return: Les compteurs cumulés de tous les workers si ce worker termine la tâche, ``None`` sinon
+        :rtype: dict | None
+        """
+        waiting = False
+
+        while True:
+            async with self.pool.acquire() as connection:
+                connection: Connection
+
+                async with connection.transaction():
+                    await connection.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.LOCK)
+
+                    # Un worker dont le bail a expiré est considéré comme arrêté
+                    running = await connection.fetchval(
+                        """
+                            SELECT COUNT(*)
+                            FROM TACHE_SHARD
+                            WHERE IDTACHE = $1 AND FIN IS NULL AND EXPIRATION > NOW()
+                        """,
+                        self.taskId,
+                    )
+
+                    if not running:
+                        # Plusieurs workers peuvent sortir de l'attente : un seul termine la tâche. FIN
+                        # n'est renseignée qu'à la fin de la tâche, avec son statut (voir ``updateTask``)
+                        claimed = await connection.fetchval(
+                            """
+                                UPDATE TACHE
+                                SET STATUT = 'cloture'
+                                WHERE ID = $1 AND FIN IS NULL AND STATUT IS NULL
+                                RETURNING ID
+                            """,
+                            self.taskId,
+                        )
+
+                        if claimed is None:
+                            return None
+
+                        row = await connection.fetchrow(
+                            """
+                                SELECT
+                                    COUNT(*) AS shards,
+                                    COALESCE(SUM(REQUETES), 0) AS requetes,
+                                    COALESCE(SUM(RESTAURANTS_ECRITS), 0) AS restaurants_ecrits,
+                                    COALESCE(SUM(LIGNES_ECRITES), 0) AS lignes_ecrites,
+                                    ARRAY(
+                                        SELECT DISTINCT UNNEST(TABLES)
+                                        FROM TACHE_SHARD
+                                        WHERE IDTACHE = $1
+                                    ) AS tables,
+                                    -- Régions reportées par un worker, ou jamais terminées
+                                    ARRAY(
+                                        SELECT UNNEST(REPORTEES)
+                                        FROM TACHE_SHARD
+                                        WHERE IDTACHE = $1
+                                        UNION
+                                        SELECT IDREG
+                                        FROM TACHE_REGION
+                                        WHERE IDTACHE = $1 AND FIN IS NULL
+                                    ) AS reportees
+                                FROM TACHE_SHARD
+                                WHERE IDTACHE = $1
+                            """,
+                            self.taskId,
+                        )
+
+                        break
+
+            if not waiting:
+                self.logger.info(f"Part terminée, {running} workers encore actifs sur la tâche #{self.taskId} : attente...")
+                waiting = True
+
+            await asyncio.sleep(self.lease / 3)
+
+        self.logger.info(f"Dernier worker de la tâche #{self.taskId} ({row['shards']} workers) : fin de la tâche !")
+
+        return {
+            "requetes": row["requetes"],
+            "restaurants_ecrits": row["restaurants_ecrits"],
+            "lignes_ecrites": row["lignes_ecrites"],
+            "tables": set(row["tables"]),
+            "reportees": set(row["reportees"]),
+        }
@@ -0,0 +1,75 @@
+import os
+
+from tempfile import NamedTemporaryFile
+
+
+# Déclinaisons enregistrées pour chaque image : nom -> (taille maximale en pixels, qualité WebP)
+VARIANTS = {
+    "full": (None, 90),
+    "medium": (800, 85),
+    "thumbnail": (200, 80),
+}
+
+
+class FileImageStore:
+    """
+    Stockage des images adressé par leur contenu, sur le système de fichiers.
+
+    Chaque image est identifiée par le hash de ses pixels décodés (``CONTENT_HASH``) : une
+    même image servie sous plusieurs URL n'est enregistrée qu'une fois. Ses déclinaisons
+    (voir ``VARIANTS``) sont rangées dans ``<racine>/<2 premiers caractères>/<hash>/<déclinaison>.webp``.
+
+    Les fichiers sont écrits dans un fichier temporaire puis renommés : un fichier présent
+    est toujours complet, même si deux tâches écrivent la même image en même temps.
+    """
+
+    def __init__(self, root: str) -> None:
+        """
+        Constructeur de la classe FileImageStore.
+
+        :param root: Le dossier racine du stockage
+        :type root: str
+        """
+        self.root = root
+
+    def path(self, contentHash: str, variant: str) -> str:
+        """
+        Récupère le chemin d'une déclinaison d'une image.
+
+        :param contentHash: Le hash du contenu de l'image
+        :type contentHash: str
+        :param variant: Le nom de la déclinaison
+        :type variant: str
+        :return: Le chemin du fichier
+        :rtype: str
+        """
+        return os.path.join(self.root, contentHash[:2], contentHash, f"{variant}.webp")
+
+    def exists(self, contentHash: str) -> bool:
+        """
+        Vérifie que toutes les déclinaisons d'une image sont enregistrées.
+
+        :param contentHash: Le hash du contenu de l'image
+        :type contentHash: str
+        :return: ``True`` si l'image est enregistrée
+        :rtype: bool
+        """
+        return all(os.path.exists(self.path(contentHash, variant)) for variant in VARIANTS)
+
+    def write(self, contentHash: str, variants: dict[str, bytes]) -> None:
+        """
+        Enregistre les déclinaisons d'une image.
+
+        :param contentHash: Le hash du contenu de l'image
+        :type contentHash: str
+        :param variants: Le contenu de chaque déclinaison
+        :type variants: dict[str, bytes]
+        """
+        folder = os.path.join(self.root, contentHash[:2], contentHash)
+        os.makedirs(folder, exist_ok=True)
+
+        for variant, data in variants.items():
+            with NamedTemporaryFile(dir=folder, prefix=f".{variant}.", delete=False) as file:
+                file.write(data)
+
+            os.replace(file.name, self.path(contentHash, variant))
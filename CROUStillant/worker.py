@@ -1,18 +1,47 @@
-import hashlib
 import asyncio
 
-from CrousPy import Crous, Region, RU, Menu
+from CrousPy import Region, RU, Menu
+from CROUStillant.client import CrousClient
 from CROUStillant.logger import Logger
+from CROUStillant.bulk import BulkWriter
+from CROUStillant.dishes import DishCache
+from CROUStillant.encoding import HASH_MODES, dumpsJSON, fingerprint
+from CROUStillant.images import ImageLoader
+from CROUStillant.storage import FileImageStore
+from CROUStillant.pipeline import Pipeline, Stage
+from CROUStillant.planner import RefreshPlanner
+from CROUStillant.profiling import Profiler
+from CROUStillant.shard import ShardCoordinator
+from CROUStillant.menus import MenuTree, MenuPlan, CategoryNode, isValidDish, dishNames, planMenus, rowCount, countRows
 from asyncpg import Pool, Connection
-from json import dumps
-from datetime import datetime
-from io import BytesIO
-from PIL import Image
+from collections import Counter
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from typing import AsyncIterator, Iterable
 
 
 class Worker:
     def __init__(
-        self, logger: Logger, pool: Pool, client: Crous, restaurants: list[int]
+        self,
+        logger: Logger,
+        pool: Pool,
+        client: CrousClient,
+        restaurants: Iterable[int],
+        concurrency: int = 1,
+        dbConcurrency: int = 1,
+        writeConcurrency: int = 1,
+        queueSize: int = 0,
+        imageConcurrency: int = 4,
+        imageStore: FileImageStore | None = None,
+        retryBudget: float = 120.0,
+        bulkSize: int = 0,
+        hashMode: str = "compat",
+        windowPast: int | None = None,
+        windowFuture: int | None = None,
+        planner: RefreshPlanner | None = None,
+        shard: ShardCoordinator | None = None,
+        budget: float = 0.0,
+        profiler: Profiler | None = None,
     ) -> None:
         """
         Constructeur de la classe Worker.
@@ -21,23 +50,226 @@ class Worker:
         :type logger: Logger
         :param pool: Le pool de connexions
         :type pool: Pool
-        :param client: Le client Crous
-        :type client: Crous
-        :param restaurants: Les restaurants actifs
-        :type restaurants: list[int]
+        :param client: Le client de l'API du CROUS
+        :type client: CrousClient
+        :param restaurants: Les restaurants actifs. Ceux qui ne sont pas vus pendant le chargement seront désactivés
+        :type restaurants: Iterable[int]
+        :param concurrency: Le nombre de restaurants traités en parallèle par les étapes qui interrogent l'API du CROUS (``regions`` et ``menus``)
+        :type concurrency: int
+        :param dbConcurrency: Le nombre de restaurants enregistrés et de menus comparés en parallèle (étapes ``restaurants`` et ``diff``)
+        :type dbConcurrency: int
+        :param writeConcurrency: Le nombre d'écritures de menus en parallèle (étape ``write``)
+        :type writeConcurrency: int
+        :param queueSize: La taille maximale de la file de chaque étape (``0`` pour des files non bornées)
+        :type queueSize: int
+        :param imageConcurrency: Le nombre d'images chargées en parallèle
+        :type imageConcurrency: int
+        :param imageStore: Le stockage des images (``None`` pour enregistrer les images dans RAW_IMAGE)
+        :type imageStore: FileImageStore | None
+        :param retryBudget: Le temps maximal consacré aux nouvelles tentatives différées, en fin de chargement (secondes)
+        :type retryBudget: float
+        :param bulkSize: Le nombre de menus écrits par lot (``0`` pour écrire les menus un par un)
+        :type bulkSize: int
+        :param hashMode: Le mode de hash des menus (``compat`` ou ``fast``, voir ``HASH_MODES``)
+        :type hashMode: str
+        :param windowPast: Le nombre de jours passés dont les menus sont comparés et enregistrés (``None`` : tous)
+        :type windowPast: int | None
+        :param windowFuture: Le nombre de jours à venir dont les menus sont comparés et enregistrés (``None`` : tous)
+        :type windowFuture: int | None
+        :param planner: La planification des vérifications par restaurant (``None`` : tous les restaurants à chaque tâche)
+        :type planner: RefreshPlanner | None
+        :param shard: La répartition de la tâche entre plusieurs workers (``None`` : toutes les régions sont chargées par ce worker)
+        :type shard: ShardCoordinator | None
+        :param budget: Le temps alloué au chargement des données, depuis le lancement de la tâche (secondes, ``0`` : pas de limite)
+        :type budget: float
+        :param profiler: Le profilage des tâches (``None`` : pas de profilage)
+        :type profiler: Profiler | None
         """
         self.logger = logger
         self.pool = pool
         self.client = client
-        self.restaurants = restaurants
+        self.restaurants: set[int] = set(restaurants)
+
+        self.concurrency = concurrency
+        self.dbConcurrency = dbConcurrency
+        self.writeConcurrency = writeConcurrency
+        self.queueSize = queueSize
+        self.retryBudget = retryBudget
+
+        # Fenêtre d'ingestion : les menus hors de la fenêtre sont ignorés avant tout calcul de hash
+        self.windowPast = windowPast
+        self.windowFuture = windowFuture
+
+        self.planner = planner
+        self.shard = shard
+        self.profiler = profiler
+
+        # Temps alloué : une fois l'échéance passée (``perf_counter()``), les régions et les menus
+        # restants sont reportés à la tâche suivante, qui les charge en premier
+        self.budget = budget
+        self.deadline: float | None = None
+        self.postponed: set[int] = set()
+        self.priority: set[int] = set()
+
+        # Restaurants désactivés (ou inconnus) à sonder, et menus récupérés par le sondage
+        self.probeCandidates: list[tuple[Region, RU]] = []
+        self.probedMenus: dict[int, list[Menu]] = {}
+
+        self.pipeline: Pipeline | None = None
+
+        # Requêtes échouées, retentées en fin de chargement (nom de l'étape -> éléments)
+        self.deferred: dict[str, list] = {"regions": [], "menus": []}
+        self.retrying = False
+
+        # Échecs par région et par restaurant : [nombre d'échecs, dernière erreur si non résolue]
+        self.failedRegions: dict[int, list] = {}
+        self.failedRestaurants: dict[int, list] = {}
+
+        self.types: dict[str, int] = {}
+        self.typesLock = asyncio.Lock()
+
+        if hashMode not in HASH_MODES:
+            raise ValueError(f"Mode de hash inconnu : {hashMode}")
+
+        self.hashMode = hashMode
+
+        self.dishes = DishCache()
+        self.images = ImageLoader(logger, pool, client.session, imageConcurrency, store=imageStore)
+
+        # Mesures partagées avec le client de l'API (voir ``Metrics``)
+        self.metrics = client.metrics
+
+        # Lignes écrites pour les menus modifiés, et lignes qu'une réécriture complète aurait écrites,
+        # puis restaurants enregistrés (modifiés ou nouveaux) et restaurants inchangés
+        self.rows = Counter()
+
+        # Menus écrits (nouveaux ou modifiés) pendant le chargement, pour la mise à jour des agrégats
+        self.changedMenus: set[int] = set()
+
+        # Empreinte des champs enregistrés de chaque restaurant (RESTAURANT.EMPREINTE)
+        self.fingerprints: dict[int, str] = {}
+
+        self.bulk = BulkWriter(logger, pool, self.dishes, self.rows, bulkSize) if bulkSize > 0 else None
 
         self.taskId = None
-        self.requests = 0
 
-    async def getStats(self) -> dict:
+    @property
+    def requests(self) -> int:
+        """
+        Nombre de requêtes réussies à l'API du CROUS.
+        """
+        return self.client.requests
+
+    @property
+    def written(self) -> int:
+        """
+        Nombre de lignes écrites pour les restaurants et les menus modifiés.
+        """
+        return self.rows["ecrites"] + self.rows["restaurants"]
+
+    @property
+    def writtenTables(self) -> set[str]:
+        """
+        Tables modifiées pendant le chargement, pour le rafraîchissement des vues matérialisées.
         """
-        Récupère les statistiques.
+        tables = set()
 
+        if self.rows["regions"]:
+            tables.add("REGION")
+
+        if self.rows["types"]:
+            tables.add("TYPE_RESTAURANT")
+
+        if self.rows["restaurants"] or self.rows["desactives"] or self.rows["reactives"]:
+            tables.add("RESTAURANT")
+
+        if self.changedMenus:
+            tables.update(
+                (
+                    "MENU", "REPAS", "CATEGORIE", "COMPOSITION", "PLAT",
+                    "STATS_PLAT_JOUR", "STATS_RESTAURANT_JOUR", "STATS_PLAT_RESTAURANT",
+                )
+            )
+
+        return tables
+
+    @property
+    def expired(self) -> bool:
+        """
+        Indique si le temps alloué au chargement est écoulé.
+        """
+        return self.deadline is not None and perf_counter() >= self.deadline
+
+    def reset(self, restaurants: Iterable[int]) -> None:
+        """
+        Prépare une nouvelle tâche (mode démon) : les compteurs, les échecs et les menus écrits
+        de la tâche précédente sont remis à zéro. Les caches (plats, types de restaurants,
+        empreintes des restaurants) sont gardés.
+
+        :param restaurants: Les restaurants actifs. Ceux qui ne sont pas vus pendant le chargement seront désactivés
+        :type restaurants: Iterable[int]
+        """
+        self.restaurants = set(restaurants)
+
+        self.pipeline = None
+        self.deferred = {"regions": [], "menus": []}
+        self.retrying = False
+        self.failedRegions = {}
+        self.failedRestaurants = {}
+
+        # Le compteur est partagé avec l'écriture par lots : il est vidé, pas remplacé
+        self.rows.clear()
+        self.changedMenus = set()
+        self.probeCandidates = []
+        self.probedMenus = {}
+        self.deadline = None
+        self.postponed = set()
+        self.priority = set()
+
+        if self.bulk:
+            self.bulk.menus = []
+
+        self.dishes.hits = 0
+        self.dishes.misses = 0
+        self.images.counts.clear()
+
+        self.client.reset()
+        self.metrics.reset()
+        self.taskId = None
+
+    async def loadPriority(self) -> None:
+        """
+        Récupère les régions reportées par la tâche précédente, si elle a été interrompue
+        (temps alloué écoulé) : ce sont les régions les moins récemment chargées, elles sont
+        chargées en premier.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            row = await connection.fetchrow(
+                """
+                    SELECT STATUT, REPORTEES
+                    FROM TACHE
+                    WHERE FIN IS NOT NULL
+                    ORDER BY ID DESC
+                    LIMIT 1
+                """
+            )
+
+        if row and row["statut"] == "interrompue" and row["reportees"]:
+            self.priority = set(row["reportees"])
+            self.logger.info(f"{len(self.priority)} régions reportées par la tâche précédente, chargées en premier !")
+
+    async def getStats(self, estimate: bool = False) -> dict:
+        """
+        Récupère les statistiques (nombre de lignes de chaque table).
+
+        Les compteurs exacts (``v_compteurs``) sont mis à jour par les déclencheurs de chaque
+        table, dans la transaction qui écrit les lignes : ils sont toujours à jour. L'estimation
+        (``v_stats_estimation``) utilise les statistiques de l'optimiseur, pour l'affichage.
+
+        :param estimate: ``True`` pour une estimation plutôt que les compteurs exacts
+        :type estimate: bool
         :return: Les statistiques
         :rtype: dict
         """
@@ -45,58 +277,68 @@ class Worker:
             connection: Connection
 
             stats = await connection.fetchrow(
-                """
-                    SELECT * FROM v_stats;
-                """
+                f"SELECT * FROM {'v_stats_estimation' if estimate else 'v_compteurs'};"
             )
 
         return dict(stats)
 
-    async def _retry_region_get(self, retries: int = 3, delay: float = 1.0) -> list[Region]:
+    async def compactCounters(self) -> None:
+        """
+        Regroupe les différences enregistrées par les déclencheurs en une ligne par compteur.
         """
-        Retry wrapper for self.client.region.get().
+        async with self.pool.acquire() as connection:
+            connection: Connection
 
-        This method logs each attempt, increments the request counter on
-        successful calls, and retries the request a limited number of times
-        before propagating the last encountered exception.
+            await connection.execute("SELECT compact_counters();")
 
-        :param retries: Number of attempts
-        :type retries: int
-        :param delay: Delay between attempts (seconds)
-        :type delay: float
-        :return: List of regions
-        :rtype: list[Region]
+    def collectMetrics(self) -> None:
+        """
+        Ajoute aux mesures les compteurs de la tâche : lignes écrites et restaurants traités, et
+        accès aux caches (plats en mémoire, empreintes des restaurants, hash des menus, images).
         """
-        last_exception = None
+        for name, value in self.rows.items():
+            self.metrics.count("lignes", name, value)
+
+        self.metrics.cache("plats", self.dishes.hits, self.dishes.misses)
+        self.metrics.cache("restaurants", self.rows["restaurants_inchanges"], self.rows["restaurants"])
+        self.metrics.cache("menus", self.rows["menus_inchanges"], self.rows["menus_modifies"])
+        self.metrics.cache(
+            "images",
+            self.images.counts["fraiches"] + self.images.counts["inchangees"],
+            self.images.counts["telechargees"],
+        )
 
-        for attempt in range(1, retries + 1):
-            try:
-                self.logger.debug(
-                    f"GET /regions (attempt {attempt}/{retries})"
-                )
-                regions = await self.client.region.get()
-                self.requests += 1
-                return regions
-            except Exception as e:
-                last_exception = e
-                self.logger.warning(
-                    f"Failed to load regions "
-                    f"(attempt {attempt}/{retries}): {e}"
-                )
+    async def loadDishes(self) -> None:
+        """
+        Charge le dictionnaire des plats (LIBELLE -> PLATID) en mémoire.
+        """
+        self.logger.info("Chargement des plats...")
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
 
-                if attempt < retries:
-                    await asyncio.sleep(delay * attempt)
+            await self.dishes.load(connection)
 
-        self.logger.error(
-            f"Failed to load regions after {retries} attempts"
-        )
+        self.logger.info(f"{len(self.dishes)} plats chargés !")
+
+    async def loadFingerprints(self) -> None:
+        """
+        Charge l'empreinte des restaurants enregistrés (RID -> EMPREINTE) en mémoire.
+        """
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            rows = await connection.fetch(
+                """
+                    SELECT RID, EMPREINTE
+                    FROM RESTAURANT
+                    WHERE EMPREINTE IS NOT NULL
+                """
+            )
 
-        if last_exception is not None:
-            raise last_exception
+        self.fingerprints = {row["rid"]: row["empreinte"] for row in rows}
 
-        raise RuntimeError(
-            "Failed to load regions after retries, but no exception was captured"
-        )
+        self.logger.info(f"{len(self.fingerprints)} empreintes de restaurants chargées !")
 
     async def loadRegions(self) -> list[Region]:
         """
@@ -107,14 +349,14 @@ class Worker:
         """
         self.logger.info("Chargement des régions...")
 
-        regions = await self._retry_region_get()
+        regions = await self.client.regions()
 
         self.logger.info(f"{len(regions)} régions chargées !")
 
         async with self.pool.acquire() as connection:
             connection: Connection
             for region in regions:
-                await connection.execute(
+                status = await connection.execute(
                     """
                         INSERT INTO region (IDREG, LIBELLE) 
                         VALUES ($1, $2) 
@@ -124,530 +366,1005 @@ class Worker:
                     region.name,
                 )
 
+                self.rows["regions"] += rowCount(status)
+
         self.logger.info("Régions enregistrées !")
 
         return regions
 
-    async def _retry_ru_get(self, region_id: int, retries: int = 3, delay: float = 1.0):
+    async def loadRestaurants(self, regions: list[Region]) -> None:
         """
-        Retry wrapper for self.client.ru.get()
+        Charge les restaurants et leurs menus, et les enregistre dans la base de données.
+
+        Le chargement est un pipeline d'étapes reliées par des files bornées, chacune avec
+        son propre nombre de tâches :
+
+        - ``regions`` : liste des restaurants de chaque région (API)
+        - ``restaurants`` : enregistrement des restaurants actifs et de leur image
+        - ``menus`` : récupération des menus (API)
+        - ``diff`` : calcul des hash et comparaison avec les menus enregistrés
+        - ``write`` : écriture des menus modifiés
+
+        Une étape lente (API ou base de données) ralentit les étapes en amont sans bloquer
+        les autres, et le bilan du pipeline indique laquelle limite le débit.
 
-        :param region_id: Region ID
-        :type region_id: int
-        :param retries: Number of attempts
-        :type retries: int
-        :param delay: Delay between attempts (seconds)
-        :type delay: float
-        :return: List of restaurants for the specified region
-        :rtype: list[RU]
+        Les requêtes à l'API ne sont d'abord tentées qu'une fois : en cas d'échec, la région ou
+        le restaurant est mis de côté et le chargement continue. Les requêtes mises de côté
+        sont retentées à la fin, avec toutes leurs tentatives, dans la limite de ``retryBudget``
+        secondes. Les échecs sont enregistrés dans TACHE_LOG.
+
+        Avec une planification (``planner``), seuls les menus des restaurants à vérifier sont
+        récupérés, et les restaurants désactivés sont sondés (voir ``probeRestaurants``).
+
+        Avec une répartition entre plusieurs workers (``shard``), seules les régions réclamées
+        par ce worker sont chargées (voir ``loadShard``).
+
+        Avec un temps alloué (``budget``), les régions reportées par la tâche précédente sont
+        chargées en premier ; une fois l'échéance passée, les régions et les menus restants
+        sont reportés (``postponed``), sans désactiver leurs restaurants.
+
+        :param regions: Les régions
+        :type regions: list[Region]
         """
-        last_exception = None
+        self.logger.info("Chargement des restaurants...")
 
-        for attempt in range(1, retries + 1):
-            try:
-                self.logger.debug(
-                    f"GET /regions/{region_id}/restaurants (attempt {attempt}/{retries})"
-                )
-                restaurants = await self.client.ru.get(region_id)
-                self.requests += 1
-                return restaurants
-            except Exception as e:
-                last_exception = e
-                self.logger.warning(
-                    f"Failed to load restaurants for region {region_id} "
-                    f"(attempt {attempt}/{retries}): {e}"
-                )
+        if self.planner:
+            await self.planner.load(self.restaurants)
+
+        try:
+            if self.shard:
+                await self.loadShard(regions)
+            else:
+                self.pipeline = self.createPipeline()
 
-                if attempt < retries:
-                    await asyncio.sleep(delay * attempt)
+                # Tri stable : les régions reportées d'abord, les autres dans l'ordre de l'API
+                with self.metrics.phase("pipeline"):
+                    await self.pipeline.run(sorted(regions, key=lambda region: region.id not in self.priority))
 
-        self.logger.error(
-            f"Failed to load restaurants for region {region_id} after {retries} attempts"
-        )
+                self.metrics.stages(self.pipeline.stats())
+
+                with self.metrics.phase("nouvelles_tentatives"):
+                    await self.retryDeferred()
 
-        if last_exception is not None:
-            raise last_exception
+            with self.metrics.phase("sondage"):
+                await self.probeRestaurants()
 
-        raise RuntimeError(
-            "Failed to load restaurants after retries, but no exception was captured"
+            with self.metrics.phase("images"):
+                await self.images.load()
+
+            # Écriture des derniers menus en tampon
+            if self.bulk:
+                with self.metrics.phase("ecriture_par_lots"):
+                    await self.bulk.flush()
+        finally:
+            self.client.report()
+
+            # Même après une erreur : les agrégats des menus déjà écrits doivent être à jour,
+            # ces menus ne seront plus réécrits au prochain cycle (hash inchangé)
+            with self.metrics.phase("agregats"):
+                await self.updateRollups()
+
+            if self.planner:
+                await self.planner.save()
+
+        self.logger.info(
+            f"{self.rows['restaurants']:,d} restaurants enregistrés, {self.rows['restaurants_inchanges']:,d} inchangés !"
+        )
+        self.logger.info(
+            f"{self.rows['ecrites']:,d} lignes écrites pour les menus modifiés "
+            f"(une réécriture complète en aurait écrit {self.rows['reecriture']:,d}) !"
         )
+        self.logger.info(f"{self.rows['hors_fenetre']:,d} menus hors de la fenêtre d'ingestion ignorés !")
 
-    async def loadRestaurants(self, regions: list[Region]) -> None:
+        if self.planner:
+            self.logger.info(f"{self.rows['non_planifies']:,d} restaurants non vérifiés (vérification planifiée plus tard) !")
+
+        if self.postponed:
+            self.logger.warning(
+                f"Temps alloué écoulé : {len(self.postponed)} régions reportées à la tâche suivante, "
+                f"dont {self.rows['reportes']:,d} restaurants sans vérification des menus !"
+            )
+
+    async def loadShard(self, regions: list[Region]) -> None:
         """
-        Charge les restaurants et les enregistre dans la base de données.
+        Charge les régions réclamées par ce worker (voir ``ShardCoordinator``) : les régions
+        sont réclamées au fil du pipeline, tant qu'il en reste, puis marquées comme terminées
+        après les nouvelles tentatives. Les régions d'un worker arrêté, libérées entre-temps,
+        sont chargées à leur tour.
 
         :param regions: Les régions
         :type regions: list[Region]
         """
-        self.logger.info("Chargement des restaurants...")
+        byId = {region.id: region for region in regions}
 
-        async with self.pool.acquire() as connection:
-            connection: Connection
+        await self.shard.register(list(byId))
 
-            for region in regions:
-                self.logger.info(
-                    f"Chargement des restaurants pour la région {region.name}..."
-                )
+        while True:
+            self.pipeline = self.createPipeline()
 
-                restaurants = await self._retry_ru_get(region.id)
+            with self.metrics.phase("pipeline"):
+                await self.pipeline.run(self.claimRegions(byId))
 
-                self.logger.info(
-                    f"{len(restaurants)} restaurants chargés pour la région {region.name} !"
-                )
+            self.metrics.stages(self.pipeline.stats())
 
-                for restaurant in restaurants:
-                    restaurant: RU
+            with self.metrics.phase("nouvelles_tentatives"):
+                await self.retryDeferred()
+            await self.shard.complete()
 
-                    # Vérifie si le restaurant était actif lors de la dernière mise à jour. Limite le nombre de requêtes inutiles.
-                    if restaurant.id not in self.restaurants:
-                        self.logger.debug(
-                            f"Le restaurant {restaurant.title} n'est pas actif !"
-                        )
-                        continue
+            # Temps alloué écoulé : les régions restantes sont laissées à la tâche suivante
+            if self.expired or not await self.shard.pending():
+                break
 
-                    tpRestaurantID = await connection.fetchval(
-                        "SELECT IDTPR FROM TYPE_RESTAURANT WHERE LIBELLE = $1",
-                        restaurant.type,
-                    )
+        self.logger.info(f"{len(self.shard.claimed)} régions chargées par ce worker !")
+
+    async def claimRegions(self, regions: dict[int, Region]) -> AsyncIterator[Region]:
+        """
+        Réclame les régions une à une, pour l'étape ``regions``. Aucune région n'est réclamée
+        tant que les files du pipeline sont pleines : les régions restantes peuvent être prises
+        par un worker moins chargé.
+
+        :param regions: Les régions, par identifiant
+        :type regions: dict[int, Region]
+        :return: Les régions réclamées
+        :rtype: AsyncIterator[Region]
+        """
+        while True:
+            while self.pipeline.backlog > self.concurrency:
+                await asyncio.sleep(0.5)
+
+            if self.expired:
+                return
 
-                    if not tpRestaurantID:
-                        await connection.execute(
-                            """
-                                INSERT INTO type_restaurant (LIBELLE) 
-                                VALUES ($1) 
-                                ON CONFLICT DO NOTHING
-                            """,
-                            restaurant.type,
-                        )
-
-                        tpRestaurantID = await connection.fetchval(
-                            "SELECT IDTPR FROM TYPE_RESTAURANT WHERE LIBELLE = $1",
-                            restaurant.type,
-                        )
-
-                    async with connection.transaction():
-                        await connection.execute(
-                            """
-                                INSERT INTO restaurant (RID, IDREG, IDTPR, NOM, ADRESSE, LATITUDE, LONGITUDE, HORAIRES, JOURS_OUVERT, IMAGE_URL, EMAIL, TELEPHONE, ISPMR, ZONE, PAIEMENT, ACCES, OPENED, AJOUT)
-                                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18)
-                                ON CONFLICT (RID) DO UPDATE SET
-                                    IDTPR = $3,
-                                    NOM = $4,
-                                    ADRESSE = $5,
-                                    LATITUDE = $6,
-                                    LONGITUDE = $7,
-                                    HORAIRES = $8,
-                                    JOURS_OUVERT = $9,
-                                    IMAGE_URL = $10,
-                                    EMAIL = $11,
-                                    TELEPHONE = $12,
-                                    ISPMR = $13,
-                                    ZONE = $14,
-                                    PAIEMENT = $15,
-                                    ACCES = $16,
-                                    OPENED = $17,
-                                    MIS_A_JOUR = $18
-                            """,
-                            restaurant.id,
-                            region.id,
-                            tpRestaurantID,
-                            restaurant.title,
-                            restaurant.contact.address,
-                            restaurant.lat,
-                            restaurant.lon,
-                            dumps(restaurant.infos.horaires)
-                            if restaurant.infos.horaires
-                            else None,
-                            restaurant.opening,
-                            restaurant.image_url,
-                            restaurant.contact.email,
-                            restaurant.contact.phone,
-                            restaurant.infos.pmr,
-                            restaurant.zone,
-                            dumps(restaurant.infos.paiements)
-                            if restaurant.infos.paiements
-                            else None,
-                            dumps(restaurant.infos.acces)
-                            if restaurant.infos.acces
-                            else None,
-                            restaurant.open,
-                            datetime.now(),
-                        )
-
-                    if restaurant.image_url:
-                        lastUpdate = await connection.fetchval(
-                            "SELECT DERNIERE_MODIFICATION FROM RESTAURANT_IMAGE WHERE IMAGE_URL = $1",
-                            restaurant.image_url,
-                        )
-
-                        if not lastUpdate or ((datetime.now() - lastUpdate).days >= 7):
-                            await self.loadImage(restaurant.image_url)
-
-                    if restaurant.id in self.restaurants:
-                        self.restaurants.remove(restaurant.id)
-
-                    if self.taskId:
-                        await connection.execute(
-                            """
-                                INSERT INTO TACHE_LOG (RID, IDTACHE)
-                                VALUES ($1, $2)
-                            """,
-                            restaurant.id,
-                            self.taskId,
-                        )
-
-                    # if restaurant.open:
-                    #     await self.loadMenus(region, restaurant)
-                    # else:
-                    #     self.logger.debug(f"Le restaurant {restaurant.title} est fermé ! Aucun menu ne sera chargé.")
-
-                    # Le restaurant peut être fermé aujourd'hui mais les menus peuvent être disponibles pour les jours suivants
-                    await self.loadMenus(region, restaurant)
+            idreg = await self.shard.claim(self.priority)
 
-    def compute_menu_hash(self, menu: Menu) -> str:
+            if idreg is None:
+                return
+
+            # Région inscrite par un autre worker, absente de la liste chargée par celui-ci
+            if idreg not in regions:
+                self.logger.warning(f"Région {idreg} inconnue de ce worker, ignorée !")
+                continue
+
+            yield regions[idreg]
+
+    async def updateRollups(self) -> None:
         """
-        Calcule un hash unique pour un menu basé sur son contenu complet.
+        Met à jour les agrégats des menus (tables STATS_*) pour les menus écrits pendant le
+        chargement, avec la fonction ``rollup_menus``.
+        """
+        if not self.changedMenus:
+            self.logger.info("Aucun menu écrit, agrégats inchangés !")
+            return
 
-        :param menu: Le menu pour lequel calculer le hash
-        :type menu: Menu
-        :return: Hash SHA256 du contenu du menu
-        :rtype: str
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            days = await connection.fetchval(
+                "SELECT rollup_menus($1::int[])",
+                sorted(self.changedMenus),
+            )
+
+        self.logger.info(f"Agrégats mis à jour pour {days:,d} jours de menus !")
+
+    def createPipeline(self) -> Pipeline:
+        """
+        Crée le pipeline de chargement des restaurants et des menus.
+
+        Pendant une tâche profilée, la durée passée sur chaque restaurant est mesurée à chaque étape.
+
+        :return: Le pipeline
+        :rtype: Pipeline
         """
-        # Créer une représentation structurée du menu pour le hachage
-        # Note: On n'inclut pas l'ID car on compare par ID, uniquement le contenu
-        menu_data = {
-            "date": str(menu.date),
-            "meals": []
+        handlers = {
+            "restaurants": self.loadRestaurant,
+            "menus": self.fetchMenus,
+            "diff": self.diffMenus,
+            "write": self.writeMenus,
         }
 
-        for meal in menu.meals:
-            meal_data = {
-                "name": meal.name,
-                "categories": []
+        if self.profiler and self.profiler.active:
+            # Éléments des étapes : (région, restaurant) puis (restaurant, menus)
+            handlers = {
+                stage: self.profiler.timed(
+                    stage, handler, (lambda item: item[1]) if stage in ("restaurants", "menus") else (lambda item: item[0])
+                )
+                for stage, handler in handlers.items()
             }
 
-            for category in meal.categories:
-                category_data = {
-                    "name": category.name,
-                    "dishes": [dish.name for dish in category.dishes]
-                }
-                meal_data["categories"].append(category_data)
+        return Pipeline(
+            self.logger,
+            [
+                Stage("regions", self.loadRegion, self.concurrency, self.queueSize),
+                Stage("restaurants", handlers["restaurants"], self.dbConcurrency, self.queueSize),
+                Stage("menus", handlers["menus"], self.concurrency, self.queueSize),
+                Stage("diff", handlers["diff"], self.dbConcurrency, self.queueSize),
+                Stage("write", handlers["write"], self.writeConcurrency, self.queueSize),
+            ],
+        )
 
-            menu_data["meals"].append(meal_data)
+    def deferFailure(self, failures: dict[int, list], key: int, stage: str, item, error: Exception) -> None:
+        """
+        Enregistre l'échec d'une requête et, lors du premier passage, la met de côté pour
+        une nouvelle tentative en fin de chargement.
+
+        :param failures: Les échecs (par région ou par restaurant)
+        :type failures: dict[int, list]
+        :param key: L'identifiant de la région ou du restaurant
+        :type key: int
+        :param stage: L'étape à laquelle reprendre
+        :type stage: str
+        :param item: L'élément de l'étape
+        :param error: L'erreur rencontrée
+        :type error: Exception
+        """
+        failure = failures.setdefault(key, [0, None])
+        failure[0] += 1
+        failure[1] = f"{type(error).__name__}: {error}"[:500]
 
-        # Convertir en JSON et calculer le hash
-        menu_json = dumps(menu_data, sort_keys=True, ensure_ascii=False)
-        return hashlib.sha256(menu_json.encode('utf-8')).hexdigest()
+        if not self.retrying:
+            self.deferred[stage].append(item)
 
-    async def _retry_menu_get(self, region_id: int, ru_id: int, retries: int = 3, delay: float = 1.0):
+    def resolveFailure(self, failures: dict[int, list], key: int) -> None:
         """
-        Récupère les menus d'un restaurant avec une logique de nouvelle tentative
-        en cas d'échec de l'appel à ``self.client.menu.get``.
+        Marque comme résolu l'échec d'une région ou d'un restaurant, après une nouvelle tentative réussie.
 
-        Cette méthode encapsule l'appel à l'API des menus avec un nombre maximal
-        de tentatives configurables et un délai croissant entre chaque tentative.
+        :param failures: Les échecs (par région ou par restaurant)
+        :type failures: dict[int, list]
+        :param key: L'identifiant de la région ou du restaurant
+        :type key: int
+        """
+        if key in failures:
+            failures[key][1] = None
 
-        :param region_id: Identifiant de la région du restaurant cible.
-        :type region_id: int
-        :param ru_id: Identifiant du restaurant universitaire pour lequel charger les menus.
-        :type ru_id: int
-        :param retries: Nombre maximal de tentatives avant d'abandonner.
-        :type retries: int
-        :param delay: Délai de base (en secondes) avant la prochaine tentative, multiplié par le numéro de la tentative.
-        :type delay: float
-        :return: Liste des menus récupérés pour le restaurant.
-        :rtype: list[Menu]
-        :raises Exception: Relève la dernière exception rencontrée si toutes les tentatives échouent.
+    async def retryDeferred(self) -> None:
         """
-        last_exception = None
+        Retente les requêtes mises de côté, dans la limite de ``retryBudget`` secondes, puis
+        enregistre les échecs dans TACHE_LOG. Les requêtes vers une région dont le disjoncteur
+        est ouvert attendent d'abord la fin de son délai, décomptée du temps alloué.
+        """
+        seeds, self.deferred = self.deferred, {"regions": [], "menus": []}
+        count = sum(len(items) for items in seeds.values())
+
+        # Les nouvelles tentatives ne dépassent pas le temps alloué à la tâche
+        budget = self.retryBudget
+
+        if self.deadline is not None:
+            budget = max(0.0, min(budget, self.deadline - perf_counter()))
+
+        if count:
+            # Les disjoncteurs ouverts par le premier passage refuseraient toutes les nouvelles
+            # tentatives sans les envoyer : elles attendent que les requêtes soient de nouveau tentées
+            regions = {region.id for region in seeds["regions"]} | {region.id for region, _ in seeds["menus"]}
+            delay = min(self.client.reopening(regions), budget)
+
+            if delay > 0:
+                self.logger.info(f"Disjoncteurs ouverts : nouvelles tentatives dans {delay:.0f}s...")
+
+                await asyncio.sleep(delay)
+                budget -= delay
+
+            self.logger.info(f"Nouvelle tentative pour {count} requêtes échouées...")
+
+            self.retrying = True
 
-        for attempt in range(1, retries + 1):
             try:
-                self.logger.debug(
-                    f"GET /regions/{region_id}/restaurants/{ru_id}/menus (attempt {attempt}/{retries})"
+                async with asyncio.timeout(budget):
+                    await self.createPipeline().run([], seeds)
+            except TimeoutError:
+                self.logger.warning(
+                    f"Temps alloué aux nouvelles tentatives écoulé ({budget:.0f}s) !"
                 )
-                menus = await self.client.menu.get(region_id, ru_id)
-                self.requests += 1
-                return menus
+            finally:
+                self.retrying = False
+
+        await self.recordFailures()
+
+    async def probeRestaurants(self) -> None:
+        """
+        Sonde les restaurants désactivés (ou inconnus) présents dans la liste de leur région, et
+        dont le sondage est planifié : leurs menus sont récupérés, avec une seule tentative. Un
+        restaurant qui a de nouveau des menus est réactivé (voir ``updateRestaurantsStatus``) et
+        chargé comme un restaurant actif, sans nouvelle requête pour ses menus.
+        """
+        candidates, self.probeCandidates = self.probeCandidates, []
+
+        if not candidates:
+            return
+
+        if self.expired:
+            self.logger.info(f"Temps alloué écoulé : sondage de {len(candidates)} restaurants désactivés reporté !")
+            return
+
+        self.logger.info(f"Sondage de {len(candidates)} restaurants désactivés...")
+
+        async def probe(region: Region, ru: RU) -> None:
+            try:
+                menus = await self.client.menus(region.id, ru.id, 1)
             except Exception as e:
-                last_exception = e
-                self.logger.warning(
-                    f"Failed to load menus for restaurant {ru_id} in region {region_id} "
-                    f"(attempt {attempt}/{retries}): {e}"
+                self.logger.debug(f"Sondage du restaurant {ru.title} impossible ({e}) !")
+                return
+
+            self.rows["sondes"] += 1
+
+            if menus:
+                self.probedMenus[ru.id] = menus
+                self.planner.reactivated.add(ru.id)
+            else:
+                self.planner.record(ru.id, False)
+
+        async with asyncio.TaskGroup() as group:
+            for region, ru in candidates:
+                group.create_task(probe(region, ru))
+
+        found = [(region, ru) for region, ru in candidates if ru.id in self.probedMenus]
+
+        if found:
+            self.logger.info(f"{len(found)} restaurants désactivés ont de nouveau des menus !")
+
+            await self.createPipeline().run([], {"restaurants": found})
+
+    async def recordFailures(self) -> None:
+        """
+        Enregistre dans TACHE_LOG le nombre d'échecs de chaque restaurant et, si l'échec n'a
+        pas été résolu, la dernière erreur. L'échec d'une région est reporté sur ses restaurants
+        actifs, qui sont conservés actifs : ils n'ont pas pu être vérifiés.
+        """
+        if not self.failedRegions and not self.failedRestaurants:
+            return
+
+        failures = dict(self.failedRestaurants)
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            if self.failedRegions:
+                rows = await connection.fetch(
+                    """
+                        SELECT RID, IDREG
+                        FROM RESTAURANT
+                        WHERE IDREG = ANY($1::int[]) AND ACTIF = TRUE
+                    """,
+                    list(self.failedRegions),
                 )
 
-                if attempt < retries:
-                    await asyncio.sleep(delay * attempt)
+                for row in rows:
+                    count, error = self.failedRegions[row["idreg"]]
+                    failures.setdefault(row["rid"], [count, error])
 
-        self.logger.error(
-            f"Failed to load menus for restaurant {ru_id} in region {region_id} after {retries} attempts"
-        )
+                    # Région toujours indisponible : le restaurant n'a pas été vu, mais ne doit pas être désactivé
+                    if error:
+                        self.restaurants.discard(row["rid"])
+
+            if self.taskId and failures:
+                await connection.execute(
+                    """
+                        INSERT INTO TACHE_LOG (RID, IDTACHE, ECHECS, ERREUR)
+                        SELECT U.RID, $1, U.ECHECS, U.ERREUR
+                        FROM unnest($2::int[], $3::int[], $4::varchar[]) AS U(RID, ECHECS, ERREUR)
+                        ON CONFLICT (RID, IDTACHE) DO UPDATE SET
+                            ECHECS = EXCLUDED.ECHECS,
+                            ERREUR = EXCLUDED.ERREUR
+                    """,
+                    self.taskId,
+                    list(failures),
+                    [count for count, _ in failures.values()],
+                    [error for _, error in failures.values()],
+                )
 
-        if last_exception is not None:
-            raise last_exception
+        unresolved = sum(1 for _, error in failures.values() if error)
 
-        raise RuntimeError(
-            "Failed to load menus after retries, but no exception was captured"
+        self.logger.warning(
+            f"{len(failures)} restaurants ont rencontré des erreurs, dont {unresolved} non résolues !"
         )
 
-    async def loadMenus(self, region: Region, ru: RU) -> None:
+    async def loadRegion(self, region: Region) -> list[tuple[Region, RU]]:
         """
-        Charge les menus et les enregistre dans la base de données.
+        Étape ``regions`` : charge la liste des restaurants d'une région.
 
         :param region: La région
         :type region: Region
-        :param ru: Le restaurant universitaire
-        :type ru: RU
+        :return: Les restaurants actifs de la région, pour l'étape ``restaurants``
+        :rtype: list[tuple[Region, RU]]
         """
-        self.logger.info(f"Chargement des menus pour le restaurant {ru.title}...")
+        # Temps alloué écoulé : la région est reportée, ses restaurants ne sont pas désactivés
+        if self.expired:
+            self.postponed.add(region.id)
+            return []
+
+        self.logger.info(
+            f"Chargement des restaurants pour la région {region.name}..."
+        )
+
+        try:
+            restaurants = await self.client.restaurants(region.id, None if self.retrying else 1)
+        except Exception as e:
+            self.deferFailure(self.failedRegions, region.id, "regions", region, e)
+            return []
+
+        if self.retrying:
+            self.resolveFailure(self.failedRegions, region.id)
+
+        self.logger.info(
+            f"{len(restaurants)} restaurants chargés pour la région {region.name} !"
+        )
+
+        active = []
+
+        for restaurant in restaurants:
+            restaurant: RU
+
+            # Vérifie si le restaurant était actif lors de la dernière mise à jour. Limite le nombre de requêtes inutiles.
+            if restaurant.id not in self.restaurants:
+                self.logger.debug(
+                    f"Le restaurant {restaurant.title} n'est pas actif !"
+                )
+
+                # Restaurant désactivé : sondé de temps en temps, après le chargement
+                if self.planner and not self.retrying and self.planner.probe(restaurant.id):
+                    self.probeCandidates.append((region, restaurant))
 
-        menus = await self._retry_menu_get(region.id, ru.id)
+                continue
 
-        self.logger.info(f"{len(menus)} menus chargés pour le restaurant {ru.title} !")
+            active.append((region, restaurant))
+
+        return active
+
+    async def getRestaurantType(self, connection: Connection, libelle: str) -> int:
+        """
+        Récupère l'identifiant d'un type de restaurant, en le créant si nécessaire.
+        Les identifiants sont mis en cache, et la création est protégée par un verrou
+        pour éviter les doublons lorsque plusieurs restaurants sont traités en parallèle.
+
+        :param connection: La connexion à la base de données
+        :type connection: Connection
+        :param libelle: Le libellé du type de restaurant
+        :type libelle: str
+        :return: L'identifiant du type de restaurant
+        :rtype: int
+        """
+        if libelle in self.types:
+            return self.types[libelle]
+
+        async with self.typesLock:
+            if libelle in self.types:
+                return self.types[libelle]
+
+            tpRestaurantID = await connection.fetchval(
+                "SELECT IDTPR FROM TYPE_RESTAURANT WHERE LIBELLE = $1",
+                libelle,
+            )
+
+            if not tpRestaurantID:
+                status = await connection.execute(
+                    """
+                        INSERT INTO type_restaurant (LIBELLE) 
+                        VALUES ($1) 
+                        ON CONFLICT DO NOTHING
+                    """,
+                    libelle,
+                )
+
+                self.rows["types"] += rowCount(status)
+
+                tpRestaurantID = await connection.fetchval(
+                    "SELECT IDTPR FROM TYPE_RESTAURANT WHERE LIBELLE = $1",
+                    libelle,
+                )
+
+            self.types[libelle] = tpRestaurantID
+
+        return tpRestaurantID
+
+    async def loadRestaurant(self, item: tuple[Region, RU]) -> list[tuple[Region, RU]]:
+        """
+        Étape ``restaurants`` : enregistre un restaurant, et ajoute son image aux images à charger.
+
+        :param item: La région et le restaurant universitaire
+        :type item: tuple[Region, RU]
+        :return: Le restaurant, pour l'étape ``menus``
+        :rtype: list[tuple[Region, RU]]
+        """
+        region, restaurant = item
 
         async with self.pool.acquire() as connection:
             connection: Connection
 
-            async with connection.transaction():
-                for menu in menus:
-                    # Calculer le hash du menu
-                    menu_hash = self.compute_menu_hash(menu)
-
-                    # Vérifier si le menu existe déjà et si son hash a changé
-                    existing_hash = await connection.fetchval(
-                        "SELECT MENU_HASH FROM MENU WHERE MID = $1",
-                        menu.id,
-                    )
+            tpRestaurantID = await self.getRestaurantType(connection, restaurant.type)
+
+            values = [
+                tpRestaurantID,
+                restaurant.title,
+                restaurant.contact.address,
+                restaurant.lat,
+                restaurant.lon,
+                restaurant.infos.horaires or None,
+                restaurant.opening,
+                restaurant.image_url,
+                restaurant.contact.email,
+                restaurant.contact.phone,
+                restaurant.infos.pmr,
+                restaurant.zone,
+                restaurant.infos.paiements or None,
+                restaurant.infos.acces or None,
+                restaurant.open,
+            ]
+            empreinte = fingerprint(values)
+
+            # Restaurant inchangé depuis le dernier enregistrement : aucune écriture, MIS_A_JOUR
+            # reste la date du dernier changement réel
+            if self.fingerprints.get(restaurant.id) == empreinte:
+                self.rows["restaurants_inchanges"] += 1
+            else:
+                # La condition sur EMPREINTE évite aussi une réécriture si un autre worker a
+                # déjà enregistré les mêmes valeurs
+                status = await connection.execute(
+                    """
+                        INSERT INTO restaurant (RID, IDREG, IDTPR, NOM, ADRESSE, LATITUDE, LONGITUDE, HORAIRES, JOURS_OUVERT, IMAGE_URL, EMAIL, TELEPHONE, ISPMR, ZONE, PAIEMENT, ACCES, OPENED, AJOUT, EMPREINTE)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19)
+                        ON CONFLICT (RID) DO UPDATE SET
+                            IDTPR = $3,
+                            NOM = $4,
+                            ADRESSE = $5,
+                            LATITUDE = $6,
+                            LONGITUDE = $7,
+                            HORAIRES = $8,
+                            JOURS_OUVERT = $9,
+                            IMAGE_URL = $10,
+                            EMAIL = $11,
+                            TELEPHONE = $12,
+                            ISPMR = $13,
+                            ZONE = $14,
+                            PAIEMENT = $15,
+                            ACCES = $16,
+                            OPENED = $17,
+                            MIS_A_JOUR = $18,
+                            EMPREINTE = $19
+                        WHERE restaurant.EMPREINTE IS DISTINCT FROM EXCLUDED.EMPREINTE
+                    """,
+                    restaurant.id,
+                    region.id,
+                    tpRestaurantID,
+                    restaurant.title,
+                    restaurant.contact.address,
+                    restaurant.lat,
+                    restaurant.lon,
+                    dumpsJSON(restaurant.infos.horaires)
+                    if restaurant.infos.horaires
+                    else None,
+                    restaurant.opening,
+                    restaurant.image_url,
+                    restaurant.contact.email,
+                    restaurant.contact.phone,
+                    restaurant.infos.pmr,
+                    restaurant.zone,
+                    dumpsJSON(restaurant.infos.paiements)
+                    if restaurant.infos.paiements
+                    else None,
+                    dumpsJSON(restaurant.infos.acces)
+                    if restaurant.infos.acces
+                    else None,
+                    restaurant.open,
+                    datetime.now(),
+                    empreinte,
+                )
 
-                    # Si le hash n'a pas changé, on peut ignorer ce menu
-                    if existing_hash == menu_hash:
-                        await connection.execute(
-                            """
-                            UPDATE MENU
-                            SET LAST_CHECKED = $2
-                            WHERE MID = $1
-                            """,
-                            menu.id,
-                            datetime.now(),
-                        )
-                        self.logger.debug(f"Menu {menu.id} inchangé, skip")
-                        continue
-
-                    # Si le menu a changé ou n'existe pas, supprimer les anciens enregistrements liés
-                    await connection.execute(
-                        """
-                            DELETE FROM COMPOSITION 
-                            WHERE CATID IN (
-                                SELECT CATID FROM CATEGORIE WHERE RPID IN (
-                                    SELECT RPID FROM REPAS WHERE MID = $1
-                                )
-                            )
-                        """,
-                        menu.id,
-                    )
+                self.fingerprints[restaurant.id] = empreinte
 
-                    await connection.execute(
-                        """
-                            DELETE FROM CATEGORIE 
-                            WHERE RPID IN (
-                                SELECT RPID FROM REPAS WHERE MID = $1
-                            )
-                        """,
-                        menu.id,
-                    )
+                if rowCount(status):
+                    self.rows["restaurants"] += 1
+                else:
+                    self.rows["restaurants_inchanges"] += 1
 
-                    await connection.execute(
-                        "DELETE FROM REPAS WHERE MID = $1",
-                        menu.id,
-                    )
+            self.restaurants.discard(restaurant.id)
 
-                    # Insérer ou mettre à jour le menu avec le nouveau hash
-                    await connection.execute(
-                        """
-                            INSERT INTO MENU (MID, RID, DATE, MENU_HASH)
-                            VALUES ($1, $2, $3, $4) 
-                            ON CONFLICT (MID) DO UPDATE 
-                            SET MENU_HASH = EXCLUDED.MENU_HASH
-                        """,
-                        menu.id,
-                        ru.id,
-                        menu.date,
-                        menu_hash,
-                    )
+            if self.taskId:
+                await connection.execute(
+                    """
+                        INSERT INTO TACHE_LOG (RID, IDTACHE)
+                        VALUES ($1, $2)
+                        ON CONFLICT DO NOTHING
+                    """,
+                    restaurant.id,
+                    self.taskId,
+                )
+
+        # L'image est chargée en fin de chargement, une seule fois par URL
+        self.images.add(restaurant.image_url)
+
+        # if not restaurant.open:
+        #     self.logger.debug(f"Le restaurant {restaurant.title} est fermé ! Aucun menu ne sera chargé.")
+        #     return []
+
+        # Menus vérifiés plus tard (planification) : le restaurant est tout de même enregistré et compté comme vu
+        if self.planner and not self.planner.isDue(restaurant.id) and restaurant.id not in self.probedMenus:
+            self.rows["non_planifies"] += 1
+            return []
+
+        # Le restaurant peut être fermé aujourd'hui mais les menus peuvent être disponibles pour les jours suivants
+        return [item]
+
+    def compute_menu_hash(self, menu: Menu) -> str:
+        """
+        Calcule un hash unique pour un menu basé sur son contenu complet.
+
+        :param menu: Le menu pour lequel calculer le hash
+        :type menu: Menu
+        :return: Hash du contenu du menu (SHA256 en mode ``compat``)
+        :rtype: str
+        """
+        return MenuTree(menu, self.hashMode).hash
 
-                    # Insérer les repas, catégories et compositions
-                    for meal in menu.meals:
-                        await connection.execute(
-                            """
-                                INSERT INTO REPAS (TPR, MID)
-                                VALUES ($1, $2) 
-                                ON CONFLICT DO NOTHING
-                            """,
-                            meal.name,
-                            menu.id,
-                        )
-
-                        rpid = await connection.fetchval(
-                            "SELECT RPID FROM REPAS WHERE TPR = $1 AND MID = $2",
-                            meal.name,
-                            menu.id,
-                        )
-
-                        for ordreCategory, category in enumerate(meal.categories):
-                            await connection.execute(
-                                """
-                                    INSERT INTO CATEGORIE (TPCAT, ORDRE, RPID)
-                                    VALUES ($1, $2, $3) 
-                                    ON CONFLICT DO NOTHING
-                                """,
-                                category.name,
-                                ordreCategory,
-                                rpid,
-                            )
-
-                            catid = await connection.fetchval(
-                                "SELECT CATID FROM CATEGORIE WHERE TPCAT = $1 AND RPID = $2",
-                                category.name,
-                                rpid,
-                            )
-
-                            for ordreDish, dish in enumerate(category.dishes):
-                                # Vérifie la longueur du nom du plat pour éviter les erreurs de dépassement de capacité de la base de données
-                                if len(dish.name) >= 499:
-                                    self.logger.critical(
-                                        f"Le plat '{dish.name}' est trop long ({len(dish.name)} caractères). Debug: [RID: {ru.id}, RPID: {rpid}, CATID: {catid}]"
-                                    )
-                                    # Ignore ce plat
-                                    continue
-
-                                if not dish.name.strip():
-                                    self.logger.critical(
-                                        f"Le plat a un nom vide. Debug: [RID: {ru.id}, RPID: {rpid}, CATID: {catid}]"
-                                    )
-                                    # Ignore ce plat
-                                    continue
-
-                                # Essayer d'insérer le plat, ou récupérer l'ID s'il existe déjà
-                                # Note: PLAT n'a pas de contrainte d'unicité sur LIBELLE, donc on vérifie d'abord
-                                platid = await connection.fetchval(
-                                    "SELECT PLATID FROM PLAT WHERE LIBELLE = $1 LIMIT 1",
-                                    dish.name,
-                                )
-
-                                if platid is None:
-                                    # Utiliser RETURNING pour obtenir l'ID atomiquement
-                                    platid = await connection.fetchval(
-                                        """
-                                            INSERT INTO PLAT (LIBELLE)
-                                            VALUES ($1)
-                                            RETURNING PLATID
-                                        """,
-                                        dish.name,
-                                    )
-
-                                await connection.execute(
-                                    """
-                                        INSERT INTO COMPOSITION (CATID, ORDRE, PLATID)
-                                        VALUES ($1, $2, $3) 
-                                        ON CONFLICT DO NOTHING
-                                    """,
-                                    catid,
-                                    ordreDish,
-                                    platid,
-                                )
-
-    async def loadImage(self, image_url: str) -> None:
-        """
-        Charge une image et l'enregistre dans la base de données.
-        Cette méthode est utilisée pour éviter de charger plusieurs fois la même image et de limiter les requêtes inutiles à l'API du CROUS.
-
-        :param image_url: L'URL de l'image
-        :type image_url: str
+    async def fetchMenus(self, item: tuple[Region, RU]) -> list[tuple[RU, list[Menu]]]:
         """
-        try:
-            self.logger.debug(f"GET {image_url}")
+        Étape ``menus`` : récupère les menus d'un restaurant.
 
-            async with self.client.client.session.get(image_url) as resp:
-                image_binary = BytesIO(await resp.read())
+        :param item: La région et le restaurant universitaire
+        :type item: tuple[Region, RU]
+        :return: Le restaurant et ses menus, pour l'étape ``diff``
+        :rtype: list[tuple[RU, list[Menu]]]
+        """
+        region, ru = item
+
+        # Temps alloué écoulé : les menus sont vérifiés par la tâche suivante (non enregistré
+        # dans la planification, le restaurant reste à vérifier)
+        if self.expired and ru.id not in self.probedMenus:
+            self.postponed.add(region.id)
+            self.rows["reportes"] += 1
+            return []
 
-            self.logger.info(f"Image {image_url} chargée !")
+        self.logger.info(f"Chargement des menus pour le restaurant {ru.title}...")
+
+        # Restaurant réactivé : menus déjà récupérés par le sondage
+        menus = self.probedMenus.pop(ru.id, None)
+
+        try:
+            if menus is None:
+                menus = await self.client.menus(region.id, ru.id, None if self.retrying else 1)
         except Exception as e:
-            self.logger.error(f"Impossible de charger l'image {image_url} ({e}) !")
-            image_binary = None
+            self.deferFailure(self.failedRestaurants, ru.id, "menus", item, e)
+            return []
 
-        if image_binary:
-            try:
-                image = Image.open(image_binary)
-            except Exception as e:
-                self.logger.error(f"Impossible de charger l'image {image_url} ({e}) !")
+        if self.retrying:
+            self.resolveFailure(self.failedRestaurants, ru.id)
 
-                # Enregistre l'image sans le contenu brut si l'image n'est pas valide
-                async with self.pool.acquire() as connection:
-                    connection: Connection
+        # Les menus passés ne changent plus : ceux hors de la fenêtre ne sont ni hashés ni comparés
+        inWindow = [menu for menu in menus if self.inWindow(menu.date)]
+        self.rows["hors_fenetre"] += len(menus) - len(inWindow)
 
-                    await connection.execute(
-                        """
-                            INSERT INTO RESTAURANT_IMAGE (
-                                IMAGE_URL, RAW_IMAGE, DERNIERE_MODIFICATION
-                            )
-                            VALUES (
-                                $1, NULL, $2
-                            )
-                            ON CONFLICT (IMAGE_URL) DO UPDATE SET 
-                                DERNIERE_MODIFICATION = $2
-                        """,
-                        image_url,
-                        datetime.now(),
-                    )
+        self.logger.info(
+            f"{len(menus)} menus chargés pour le restaurant {ru.title} ({len(menus) - len(inWindow)} hors de la fenêtre) !"
+        )
 
-                return
+        return [(ru, inWindow)]
 
-            if not image.mode == "RGB":
-                image = image.convert("RGB")
+    def inWindow(self, day: date) -> bool:
+        """
+        Vérifie qu'un menu est dans la fenêtre d'ingestion.
 
-            b = BytesIO()
-            image.save(b, format="JPEG", compress_level=1, quality=95)
-            image_bytes = b.getvalue()
+        :param day: La date du menu
+        :type day: date
+        :return: ``True`` si le menu doit être comparé et enregistré
+        :rtype: bool
+        """
+        today = date.today()
 
-            async with self.pool.acquire() as connection:
-                connection: Connection
+        if self.windowPast is not None and day < today - timedelta(days=self.windowPast):
+            return False
 
-                await connection.execute(
+        if self.windowFuture is not None and day > today + timedelta(days=self.windowFuture):
+            return False
+
+        return True
+
+    async def diffMenus(self, item: tuple[RU, list[Menu]]) -> list[tuple[RU, list[MenuTree]]]:
+        """
+        Étape ``diff`` : calcule l'arbre de hash des menus d'un restaurant et le compare
+        avec les menus enregistrés.
+
+        :param item: Le restaurant universitaire et ses menus
+        :type item: tuple[RU, list[Menu]]
+        :return: Le restaurant et ses menus modifiés, pour l'étape ``write``
+        :rtype: list[tuple[RU, list[MenuTree]]]
+        """
+        ru, menus = item
+
+        if not menus:
+            if self.planner:
+                self.planner.record(ru.id, False)
+
+            return []
+
+        # Calculer l'arbre de hash des menus
+        trees = {menu.id: MenuTree(menu, self.hashMode) for menu in menus}
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            # En une seule requête : comparer les hash avec ceux des menus déjà enregistrés,
+            # et mettre à jour LAST_CHECKED des menus inchangés, qui sont renvoyés
+            unchanged = {
+                row["mid"]
+                for row in await connection.fetch(
                     """
-                        INSERT INTO RESTAURANT_IMAGE (
-                            IMAGE_URL, RAW_IMAGE, DERNIERE_MODIFICATION
-                        )
-                        VALUES (
-                            $1, $2, $3
-                        )
-                        ON CONFLICT (IMAGE_URL) DO UPDATE SET 
-                            RAW_IMAGE = $2,
-                            DERNIERE_MODIFICATION = $3
+                        UPDATE MENU
+                        SET LAST_CHECKED = $3
+                        FROM unnest($1::int[], $2::varchar[]) AS U(MID, MENU_HASH)
+                        WHERE MENU.RID = $4 AND MENU.MID = U.MID AND MENU.MENU_HASH = U.MENU_HASH
+                        RETURNING MENU.MID
                     """,
-                    image_url,
-                    image_bytes,
+                    list(trees),
+                    [tree.hash for tree in trees.values()],
                     datetime.now(),
+                    ru.id,
+                )
+            }
+
+        if unchanged:
+            self.logger.debug(f"{len(unchanged)} menus inchangés pour le restaurant {ru.title}, skip")
+
+        # Si le hash a changé ou si le menu n'existe pas, le menu doit être écrit
+        changed = [tree for mid, tree in trees.items() if mid not in unchanged]
+
+        self.rows["menus_inchanges"] += len(unchanged)
+        self.rows["menus_modifies"] += len(changed)
+
+        if self.planner:
+            self.planner.record(ru.id, bool(changed))
+
+        return [(ru, changed)] if changed else []
+
+    async def writeMenus(self, item: tuple[RU, list[MenuTree]]) -> None:
+        """
+        Étape ``write`` : écrit les menus modifiés d'un restaurant, par lot ou dans une transaction.
+
+        :param item: Le restaurant universitaire et ses menus modifiés
+        :type item: tuple[RU, list[MenuTree]]
+        """
+        ru, changed = item
+
+        self.changedMenus.update(tree.menu.id for tree in changed)
+
+        if self.bulk:
+            for tree in changed:
+                await self.bulk.add(ru.id, tree)
+
+            return
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                plans = await planMenus(connection, [(ru.id, tree) for tree in changed])
+
+                # Résolution des plats : dictionnaire en mémoire, puis base de données pour les inconnus
+                platids, resolved = await self.dishes.resolve(connection, dishNames(changed))
+
+                for plan in plans:
+                    await self.storeMenu(connection, plan, platids)
+
+        # Plats lus ou créés en base pendant la transaction, ajoutés au dictionnaire une fois celle-ci validée
+        for libelle, platid in resolved.items():
+            self.dishes.add(libelle, platid)
+
+    async def storeMenu(self, connection: Connection, plan: MenuPlan, platids: dict[str, int]) -> None:
+        """
+        Enregistre un menu modifié (ou nouveau) : seuls les repas et catégories dont le hash a
+        changé sont supprimés et recréés.
+
+        :param connection: La connexion à la base de données, dans une transaction
+        :type connection: Connection
+        :param plan: Les modifications à apporter au menu
+        :type plan: MenuPlan
+        :param platids: Les identifiants des plats du menu, par libellé
+        :type platids: dict[str, int]
+        """
+        menu = plan.tree.menu
+        written = 0
+
+        # Supprimer les repas et catégories modifiés, avec leurs compositions
+        if plan.deleteCategories:
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM COMPOSITION WHERE RID = $2 AND CATID = ANY($1::int[])",
+                    plan.deleteCategories,
+                    plan.rid,
+                )
+            )
+
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM CATEGORIE WHERE RID = $2 AND CATID = ANY($1::int[])",
+                    plan.deleteCategories,
+                    plan.rid,
                 )
+            )
+
+        if plan.deleteRepas:
+            written += rowCount(
+                await connection.execute(
+                    "DELETE FROM REPAS WHERE RID = $2 AND RPID = ANY($1::int[])",
+                    plan.deleteRepas,
+                    plan.rid,
+                )
+            )
+
+        # Insérer ou mettre à jour le menu avec le nouveau hash
+        await connection.execute(
+            """
+                INSERT INTO MENU (MID, RID, DATE, MENU_HASH)
+                VALUES ($1, $2, $3, $4) 
+                ON CONFLICT (RID, MID) DO UPDATE 
+                SET MENU_HASH = EXCLUDED.MENU_HASH
+            """,
+            menu.id,
+            plan.rid,
+            menu.date,
+            plan.tree.hash,
+        )
+        written += 1
+
+        # Mettre à jour le hash des repas conservés
+        if plan.updateRepas:
+            written += rowCount(
+                await connection.execute(
+                    """
+                        UPDATE REPAS
+                        SET REPAS_HASH = U.REPAS_HASH
+                        FROM unnest($1::int[], $2::varchar[]) AS U(RPID, REPAS_HASH)
+                        WHERE REPAS.RID = $3 AND REPAS.RPID = U.RPID
+                    """,
+                    [rpid for rpid, _ in plan.updateRepas],
+                    [repasHash for _, repasHash in plan.updateRepas],
+                    plan.rid,
+                )
+            )
+
+        # Insérer les nouveaux repas, catégories et compositions
+        for meal in plan.newMeals:
+            rpid = await connection.fetchval(
+                """
+                    INSERT INTO REPAS (TPR, MID, RID, REPAS_HASH)
+                    VALUES ($1, $2, $3, $4)
+                    RETURNING RPID
+                """,
+                meal.name,
+                menu.id,
+                plan.rid,
+                meal.hash,
+            )
+            written += 1
+
+            for category in meal.categories:
+                written += await self.storeCategory(connection, plan, rpid, category, platids)
+
+        for rpid, category in plan.newCategories:
+            written += await self.storeCategory(connection, plan, rpid, category, platids)
+
+        countRows(self.rows, written, [plan])
+
+    async def storeCategory(self, connection: Connection, plan: MenuPlan, rpid: int, category: CategoryNode, platids: dict[str, int]) -> int:
+        """
+        Enregistre une catégorie et ses compositions.
+
+        :param connection: La connexion à la base de données, dans une transaction
+        :type connection: Connection
+        :param plan: Les modifications à apporter au menu
+        :type plan: MenuPlan
+        :param rpid: L'identifiant du repas
+        :type rpid: int
+        :param category: La catégorie
+        :type category: CategoryNode
+        :param platids: Les identifiants des plats du menu, par libellé
+        :type platids: dict[str, int]
+        :return: Le nombre de lignes insérées
+        :rtype: int
+        """
+        catid = await connection.fetchval(
+            """
+                INSERT INTO CATEGORIE (TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING CATID
+            """,
+            category.name,
+            category.ordre,
+            rpid,
+            plan.rid,
+            category.hash,
+        )
+
+        compositions = [
+            (ordreDish, platids[dish])
+            for ordreDish, dish in enumerate(category.dishes)
+            if isValidDish(self.logger, dish, f"RID: {plan.rid}, RPID: {rpid}, CATID: {catid}")
+        ]
+
+        if not compositions:
+            return 1
+
+        status = await connection.execute(
+            """
+                INSERT INTO COMPOSITION (CATID, RID, ORDRE, PLATID)
+                SELECT $1, $4, U.ORDRE, U.PLATID
+                FROM unnest($2::int[], $3::int[]) AS U(ORDRE, PLATID)
+                ON CONFLICT DO NOTHING
+            """,
+            catid,
+            [ordreDish for ordreDish, _ in compositions],
+            [platid for _, platid in compositions],
+            plan.rid,
+        )
 
-            self.logger.info(f"Image {image_url} enregistrée !")
+        return 1 + rowCount(status)
 
     async def updateRestaurantsStatus(self) -> None:
         """
-        Met à jour le statut des restaurants.
+        Désactive les restaurants actifs qui n'ont pas été vus pendant le chargement.
+
+        La désactivation se fait en une seule requête, dans une transaction : le déclencheur
+        ``notifyOnActifChange`` n'envoie pas une notification par restaurant (voir le paramètre
+        ``croustillant.bulk_actif``), une seule notification récapitulative est envoyée sur le
+        canal ``actif_change_summary``. Un restaurant déjà désactivé, par exemple par un autre
+        worker, n'est ni modifié ni notifié.
+
+        Les restaurants désactivés qui ont de nouveau des menus (voir ``probeRestaurants``) sont
+        réactivés, avec une notification par restaurant (``actif_change``).
+
+        Avec une répartition entre plusieurs workers, seuls les restaurants des régions
+        réclamées par ce worker peuvent être désactivés. Les restaurants des régions reportées
+        (temps alloué écoulé) ne sont pas désactivés.
         """
         self.logger.info("Mise à jour du statut des restaurants...")
 
-        for restaurant in self.restaurants:
+        if self.planner and self.planner.reactivated:
             async with self.pool.acquire() as connection:
                 connection: Connection
 
+                status = await connection.execute(
+                    """
+                        UPDATE RESTAURANT
+                        SET ACTIF = TRUE
+                        WHERE RID = ANY($1::int[]) AND ACTIF IS DISTINCT FROM TRUE
+                    """,
+                    sorted(self.planner.reactivated),
+                )
+
+            self.rows["reactives"] += rowCount(status)
+            self.logger.info(f"{rowCount(status)} restaurants réactivés !")
+
+        if not self.restaurants:
+            self.logger.info("Aucun restaurant à désactiver !")
+            return
+
+        async with self.pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                # Paramètre local à la transaction : désactive les notifications ligne par ligne
                 await connection.execute(
+                    "SELECT set_config('croustillant.bulk_actif', 'on', true)"
+                )
+
+                rows = await connection.fetch(
                     """
                         UPDATE RESTAURANT
                         SET ACTIF = FALSE
-                        WHERE RID = $1
+                        WHERE RID = ANY($1::int[]) AND ACTIF = TRUE
+                            AND ($2::int[] IS NULL OR IDREG = ANY($2::int[]))
+                            AND (IDREG = ANY($3::int[])) IS NOT TRUE
+                        RETURNING RID
                     """,
-                    restaurant,
+                    sorted(self.restaurants),
+                    self.shard.claimed if self.shard else None,
+                    sorted(self.postponed),
                 )
 
-        self.logger.info("Statut des restaurants mis à jour !")
+                rids = [row["rid"] for row in rows]
+                self.rows["desactives"] += len(rids)
+
+                if rids:
+                    await connection.execute(
+                        "SELECT pg_notify('actif_change_summary', $1)",
+                        dumpsJSON({"actif": False, "count": len(rids), "rids": rids}),
+                    )
+
+        self.logger.info(f"Statut des restaurants mis à jour : {len(rids)} restaurants désactivés !")
@@ -1,25 +1,76 @@
 import asyncio
+import signal
 
 from CrousPy import Crous
 from CROUStillant.logger import Logger
+from CROUStillant.client import CrousClient
 from CROUStillant.worker import Worker
+from CROUStillant.archive import MenuArchiver
+from CROUStillant.daemon import Schedule
+from CROUStillant.planner import RefreshPlanner
+from CROUStillant.shard import ShardCoordinator
+from CROUStillant.lock import RunLock
+from CROUStillant.metrics import Metrics
+from CROUStillant.profiling import Profiler
+from CROUStillant.refresh import RefreshScheduler, MaterializedView
+from CROUStillant.storage import FileImageStore
 from CROUStillant.views import WorkerView, ErrorView
-from asyncpg import create_pool, Connection
+from asyncpg import create_pool, Connection, Pool
 from aiohttp import ClientSession
-from os import environ
+from argparse import ArgumentParser
+from os import environ, getpid, sysconf
+from socket import gethostname
 from dotenv import load_dotenv
 from discord import Webhook
 from discord.ui import LayoutView
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pytz import timezone
+from time import perf_counter
 
 
 load_dotenv(dotenv_path="/CROUStillant/.env")
 
 
-async def main():
+def processStart() -> float:
+    """
+    Début du processus, en temps ``perf_counter()`` : mesure du coût de démarrage d'une tâche
+    (TACHE.DEMARRAGE), imports compris. L'âge du processus est lu dans /proc (Linux) ;
+    ailleurs, le début est l'exécution de ce module, après les imports.
+
+    :return: Le début du processus (``perf_counter()``)
+    :rtype: float
+    """
+    now = perf_counter()
+
+    try:
+        with open("/proc/self/stat") as f:
+            # Le nom du processus (2e champ) peut contenir des espaces : les champs sont lus après « ) »
+            fields = f.read().rsplit(")", 1)[1].split()
+
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+
+        # 22e champ : début du processus, en tops d'horloge depuis le démarrage de la machine
+        age = uptime - int(fields[19]) / sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return now
+
+    return now - max(0.0, age)
+
+
+STARTED = processStart()
+
+
+async def main(backfill: bool = False, daemon: bool = False, profile: bool = False):
     """
     Main function
+
+    :param backfill: Rattrapage : les menus passés sont aussi comparés et enregistrés (jusqu'aux menus archivés)
+    :type backfill: bool
+    :param daemon: Mode démon : le processus reste actif et lance les tâches selon DAEMON_HOURS
+    :type daemon: bool
+    :param profile: Profilage de chaque tâche (sinon, une tâche sur PROFILE_EVERY)
+    :type profile: bool
     """
 
     # Création de la session et du logger
@@ -27,6 +78,9 @@ async def main():
     logger = Logger("background")
     crous = Crous(session)
 
+    # Mesures : phases de la tâche, requêtes à l'API et requêtes SQL (journal de requêtes de chaque connexion)
+    metrics = Metrics(logger)
+
     # Connexion à la base de données
     logger.info("Connexion à la base de données...")
 
@@ -39,10 +93,257 @@ async def main():
         min_size=10,  # 10 connections
         max_size=10,  # 10 connections
         max_queries=50000,  # 50,000 queries
+        # En mode démon, les connexions restent ouvertes entre deux tâches
+        max_inactive_connection_lifetime=0 if daemon else 300,
+        init=metrics.instrument,
     )
 
     logger.info("Connexion à la base de données établie !")
 
+    # Archivage des menus des années scolaires passées (ARCHIVE_SCHOOL_YEARS)
+    archiver = MenuArchiver(
+        logger=logger,
+        pool=pool,
+        schoolYears=int(environ.get("ARCHIVE_SCHOOL_YEARS", 2)),
+        batch=int(environ.get("ARCHIVE_BATCH", 1000)),
+    )
+
+    # Fenêtre d'ingestion des menus (MENU_WINDOW_PAST / MENU_WINDOW_FUTURE, vide : pas de limite)
+    window = (
+        int(environ["MENU_WINDOW_PAST"]) if environ.get("MENU_WINDOW_PAST") else None,
+        int(environ["MENU_WINDOW_FUTURE"]) if environ.get("MENU_WINDOW_FUTURE") else None,
+    )
+
+    # Création du worker. En mode démon, il est gardé entre deux tâches, avec ses caches
+    # (plats, types de restaurants, empreintes des restaurants)
+    worker = Worker(
+        logger=logger,
+        pool=pool,
+        client=CrousClient(
+            logger=logger,
+            crous=crous,
+            rate=float(environ.get("CROUS_API_RATE", 0)),
+            concurrency=int(environ.get("WORKER_CONCURRENCY", 8)),
+            regionConcurrency=int(environ.get("WORKER_REGION_CONCURRENCY", 4)),
+            timeout=float(environ.get("CROUS_API_TIMEOUT", 30)),
+            retries=int(environ.get("CROUS_API_RETRIES", 3)),
+            metrics=metrics,
+        ),
+        restaurants=[],
+        concurrency=int(environ.get("WORKER_CONCURRENCY", 8)),
+        dbConcurrency=int(environ.get("WORKER_DB_CONCURRENCY", 3)),
+        writeConcurrency=int(environ.get("WORKER_WRITE_CONCURRENCY", 2)),
+        queueSize=int(environ.get("WORKER_QUEUE_SIZE", 64)),
+        imageConcurrency=int(environ.get("WORKER_IMAGE_CONCURRENCY", 4)),
+        imageStore=FileImageStore(environ["IMAGE_STORE_PATH"]) if environ.get("IMAGE_STORE_PATH") else None,
+        retryBudget=float(environ.get("WORKER_RETRY_BUDGET", 120)),
+        bulkSize=int(environ.get("WORKER_BULK_SIZE", 0)),
+        hashMode=environ.get("MENU_HASH_MODE", "compat"),
+        # Planification des vérifications par restaurant (PLANNER_MAX_INTERVAL=0 : tous les restaurants à chaque tâche)
+        planner=RefreshPlanner(
+            logger=logger,
+            pool=pool,
+            minInterval=int(environ.get("PLANNER_MIN_INTERVAL", 60)),
+            maxInterval=int(environ.get("PLANNER_MAX_INTERVAL", 1440)),
+            growth=float(environ.get("PLANNER_GROWTH", 1.5)),
+            probeInterval=int(environ.get("PLANNER_PROBE_INTERVAL", 1440)),
+        ) if int(environ.get("PLANNER_MAX_INTERVAL", 1440)) > 0 else None,
+        # Répartition des régions entre plusieurs workers (SHARD_COUNT=0 : toutes les régions sont chargées par ce worker)
+        shard=ShardCoordinator(
+            logger=logger,
+            pool=pool,
+            name=environ.get("SHARD_NAME") or f"{gethostname()}-{getpid()}",
+            shards=int(environ["SHARD_COUNT"]),
+            index=int(environ.get("SHARD_INDEX", 0)),
+            lease=float(environ.get("SHARD_LEASE", 120)),
+        ) if int(environ.get("SHARD_COUNT", 0)) > 0 else None,
+        budget=float(environ.get("TASK_BUDGET", 0)),
+        # Profilage d'une tâche sur PROFILE_EVERY en moyenne (0 : pas de profilage, --profile : chaque tâche)
+        profiler=Profiler(
+            logger=logger,
+            every=1 if profile else int(environ.get("PROFILE_EVERY", 0)),
+            interval=float(environ.get("PROFILE_INTERVAL", 0.01)),
+            stall=float(environ.get("PROFILE_STALL", 0.1)),
+            keep=int(environ.get("PROFILE_KEEP", 20)),
+        ) if profile or int(environ.get("PROFILE_EVERY", 0)) > 0 else None,
+    )
+
+    # Chargement du dictionnaire des plats
+    await worker.loadDishes()
+
+    # Chargement des empreintes des restaurants (détection des changements)
+    await worker.loadFingerprints()
+
+    webhook = Webhook.from_url(environ["WEBHOOK_URL"], session=session)
+
+    # Rafraîchissement des vues matérialisées, en parallèle, seulement si leurs tables sources
+    # ont été modifiées pendant le cycle, et au plus une fois par intervalle (VIEW_REFRESH_INTERVALS)
+    intervals = {
+        name.strip(): timedelta(minutes=float(minutes))
+        for name, minutes in (
+            interval.split("=") for interval in environ.get("VIEW_REFRESH_INTERVALS", "").split(",") if interval.strip()
+        )
+    }
+
+    scheduler = RefreshScheduler(
+        logger=logger,
+        pool=pool,
+        views=[
+            # Statistiques
+            MaterializedView(
+                "v_stats",
+                {"REGION", "RESTAURANT", "TYPE_RESTAURANT", "MENU", "REPAS", "CATEGORIE", "PLAT", "COMPOSITION"},
+                intervals.get("v_stats", timedelta(0)),
+            ),
+            # Insights restaurants (couverture, variété, richesse, plats fréquents par restaurant), calculée
+            # à partir des agrégats : aussi rafraîchie si la période a changé (nouveau jour)
+            MaterializedView(
+                "v_restaurant_insights_summary",
+                {"RESTAURANT", "PLAT", "STATS_PLAT_JOUR", "STATS_RESTAURANT_JOUR"},
+                intervals.get("v_restaurant_insights_summary", timedelta(0)),
+                stale="SELECT COALESCE(MAX(periode_fin) < CURRENT_DATE - 1, TRUE) FROM v_restaurant_insights_summary;",
+            ),
+            # Top 100 des plats
+            MaterializedView(
+                "v_plats_top",
+                {"RESTAURANT", "PLAT", "STATS_PLAT_RESTAURANT"},
+                intervals.get("v_plats_top", timedelta(0)),
+            ),
+        ],
+    )
+
+    if daemon:
+        await runDaemon(logger, pool, worker, archiver, scheduler, webhook, window)
+    else:
+        # Les workers lancés par la même ligne de la crontab partagent le cycle de l'heure en cours
+        cycle = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+        await runTask(logger, pool, worker, archiver, scheduler, webhook, window, backfill, STARTED, "unique", cycle)
+
+    # Fermeture de la session et de la connexion à la base de données
+    await pool.close()
+    await session.close()
+
+
+async def runDaemon(
+    logger: Logger,
+    pool: Pool,
+    worker: Worker,
+    archiver: MenuArchiver,
+    scheduler: RefreshScheduler,
+    webhook: Webhook,
+    window: tuple[int | None, int | None],
+) -> None:
+    """
+    Mode démon : lance les tâches aux heures de DAEMON_HOURS, avec la même session, le même
+    pool de connexions et le même worker, jusqu'à l'arrêt du processus (SIGTERM ou SIGINT).
+    Une tâche en cours se termine avant l'arrêt.
+    """
+    schedule = Schedule(
+        hours=[int(hour) for hour in environ.get("DAEMON_HOURS", "23,6,7,8,9,10,11,12,13").split(",")],
+        backfillDay=int(environ["DAEMON_BACKFILL_DAY"]) if environ.get("DAEMON_BACKFILL_DAY") else None,
+    )
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # Mesures au format Prometheus, sur http://<hôte>:METRICS_PORT/metrics
+    if environ.get("METRICS_PORT"):
+        await worker.metrics.serve(int(environ["METRICS_PORT"]))
+
+    while not stopping.is_set():
+        run = schedule.next(datetime.now())
+        logger.info(f"Prochaine tâche le {run:%d/%m/%Y à %H:%M}...")
+
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=(run - datetime.now()).total_seconds())
+            break
+        except TimeoutError:
+            pass
+
+        started = perf_counter()
+
+        try:
+            await runTask(
+                logger, pool, worker, archiver, scheduler, webhook, window, schedule.isBackfill(run), started, "daemon", run
+            )
+        except Exception as e:
+            logger.error(f"Erreur lors de la tâche de fond : {e}")
+
+            # Le bail d'une tâche répartie interrompue n'est plus renouvelé : ses régions seront reprises
+            if worker.shard:
+                worker.shard.stop()
+
+    await worker.metrics.close()
+
+    logger.info("Arrêt du démon !")
+
+
+async def runTask(
+    logger: Logger,
+    pool: Pool,
+    worker: Worker,
+    archiver: MenuArchiver,
+    scheduler: RefreshScheduler,
+    webhook: Webhook,
+    window: tuple[int | None, int | None],
+    backfill: bool,
+    started: float,
+    mode: str,
+    cycle: datetime,
+) -> None:
+    """
+    Lance une tâche de fond (voir ``processTask``), si aucune autre tâche n'est en cours (voir
+    ``RunLock``). Une tâche répartie est coordonnée par ``ShardCoordinator.join``. La tâche est
+    profilée si elle est tirée au sort (voir ``Profiler``).
+    """
+    lock = RunLock(logger, pool)
+
+    if not worker.shard and not await lock.acquire():
+        return
+
+    if worker.profiler:
+        worker.profiler.start(worker.shard.name if worker.shard else mode)
+
+    try:
+        await processTask(logger, pool, worker, archiver, scheduler, webhook, window, backfill, started, mode, cycle)
+    finally:
+        if worker.profiler:
+            await worker.profiler.stop()
+
+        await lock.release()
+
+
+async def processTask(
+    logger: Logger,
+    pool: Pool,
+    worker: Worker,
+    archiver: MenuArchiver,
+    scheduler: RefreshScheduler,
+    webhook: Webhook,
+    window: tuple[int | None, int | None],
+    backfill: bool,
+    started: float,
+    mode: str,
+    cycle: datetime,
+) -> None:
+    """
+    Lance une tâche de fond : chargement des données, archivage et rafraîchissement des vues.
+
+    :param window: La fenêtre d'ingestion des menus (jours passés, jours à venir)
+    :type window: tuple[int | None, int | None]
+    :param backfill: Rattrapage : les menus passés sont aussi comparés et enregistrés (jusqu'aux menus archivés)
+    :type backfill: bool
+    :param started: Le début de la tâche (``perf_counter()``), pour mesurer le coût de démarrage
+    :type started: float
+    :param mode: Le mode de lancement (``unique`` ou ``daemon``)
+    :type mode: str
+    :param cycle: Le cycle de la tâche (heure prévue), partagé par les workers d'une même tâche répartie
+    :type cycle: datetime
+    """
     # Récupération des restaurants actifs dans la base de données
     async with pool.acquire() as connection:
         connection: Connection
@@ -51,31 +352,43 @@ async def main():
             "SELECT RID FROM RESTAURANT WHERE ACTIF = TRUE;"
         )
 
-    # Création du worker
-    worker = Worker(
-        logger=logger,
-        pool=pool,
-        client=crous,
-        restaurants=[restaurant["rid"] for restaurant in restaurants],
-    )
+    worker.reset(restaurant["rid"] for restaurant in restaurants)
+
+    # Temps alloué au chargement (TASK_BUDGET), depuis le lancement de la tâche. Les régions
+    # reportées par la tâche précédente, interrompue, sont chargées en premier
+    if worker.budget > 0:
+        worker.deadline = started + worker.budget
+
+    await worker.loadPriority()
+
+    # En rattrapage, tous les menus passés sont repris, sauf ceux des années scolaires archivées
+    if backfill:
+        logger.info("Rattrapage : les menus passés sont comparés et enregistrés !")
+
+        worker.windowPast = (date.today() - archiver.horizon()).days if archiver.schoolYears > 0 else None
+        worker.windowFuture = None
+    else:
+        worker.windowPast, worker.windowFuture = window
+
+    # En rattrapage, tous les restaurants actifs sont vérifiés, quelle que soit leur planification
+    if worker.planner:
+        worker.planner.everything = backfill
 
     # Lancement de la tâche de fond
-    webhook = Webhook.from_url(environ["WEBHOOK_URL"], session=session)
     year = datetime.now(timezone("Europe/Paris")).year
     stats = await worker.getStats()
     start = datetime.now()
 
     # Création d'une tâche de fond pour mettre à jour les données
-    async with pool.acquire() as connection:
-        connection: Connection
-
-        await connection.execute(
+    async def createTask(connection: Connection) -> int:
+        return await connection.fetchval(
             """
                 INSERT INTO TACHE (
                     DEBUT, DEBUT_REGIONS, DEBUT_RESTAURANTS, DEBUT_TYPES_RESTAURANTS, DEBUT_MENUS, DEBUT_REPAS, 
-                    DEBUT_CATEGORIES, DEBUT_PLATS, DEBUT_COMPOSITIONS, DEBUT_ACTIFS
+                    DEBUT_CATEGORIES, DEBUT_PLATS, DEBUT_COMPOSITIONS, DEBUT_ACTIFS, MODE, RATTRAPAGE, DEMARRAGE, CYCLE
                 )
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10);
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+                RETURNING ID;
             """,
             start,
             stats["regions"],
@@ -87,10 +400,25 @@ async def main():
             stats["plats"],
             stats["compositions"],
             len(restaurants),
+            mode,
+            backfill,
+            perf_counter() - started,
+            cycle,
         )
 
-        taskId = await connection.fetchval("SELECT MAX(ID) FROM TACHE;")
-        worker.taskId = taskId
+    # Tâche répartie : seul le premier worker du cycle crée la tâche
+    if worker.shard:
+        taskId, created = await worker.shard.join(cycle, createTask)
+
+        if taskId is None:
+            return
+    else:
+        async with pool.acquire() as connection:
+            connection: Connection
+
+            taskId, created = await createTask(connection), True
+
+    worker.taskId = taskId
 
     # Startup message
     view = WorkerView(
@@ -123,13 +451,15 @@ Nombre de restaurants actifs : `{actifs:,d}`
         footer_text="CROUStillant Développement © 2022 - {year} | Tous droits réservés.".format(year=year),
     )
 
-    await sendWebhook(webhook=webhook, view=view)
+    if created:
+        await sendWebhook(webhook=webhook, view=view)
 
     # Chargement des données
     logger.info("Chargement des données...")
 
     try:
-        regions = await worker.loadRegions()
+        with worker.metrics.phase("regions"):
+            regions = await worker.loadRegions()
     except Exception as e:
         logger.error(f"Erreur lors du chargement des régions : {e}")
 
@@ -147,35 +477,13 @@ Nombre de restaurants actifs : `{actifs:,d}`
             view=view,
         )
 
-        async with pool.acquire() as connection:
-            connection: Connection
-
-            await connection.execute(
-                """
-                    UPDATE TACHE
-                    SET FIN = $1, FIN_REGIONS = $2, FIN_RESTAURANTS = $3, FIN_TYPES_RESTAURANTS = $4, FIN_MENUS = $5, 
-                        FIN_REPAS = $6, FIN_CATEGORIES = $7, FIN_PLATS = $8, FIN_COMPOSITIONS = $9, FIN_ACTIFS = $10,
-                        REQUETES = $11
-                    WHERE ID = $12;
-                """,
-                datetime.now(),
-                stats["regions"],
-                stats["restaurants"],
-                stats["types_restaurants"],
-                stats["menus"],
-                stats["repas"],
-                stats["categories"],
-                stats["plats"],
-                stats["compositions"],
-                len(restaurants),
-                0,
-                taskId,
-            )
+        await failTask(pool, worker, taskId, stats, len(restaurants))
 
         return
 
     try:
-        await worker.loadRestaurants(regions=regions)
+        with worker.metrics.phase("restaurants"):
+            await worker.loadRestaurants(regions=regions)
     except Exception as e:
         logger.error(f"Erreur lors du chargement des restaurants : {e}")
 
@@ -193,37 +501,39 @@ Nombre de restaurants actifs : `{actifs:,d}`
             view=view,
         )
 
-        async with pool.acquire() as connection:
-            connection: Connection
-
-            await connection.execute(
-                """
-                    UPDATE TACHE
-                    SET FIN = $1, FIN_REGIONS = $2, FIN_RESTAURANTS = $3, FIN_TYPES_RESTAURANTS = $4, FIN_MENUS = $5, 
-                        FIN_REPAS = $6, FIN_CATEGORIES = $7, FIN_PLATS = $8, FIN_COMPOSITIONS = $9, FIN_ACTIFS = $10,
-                        REQUETES = $11
-                    WHERE ID = $12;
-                """,
-                datetime.now(),
-                stats["regions"],
-                stats["restaurants"],
-                stats["types_restaurants"],
-                stats["menus"],
-                stats["repas"],
-                stats["categories"],
-                stats["plats"],
-                stats["compositions"],
-                len(restaurants),
-                0,
-                taskId,
-            )
+        await failTask(pool, worker, taskId, stats, len(restaurants))
 
         return
 
     logger.info("Données chargées !")
 
     # Mise à jour des statuts des restaurants inactifs
-    await worker.updateRestaurantsStatus()
+    with worker.metrics.phase("statut"):
+        await worker.updateRestaurantsStatus()
+
+    # Mesures du chargement (TACHE_METRIQUE)
+    worker.collectMetrics()
+    await worker.metrics.save(pool, taskId)
+
+    # Compteurs de la tâche. Tâche répartie : seul le dernier worker à terminer termine la tâche
+    if worker.shard:
+        totals = await worker.shard.finish(
+            worker.requests, worker.rows["restaurants"], worker.written, worker.writtenTables, worker.postponed
+        )
+
+        if totals is None:
+            if environ.get("METRICS_TEXTFILE"):
+                worker.metrics.write(environ["METRICS_TEXTFILE"])
+
+            return
+    else:
+        totals = {
+            "requetes": worker.requests,
+            "restaurants_ecrits": worker.rows["restaurants"],
+            "lignes_ecrites": worker.written,
+            "tables": worker.writtenTables,
+            "reportees": worker.postponed,
+        }
 
     # Récupération des restaurants actifs dans la base de données
     async with pool.acquire() as connection:
@@ -237,65 +547,50 @@ Nombre de restaurants actifs : `{actifs:,d}`
     end = datetime.now()
     elapsed = end - start
 
-    # Mise à jour des données
-    async with pool.acquire() as connection:
-        connection: Connection
+    # Une erreur pendant la fin de la tâche la termine quand même, avec un statut et ses régions reportées
+    try:
+        # Archivage des menus des années scolaires passées
+        with worker.metrics.phase("archivage"):
+            await archiver.run()
 
-        # Rafraîchissement de la vue matérialisée des statistiques
-        await connection.execute(
-            """
-                REFRESH MATERIALIZED VIEW CONCURRENTLY v_stats;
-            """
-        )
+        # Regroupement des compteurs de lignes modifiés pendant le cycle
+        with worker.metrics.phase("compteurs"):
+            await worker.compactCounters()
 
-        # Rafraîchissement de la vue matérialisée des insights restaurants
-        # (couverture, variété, richesse, plats fréquents par restaurant)
-        await connection.execute(
-            """
-                REFRESH MATERIALIZED VIEW CONCURRENTLY v_restaurant_insights_summary;
-            """
-        )
+        # Rafraîchissement des vues matérialisées
+        with worker.metrics.phase("vues"):
+            await scheduler.run(totals["tables"], taskId)
 
-        # Rafraîchissement de la vue matérialisée du top 100 des plats
-        await connection.execute(
-            """
-                REFRESH MATERIALIZED VIEW CONCURRENTLY v_plats_top;
-            """
+        # Récupération des statistiques finales
+        stats = await worker.getStats()
+    except Exception as e:
+        logger.error(f"Erreur lors de la fin de la tâche : {e}")
+
+        await updateTask(
+            pool, taskId, datetime.now(), stats, len(restaurants), totals,
+            "interrompue" if totals["reportees"] else "erreur",
         )
 
-    # Récupération des statistiques finales
-    stats = await worker.getStats()
+        raise
 
     # Mise à jour de la tâche
-    async with pool.acquire() as connection:
-        connection: Connection
+    await updateTask(
+        pool, taskId, end, stats, len(restaurants), totals, "interrompue" if totals["reportees"] else "terminee"
+    )
 
-        await connection.execute(
-            """
-                UPDATE TACHE
-                SET FIN = $1, FIN_REGIONS = $2, FIN_RESTAURANTS = $3, FIN_TYPES_RESTAURANTS = $4, FIN_MENUS = $5, 
-                    FIN_REPAS = $6, FIN_CATEGORIES = $7, FIN_PLATS = $8, FIN_COMPOSITIONS = $9, FIN_ACTIFS = $10,
-                    REQUETES = $11
-                WHERE ID = $12;
-            """,
-            end,
-            stats["regions"],
-            stats["restaurants"],
-            stats["types_restaurants"],
-            stats["menus"],
-            stats["repas"],
-            stats["categories"],
-            stats["plats"],
-            stats["compositions"],
-            len(restaurants),
-            worker.requests,
-            taskId,
-        )
+    # Mesures de la fin de la tâche (archivage, compteurs, vues), et export pour Prometheus
+    worker.metrics.finish(taskId, elapsed.total_seconds())
+    worker.metrics.summary()
+    await worker.metrics.save(pool, taskId)
+
+    if environ.get("METRICS_TEXTFILE"):
+        worker.metrics.write(environ["METRICS_TEXTFILE"])
 
     # Envoi du message de fin
     view = WorkerView(
-        content="## Tâche de fond terminée ! Données chargées.\nTemps écoulé : `{elapsed}` secondes.\n\nTâche **`#{taskId}`**".format(
+        content="## Tâche de fond terminée ! Données chargées.\nTemps écoulé : `{elapsed}` secondes.{postponed}\n\nTâche **`#{taskId}`**".format(
             elapsed=round(elapsed.total_seconds(), 2),
+            postponed=f"\nTemps alloué écoulé : `{len(totals['reportees'])}` régions reportées." if totals["reportees"] else "",
             taskId=taskId,
         ),
         stats="""
@@ -326,9 +621,89 @@ Nombre de restaurants actifs : `{actifs:,d}`
 
     await sendWebhook(webhook=webhook, view=view)
 
-    # Fermeture de la session et de la connexion à la base de données
-    await pool.close()
-    await session.close()
+
+async def updateTask(
+    pool: Pool,
+    taskId: int,
+    end: datetime,
+    stats: dict,
+    actifs: int,
+    totals: dict | None,
+    status: str,
+) -> None:
+    """
+    Enregistre la fin d'une tâche : statistiques finales, compteurs et statut.
+
+    :param taskId: L'identifiant de la tâche
+    :type taskId: int
+    :param end: La fin de la tâche
+    :type end: datetime
+    :param stats: Les statistiques (voir ``Worker.getStats``)
+    :type stats: dict
+    :param actifs: Le nombre de restaurants actifs
+    :type actifs: int
+    :param totals: Les compteurs de la tâche (``None`` : aucune requête réussie, rien d'écrit)
+    :type totals: dict | None
+    :param status: Le statut de la tâche (``terminee``, ``interrompue`` ou ``erreur``)
+    :type status: str
+    """
+    # FIN et le statut final sont renseignés ensemble : une tâche répartie est seulement
+    # « en clôture » jusqu'ici (voir ``ShardCoordinator.close``)
+    async with pool.acquire() as connection:
+        connection: Connection
+
+        await connection.execute(
+            """
+                UPDATE TACHE
+                SET FIN = $1, FIN_REGIONS = $2, FIN_RESTAURANTS = $3, FIN_TYPES_RESTAURANTS = $4, FIN_MENUS = $5, 
+                    FIN_REPAS = $6, FIN_CATEGORIES = $7, FIN_PLATS = $8, FIN_COMPOSITIONS = $9, FIN_ACTIFS = $10,
+                    REQUETES = $11, RESTAURANTS_ECRITS = $12, LIGNES_ECRITES = $13, STATUT = $14, REPORTEES = $15
+                WHERE ID = $16;
+            """,
+            end,
+            stats["regions"],
+            stats["restaurants"],
+            stats["types_restaurants"],
+            stats["menus"],
+            stats["repas"],
+            stats["categories"],
+            stats["plats"],
+            stats["compositions"],
+            actifs,
+            totals["requetes"] if totals else 0,
+            totals["restaurants_ecrits"] if totals else None,
+            totals["lignes_ecrites"] if totals else None,
+            status,
+            sorted(totals["reportees"]) if totals else None,
+            taskId,
+        )
+
+
+async def failTask(pool: Pool, worker: Worker, taskId: int, stats: dict, actifs: int) -> None:
+    """
+    Termine une tâche après une erreur de chargement.
+
+    Tâche répartie : les autres workers continuent, les régions de celui-ci sont libérées. Si ce
+    worker est le dernier, il termine la tâche, et les régions libérées sont reportées.
+
+    :param taskId: L'identifiant de la tâche
+    :type taskId: int
+    :param stats: Les statistiques du début de la tâche
+    :type stats: dict
+    :param actifs: Le nombre de restaurants actifs
+    :type actifs: int
+    """
+    totals = None
+
+    if worker.shard:
+        totals = await worker.shard.abort()
+
+        if totals is None:
+            return
+
+    await updateTask(
+        pool, taskId, datetime.now(), stats, actifs, totals, "interrompue" if totals and totals["reportees"] else "erreur"
+    )
 
 
 async def sendWebhook(webhook: Webhook, view: LayoutView) -> None:
@@ -339,4 +714,22 @@ async def sendWebhook(webhook: Webhook, view: LayoutView) -> None:
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = ArgumentParser(description="Tâche de fond de CROUStillant")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="rattrapage : compare et enregistre aussi les menus passés, hors de la fenêtre d'ingestion",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="mode démon : reste actif et lance les tâches aux heures de DAEMON_HOURS (remplace la crontab)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile chaque tâche (piles d'appels, blocages de la boucle, durées par restaurant) dans logs/profiles",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(backfill=args.backfill, daemon=args.daemon, profile=args.profile))
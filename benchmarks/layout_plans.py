@@ -0,0 +1,159 @@
+"""
+Comparaison des plans d'exécution de l'arbre des menus, selon le partitionnement.
+
+Exécute avec ``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` les requêtes du worker (lecture de
+l'arbre des menus modifiés, diff des hash, suppression d'un arbre) et l'agrégation des
+rollups, sur les tables actuelles et sur l'autre schéma (tables ``_COPART`` avant l'échange,
+``_ANCIEN`` après, voir ``CROUStillant.layout``), pour quelques restaurants tirés au hasard.
+Les suppressions sont annulées (transaction annulée).
+
+Affiche, pour chaque requête, le temps de planification et d'exécution, le nombre de blocs
+lus et le nombre de partitions effectivement parcourues.
+
+Utilisation (depuis la racine du projet) :
+
+    python -m benchmarks.layout_plans [nombre de restaurants] [répétitions]
+"""
+
+import asyncio
+import json
+import sys
+
+from asyncpg import Connection, connect
+from dotenv import load_dotenv
+from os import environ
+
+
+QUERIES = {
+    "arbre des menus": """
+        SELECT R.MID, R.RPID, R.TPR, R.REPAS_HASH, C.CATID, C.ORDRE, C.CATEGORIE_HASH
+        FROM REPAS{suffix} R
+        LEFT JOIN CATEGORIE{suffix} C ON C.RID = R.RID AND C.RPID = R.RPID
+        WHERE R.RID = ANY($2::int[]) AND R.MID = ANY($1::int[])
+    """,
+    "diff des hash": """
+        SELECT M.MID, M.MENU_HASH
+        FROM MENU{suffix} M
+        WHERE M.RID = ANY($2::int[]) AND M.MID = ANY($1::int[])
+    """,
+    "suppression": """
+        DELETE FROM COMPOSITION{suffix} CO
+        USING CATEGORIE{suffix} C, REPAS{suffix} R
+        WHERE CO.RID = C.RID AND CO.CATID = C.CATID
+          AND C.RID = R.RID AND C.RPID = R.RPID
+          AND R.RID = ANY($2::int[]) AND R.MID = ANY($1::int[])
+    """,
+    "rollup (plats par jour)": """
+        SELECT M.RID, M.DATE, CO.PLATID, COUNT(*) AS NB
+        FROM MENU{suffix} M
+        JOIN REPAS{suffix} RP ON RP.RID = M.RID AND RP.MID = M.MID
+        JOIN CATEGORIE{suffix} C ON C.RID = RP.RID AND C.RPID = RP.RPID
+        JOIN COMPOSITION{suffix} CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+        WHERE M.RID = ANY($2::int[]) AND M.MID = ANY($1::int[])
+        GROUP BY M.RID, M.DATE, CO.PLATID
+    """,
+}
+
+
+def scannedPartitions(plan: dict) -> set[str]:
+    """
+    Récupère les tables (partitions) effectivement parcourues par un plan.
+
+    :param plan: Le nœud du plan
+    :type plan: dict
+    :return: Les noms des tables parcourues
+    :rtype: set[str]
+    """
+    relations = set()
+
+    if "Relation Name" in plan and plan.get("Actual Loops", 0) > 0:
+        relations.add(plan["Relation Name"])
+
+    for child in plan.get("Plans", []):
+        relations |= scannedPartitions(child)
+
+    return relations
+
+
+async def explain(connection: Connection, query: str, mids: list[int], rids: list[int]) -> dict:
+    """
+    Exécute une requête avec ``EXPLAIN ANALYZE``, dans une transaction annulée.
+
+    :param connection: La connexion à la base de données
+    :type connection: Connection
+    :param query: La requête
+    :type query: str
+    :param mids: Les menus
+    :type mids: list[int]
+    :param rids: Les restaurants
+    :type rids: list[int]
+    :return: Le plan et ses mesures
+    :rtype: dict
+    """
+    transaction = connection.transaction()
+    await transaction.start()
+
+    try:
+        result = await connection.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", mids, rids)
+    finally:
+        await transaction.rollback()
+
+    return json.loads(result)[0]
+
+
+async def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    load_dotenv(dotenv_path="/CROUStillant/.env")
+
+    connection: Connection = await connect(
+        database=environ["POSTGRES_DATABASE"],
+        user=environ["POSTGRES_USER"],
+        password=environ["POSTGRES_PASSWORD"],
+        host=environ["POSTGRES_HOST"],
+        port=environ["POSTGRES_PORT"],
+    )
+
+    try:
+        key = await connection.fetchval("SELECT pg_get_partkeydef('menu'::regclass)")
+        other = "_ANCIEN" if "rid" in key.lower() else "_COPART"
+
+        if not await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", f"menu{other}"):
+            print(f"Tables MENU{other} absentes : lancer d'abord python -m CROUStillant.layout prepare et copy.")
+            return
+
+        rows = await connection.fetch(
+            "SELECT MID, RID FROM MENU WHERE RID IN (SELECT RID FROM MENU GROUP BY RID ORDER BY random() LIMIT $1)",
+            count,
+        )
+        mids = [row["mid"] for row in rows]
+        rids = sorted({row["rid"] for row in rows})
+
+        print(f"Schéma actuel : {key}, comparé aux tables {other}")
+        print(f"{len(rids)} restaurants, {len(mids)} menus, meilleur temps sur {repeat} essais :")
+
+        for name, query in QUERIES.items():
+            for label, suffix in (("actuel", ""), (other, other)):
+                best = None
+
+                for _ in range(repeat):
+                    result = await explain(connection, query.format(suffix=suffix), mids, rids)
+
+                    if best is None or result["Execution Time"] < best["Execution Time"]:
+                        best = result
+
+                plan = best["Plan"]
+                blocks = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+
+                print(
+                    f"  {name:<25} {label:<8} planification {best['Planning Time']:8.2f} ms"
+                    f"  exécution {best['Execution Time']:8.2f} ms"
+                    f"  {blocks:7d} blocs  {len(scannedPartitions(plan)):3d} partitions"
+                )
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Micro-benchmark du hash des menus.
+
+Compare, sur des menus générés mais réalistes (3 repas, 4 à 8 catégories, 1 à 6 plats
+accentués), l'ancien calcul (dictionnaire + ``json.dumps(sort_keys=True)`` + SHA256, à
+chaque niveau de l'arbre) avec l'encodeur canonique de ``CROUStillant.encoding``, en
+modes ``compat`` et ``fast``. Vérifie aussi que le mode ``compat`` produit exactement les
+hash historiques de MENU.MENU_HASH.
+
+Utilisation (depuis la racine du projet) :
+
+    python -m benchmarks.menu_hash [nombre de menus] [répétitions]
+"""
+
+import hashlib
+import random
+import sys
+
+from CROUStillant.menus import MenuTree
+from datetime import date, timedelta
+from json import dumps
+from time import perf_counter
+from types import SimpleNamespace
+
+
+CATEGORIES = [
+    "Entrées", "Plats", "Accompagnements", "Desserts", "Menu végétarien",
+    "Grillades", "Pâtes & pizzas", "Fromages", "Cafétéria", "Menu du jour",
+]
+
+DISHES = [
+    "Salade de lentilles", "Carottes râpées vinaigrette", "Œuf dur mayonnaise", "Taboulé",
+    "Poulet rôti au thym", "Bœuf bourguignon", "Filet de colin sauce citron", "Lasagnes à la bolognaise",
+    "Gratin dauphinois", "Riz pilaf", "Haricots verts persillés", "Frites", "Purée de pommes de terre",
+    "Crème brûlée", "Tarte aux pommes", "Fromage blanc", "Mousse au chocolat", "Fruit de saison",
+    "Dahl de lentilles corail", "Curry de légumes", "Falafels, sauce au yaourt", "Chili sin carne",
+]
+
+
+def generateMenus(count: int) -> list[SimpleNamespace]:
+    """
+    Génère des menus ayant la même forme que ceux de CrousPy.
+    """
+    generator = random.Random(42)
+    start = date(2026, 9, 1)
+
+    return [
+        SimpleNamespace(
+            id=index,
+            date=start + timedelta(days=index % 60),
+            meals=[
+                SimpleNamespace(
+                    name=meal,
+                    categories=[
+                        SimpleNamespace(
+                            name=category,
+                            dishes=[
+                                SimpleNamespace(name=dish)
+                                for dish in generator.sample(DISHES, generator.randint(1, 6))
+                            ],
+                        )
+                        for category in generator.sample(CATEGORIES, generator.randint(4, 8))
+                    ],
+                )
+                for meal in ("matin", "midi", "soir")
+            ],
+        )
+        for index in range(count)
+    ]
+
+
+def legacyDigest(data: dict) -> str:
+    return hashlib.sha256(dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def legacyMenuHash(menu) -> str:
+    """
+    Ancien ``Worker.compute_menu_hash`` : hash du menu uniquement.
+    """
+    return legacyDigest({
+        "date": str(menu.date),
+        "meals": [
+            {
+                "name": meal.name,
+                "categories": [
+                    {"name": category.name, "dishes": [dish.name for dish in category.dishes]}
+                    for category in meal.categories
+                ],
+            }
+            for meal in menu.meals
+        ],
+    })
+
+
+def legacyTree(menu) -> tuple[str, list[str], list[str]]:
+    """
+    Arbre de hash calculé avec un ``json.dumps`` par nœud.
+    """
+    meals = []
+    mealHashes = []
+    categoryHashes = []
+
+    for meal in menu.meals:
+        categories = []
+
+        for category in meal.categories:
+            data = {"name": category.name, "dishes": [dish.name for dish in category.dishes]}
+            categoryHashes.append(legacyDigest(data))
+            categories.append(data)
+
+        data = {"name": meal.name, "categories": categories}
+        mealHashes.append(legacyDigest(data))
+        meals.append(data)
+
+    return legacyDigest({"date": str(menu.date), "meals": meals}), mealHashes, categoryHashes
+
+
+def measure(function, menus: list, repeat: int) -> float:
+    """
+    Meilleur temps, en secondes, pour traiter tous les menus.
+    """
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = perf_counter()
+        for menu in menus:
+            function(menu)
+        best = min(best, perf_counter() - start)
+
+    return best
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    menus = generateMenus(count)
+
+    # Compatibilité : les hash doivent être identiques aux hash historiques, à tous les niveaux
+    for menu in menus:
+        tree = MenuTree(menu)
+        menuHash, mealHashes, categoryHashes = legacyTree(menu)
+
+        assert tree.hash == menuHash == legacyMenuHash(menu)
+        assert [meal.hash for meal in tree.meals] == mealHashes
+        assert [category.hash for meal in tree.meals for category in meal.categories] == categoryHashes
+
+    results = {
+        "ancien (menu seul)": measure(legacyMenuHash, menus, repeat),
+        "ancien (arbre)": measure(legacyTree, menus, repeat),
+        "encodeur compat (arbre)": measure(lambda menu: MenuTree(menu, "compat"), menus, repeat),
+        "encodeur fast (arbre)": measure(lambda menu: MenuTree(menu, "fast"), menus, repeat),
+    }
+
+    reference = results["ancien (arbre)"]
+
+    print(f"{count:,d} menus, meilleur temps sur {repeat} essais :")
+    for name, elapsed in results.items():
+        print(f"  {name:<25} {elapsed * 1000:8.1f} ms  {elapsed / count * 1e6:6.1f} µs/menu  x{reference / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
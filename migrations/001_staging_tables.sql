@@ -0,0 +1,31 @@
+/***************************************************************
+    *  CROUStillant - migrations/001_staging_tables.sql
+    *  Description: Tables de transit pour l'écriture des menus par lots
+    *               (à appliquer sur une base créée avant le 18/10/2026)
+***************************************************************/
+
+CREATE UNLOGGED TABLE IF NOT EXISTS STAGING_MENU(
+    MID INT,
+    RID INT,
+    DATE DATE,
+    MENU_HASH VARCHAR(64)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS STAGING_REPAS(
+    RPID INT,
+    TPR VARCHAR(10),
+    MID INT
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS STAGING_CATEGORIE(
+    CATID INT,
+    TPCAT VARCHAR(500),
+    ORDRE INT,
+    RPID INT
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS STAGING_COMPOSITION(
+    CATID INT,
+    ORDRE INT,
+    PLATID INT
+);
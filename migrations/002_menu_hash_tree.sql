@@ -0,0 +1,13 @@
+/***************************************************************
+    *  CROUStillant - migrations/002_menu_hash_tree.sql
+    *  Description: Hash des repas et des catégories, pour ne réécrire que les
+    *               parties modifiées d'un menu (voir CROUStillant/menus.py)
+***************************************************************/
+
+-- Les repas et catégories existants n'ont pas de hash : ils seront réécrits une
+-- seule fois, à la prochaine modification de leur menu.
+ALTER TABLE REPAS ADD COLUMN IF NOT EXISTS REPAS_HASH VARCHAR(64);
+ALTER TABLE CATEGORIE ADD COLUMN IF NOT EXISTS CATEGORIE_HASH VARCHAR(64);
+
+ALTER TABLE STAGING_REPAS ADD COLUMN IF NOT EXISTS REPAS_HASH VARCHAR(64);
+ALTER TABLE STAGING_CATEGORIE ADD COLUMN IF NOT EXISTS CATEGORIE_HASH VARCHAR(64);
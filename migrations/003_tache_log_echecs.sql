@@ -0,0 +1,9 @@
+/***************************************************************
+    *  CROUStillant - migrations/003_tache_log_echecs.sql
+    *  Description: Échecs de chargement par restaurant et par tâche
+***************************************************************/
+
+-- ECHECS : nombre de requêtes échouées pour le restaurant pendant la tâche
+-- ERREUR : dernière erreur, si elle n'a pas été résolue par une nouvelle tentative
+ALTER TABLE TACHE_LOG ADD COLUMN IF NOT EXISTS ECHECS INT DEFAULT 0;
+ALTER TABLE TACHE_LOG ADD COLUMN IF NOT EXISTS ERREUR VARCHAR(500);
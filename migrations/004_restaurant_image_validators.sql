@@ -0,0 +1,7 @@
+/***************************************************************
+    *  CROUStillant - migrations/004_restaurant_image_validators.sql
+    *  Description: Validateurs HTTP des images, pour les requêtes conditionnelles
+***************************************************************/
+
+ALTER TABLE RESTAURANT_IMAGE ADD COLUMN IF NOT EXISTS ETAG VARCHAR(255);
+ALTER TABLE RESTAURANT_IMAGE ADD COLUMN IF NOT EXISTS LAST_MODIFIED VARCHAR(64);
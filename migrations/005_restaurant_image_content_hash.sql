@@ -0,0 +1,7 @@
+/***************************************************************
+    *  CROUStillant - migrations/005_restaurant_image_content_hash.sql
+    *  Description: Hash du contenu des images, pour le stockage adressé par contenu
+    *               (voir CROUStillant/storage.py)
+***************************************************************/
+
+ALTER TABLE RESTAURANT_IMAGE ADD COLUMN IF NOT EXISTS CONTENT_HASH VARCHAR(64);
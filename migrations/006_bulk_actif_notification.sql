@@ -0,0 +1,24 @@
+/***************************************************************
+    *  CROUStillant - migrations/006_bulk_actif_notification.sql
+    *  Description: Désactivation groupée des restaurants : une notification
+    *               récapitulative au lieu d'une notification par restaurant
+***************************************************************/
+
+CREATE OR REPLACE FUNCTION notifyOnActifChange()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    -- Désactivation groupée (worker) : une seule notification récapitulative est envoyée
+    -- sur le canal actif_change_summary
+    IF current_setting('croustillant.bulk_actif', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
+    IF OLD.ACTIF IS DISTINCT FROM NEW.ACTIF THEN
+        payload := row_to_json(NEW)::text;
+        PERFORM pg_notify('actif_change', payload);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
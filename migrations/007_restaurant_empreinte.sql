@@ -0,0 +1,10 @@
+/***************************************************************
+    *  CROUStillant - migrations/007_restaurant_empreinte.sql
+    *  Description: Empreinte des restaurants (un restaurant inchangé n'est plus
+    *               réécrit) et nombre de lignes écrites par tâche
+***************************************************************/
+
+ALTER TABLE RESTAURANT ADD COLUMN IF NOT EXISTS EMPREINTE VARCHAR(64);
+
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS RESTAURANTS_ECRITS INT;
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS LIGNES_ECRITES INT;
@@ -0,0 +1,244 @@
+/***************************************************************
+    *  CROUStillant - migrations/008_menu_rollups.sql
+    *  Description: Agrégats des menus maintenus de façon incrémentale (tables STATS_*),
+    *               et vues v_restaurant_insights_summary / v_plats_top calculées à partir
+    *               de ces agrégats
+***************************************************************/
+
+-- Agrégats des menus, maintenus de façon incrémentale par rollup_menus() à partir des menus
+-- écrits à chaque cycle d'ingestion. Les vues v_restaurant_insights_summary et v_plats_top
+-- sont calculées à partir de ces tables, sans parcourir PLAT -> COMPOSITION -> CATEGORIE ->
+-- REPAS -> MENU.
+
+-- Nombre d'occurrences de chaque plat, par restaurant et par jour
+CREATE TABLE IF NOT EXISTS STATS_PLAT_JOUR(
+    RID INT,
+    DATE DATE,
+    PLATID INT,
+    NB INT,
+    CONSTRAINT PK_STATS_PLAT_JOUR PRIMARY KEY (RID, DATE, PLATID)
+);
+
+-- Richesse des menus, par restaurant et par jour (repas et catégories non vides, plats)
+CREATE TABLE IF NOT EXISTS STATS_RESTAURANT_JOUR(
+    RID INT,
+    DATE DATE,
+    NB_REPAS INT,
+    NB_CATEGORIES INT,
+    NB_PLATS INT,
+    CONSTRAINT PK_STATS_RESTAURANT_JOUR PRIMARY KEY (RID, DATE)
+);
+
+-- Nombre d'occurrences de chaque plat, par restaurant, sur tout l'historique
+CREATE TABLE IF NOT EXISTS STATS_PLAT_RESTAURANT(
+    RID INT,
+    PLATID INT,
+    NB INT,
+    CONSTRAINT PK_STATS_PLAT_RESTAURANT PRIMARY KEY (RID, PLATID)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stats_plat_jour_date ON STATS_PLAT_JOUR (DATE);
+CREATE INDEX IF NOT EXISTS idx_stats_restaurant_jour_date ON STATS_RESTAURANT_JOUR (DATE);
+
+
+-- Mise à jour des agrégats (tables STATS_*) pour les menus donnés.
+-- Les agrégats de chaque jour (RID, DATE) concerné sont recalculés à partir des menus
+-- enregistrés ; les totaux sur tout l'historique sont corrigés de la différence.
+-- Appelée par le worker en fin de chargement, avec les menus écrits pendant le cycle.
+CREATE OR REPLACE FUNCTION rollup_menus(mids INT[])
+RETURNS INT AS $$
+DECLARE
+    rids INT[];
+    dates DATE[];
+BEGIN
+    SELECT ARRAY_AGG(K.RID), ARRAY_AGG(K.DATE)
+    INTO rids, dates
+    FROM (
+        SELECT DISTINCT RID, DATE
+        FROM MENU
+        WHERE MID = ANY(mids)
+    ) K;
+
+    IF rids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Retirer les anciens agrégats des jours concernés des totaux
+    UPDATE STATS_PLAT_RESTAURANT T
+    SET NB = T.NB - D.NB
+    FROM (
+        SELECT J.RID, J.PLATID, SUM(J.NB) AS NB
+        FROM STATS_PLAT_JOUR J
+        JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+        GROUP BY J.RID, J.PLATID
+    ) D
+    WHERE T.RID = D.RID AND T.PLATID = D.PLATID;
+
+    DELETE FROM STATS_PLAT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    DELETE FROM STATS_RESTAURANT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    -- Recalculer les agrégats des jours concernés
+    INSERT INTO STATS_PLAT_JOUR (RID, DATE, PLATID, NB)
+    SELECT M.RID, M.DATE, CO.PLATID, COUNT(*)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RPID = RP.RPID
+    JOIN COMPOSITION CO ON CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE, CO.PLATID;
+
+    INSERT INTO STATS_RESTAURANT_JOUR (RID, DATE, NB_REPAS, NB_CATEGORIES, NB_PLATS)
+    SELECT M.RID, M.DATE, COUNT(DISTINCT RP.RPID), COUNT(DISTINCT C.CATID), COUNT(CO.PLATID)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RPID = RP.RPID
+    LEFT JOIN COMPOSITION CO ON CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE;
+
+    -- Ajouter les nouveaux agrégats aux totaux
+    INSERT INTO STATS_PLAT_RESTAURANT (RID, PLATID, NB)
+    SELECT J.RID, J.PLATID, SUM(J.NB)
+    FROM STATS_PLAT_JOUR J
+    JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+    GROUP BY J.RID, J.PLATID
+    ON CONFLICT (RID, PLATID) DO UPDATE
+    SET NB = STATS_PLAT_RESTAURANT.NB + EXCLUDED.NB;
+
+    DELETE FROM STATS_PLAT_RESTAURANT
+    WHERE RID = ANY(rids) AND NB <= 0;
+
+    RETURN CARDINALITY(rids);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recalcul complet des agrégats (tables STATS_*), à partir de tous les menus enregistrés.
+-- À appeler une fois après la création des tables, ou pour corriger une dérive.
+CREATE OR REPLACE FUNCTION rebuild_rollups()
+RETURNS INT AS $$
+BEGIN
+    TRUNCATE STATS_PLAT_JOUR, STATS_RESTAURANT_JOUR, STATS_PLAT_RESTAURANT;
+
+    RETURN rollup_menus(ARRAY(SELECT MID FROM MENU));
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Remplissage initial des agrégats à partir de tous les menus enregistrés
+SELECT rebuild_rollups();
+
+
+DROP MATERIALIZED VIEW IF EXISTS v_restaurant_insights_summary;
+DROP MATERIALIZED VIEW IF EXISTS v_plats_top;
+
+
+-- Vue pour les insights des restaurants (couverture, variété, richesse, plats fréquents)
+-- sur l'année scolaire en cours (du 1er septembre à hier).
+--
+-- Calculée à partir des agrégats par jour (STATS_RESTAURANT_JOUR, STATS_PLAT_JOUR), maintenus
+-- par rollup_menus() : la vue ne traverse plus PLAT -> COMPOSITION -> CATEGORIE -> REPAS -> MENU,
+-- quatre tables partitionnées par HASH sur leur propre clé primaire. L'API n'a plus qu'à lire une
+-- ligne par RID.
+--
+-- Rafraîchie en fin de cycle d'ingestion (voir CROUStillant/__main__.py), seulement si des menus
+-- ont été écrits ou si la période a changé (nouveau jour) : les chiffres sont donc à jour "à la
+-- dernière ingestion", ce qui convient pour des statistiques qui ne changent qu'une fois par jour au plus.
+CREATE MATERIALIZED VIEW v_restaurant_insights_summary AS
+WITH bounds AS (
+    SELECT
+        (CASE
+            WHEN EXTRACT(MONTH FROM CURRENT_DATE) >= 9
+                THEN MAKE_DATE(EXTRACT(YEAR FROM CURRENT_DATE)::int, 9, 1)
+            ELSE MAKE_DATE(EXTRACT(YEAR FROM CURRENT_DATE)::int - 1, 9, 1)
+        END) AS periode_debut,
+        (CURRENT_DATE - 1) AS periode_fin
+),
+richness AS (
+    SELECT
+        S.RID,
+        SUM(S.NB_REPAS) AS nb_repas,
+        SUM(S.NB_CATEGORIES) AS nb_categories,
+        SUM(S.NB_PLATS) AS nb_plats
+    FROM STATS_RESTAURANT_JOUR S
+    CROSS JOIN bounds B
+    WHERE S.DATE BETWEEN B.periode_debut AND B.periode_fin
+    GROUP BY S.RID
+),
+dishes AS (
+    SELECT
+        S.RID,
+        S.PLATID,
+        SUM(S.NB) AS nb
+    FROM STATS_PLAT_JOUR S
+    CROSS JOIN bounds B
+    WHERE S.DATE BETWEEN B.periode_debut AND B.periode_fin
+    GROUP BY S.RID, S.PLATID
+),
+ranked_dishes AS (
+    SELECT
+        RID,
+        PLATID,
+        NB,
+        ROW_NUMBER() OVER (PARTITION BY RID ORDER BY NB DESC) AS rn
+    FROM dishes
+),
+top_dishes AS (
+    SELECT
+        RD.RID,
+        JSONB_AGG(
+            JSONB_BUILD_OBJECT('code', RD.PLATID, 'libelle', P.LIBELLE, 'total', RD.NB)
+            ORDER BY RD.NB DESC
+        ) AS plats_frequents
+    FROM ranked_dishes RD
+    JOIN PLAT P ON P.PLATID = RD.PLATID
+    WHERE RD.RN <= 20
+    GROUP BY RD.RID
+),
+unique_dishes AS (
+    SELECT RID, COUNT(*) AS plats_uniques
+    FROM dishes
+    GROUP BY RID
+)
+SELECT
+    R.RID AS rid,
+    (SELECT periode_debut FROM bounds) AS periode_debut,
+    (SELECT periode_fin FROM bounds) AS periode_fin,
+    COALESCE(RI.nb_repas, 0) AS nb_repas,
+    COALESCE(RI.nb_categories, 0) AS nb_categories,
+    COALESCE(RI.nb_plats, 0) AS nb_plats,
+    COALESCE(UD.plats_uniques, 0) AS plats_uniques,
+    COALESCE(TD.plats_frequents, '[]'::jsonb) AS plats_frequents
+FROM RESTAURANT R
+LEFT JOIN richness RI ON RI.RID = R.RID
+LEFT JOIN unique_dishes UD ON UD.RID = R.RID
+LEFT JOIN top_dishes TD ON TD.RID = R.RID
+WHERE R.ACTIF = TRUE
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS v_restaurant_insights_summary_rid_idx ON v_restaurant_insights_summary (rid);
+
+
+-- Vue pour le top 100 des plats les plus populaires (tous restaurants de type CROUS, IDTPR = 1).
+-- Calculée à partir des totaux par restaurant (STATS_PLAT_RESTAURANT), maintenus par
+-- rollup_menus(), et rafraîchie seulement si des menus ont été écrits (voir CROUStillant/__main__.py).
+CREATE MATERIALIZED VIEW v_plats_top AS
+SELECT
+    P.PLATID AS platid,
+    P.LIBELLE AS libelle,
+    SUM(S.NB) AS nb,
+    ROW_NUMBER() OVER (ORDER BY SUM(S.NB) DESC) AS rang
+FROM STATS_PLAT_RESTAURANT S
+JOIN RESTAURANT R ON R.RID = S.RID AND R.IDTPR = 1
+JOIN PLAT P ON P.PLATID = S.PLATID
+GROUP BY P.PLATID, P.LIBELLE
+ORDER BY nb DESC
+LIMIT 100
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS v_plats_top_platid_idx ON v_plats_top (platid);
@@ -0,0 +1,21 @@
+/***************************************************************
+    *  CROUStillant - migrations/009_vue_rafraichissement.sql
+    *  Description: Historique des rafraîchissements des vues matérialisées
+    *               (durée, cadence, voir CROUStillant/refresh.py)
+***************************************************************/
+
+-- Rafraîchissements des vues matérialisées (voir CROUStillant/refresh.py)
+-- STATUT : ok (effectué), differe (repoussé par la cadence de la vue), erreur
+-- DUREE  : durée du rafraîchissement en secondes (NULL s'il a été différé)
+CREATE TABLE IF NOT EXISTS VUE_RAFRAICHISSEMENT(
+    ID SERIAL PRIMARY KEY,
+    IDTACHE INT,
+    VUE VARCHAR(100),
+    DEBUT TIMESTAMP,
+    DUREE FLOAT,
+    STATUT VARCHAR(10),
+    CONSTRAINT FK_VUE_RAFRAICHISSEMENT_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID),
+    CONSTRAINT CK_VUE_RAFRAICHISSEMENT_STATUT CHECK (STATUT IN ('ok', 'differe', 'erreur'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_vue_rafraichissement_vue_debut ON VUE_RAFRAICHISSEMENT (VUE, DEBUT);
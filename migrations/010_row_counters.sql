@@ -0,0 +1,274 @@
+/***************************************************************
+    *  CROUStillant - migrations/010_row_counters.sql
+    *  Description: Compteurs de lignes mis à jour par des déclencheurs par instruction,
+    *               et v_stats calculée à partir de ces compteurs au lieu de COUNT(*)
+***************************************************************/
+
+-- Compteurs de lignes (voir count_rows() et v_compteurs)
+-- Chaque instruction qui insère ou supprime des lignes ajoute une ligne de différence (DELTA) :
+-- les transactions concurrentes n'attendent jamais sur une même ligne. Les différences sont
+-- regroupées par compact_counters() en fin de cycle d'ingestion.
+CREATE TABLE IF NOT EXISTS COMPTEUR(
+    ID BIGSERIAL PRIMARY KEY,
+    NOM VARCHAR(50),
+    DELTA BIGINT
+);
+
+
+-- Mise à jour des compteurs de lignes (table COMPTEUR), par instruction et non par ligne :
+-- les lignes insérées, supprimées ou modifiées sont lues dans les tables de transition.
+CREATE OR REPLACE FUNCTION count_rows()
+RETURNS TRIGGER AS $$
+DECLARE
+    nom TEXT;
+    delta BIGINT;
+    actifs BIGINT := 0;
+BEGIN
+    nom := CASE TG_TABLE_NAME
+        WHEN 'region' THEN 'regions'
+        WHEN 'restaurant' THEN 'restaurants'
+        WHEN 'type_restaurant' THEN 'types_restaurants'
+        WHEN 'menu' THEN 'menus'
+        WHEN 'repas' THEN 'repas'
+        WHEN 'categorie' THEN 'categories'
+        WHEN 'plat' THEN 'plats'
+        WHEN 'composition' THEN 'compositions'
+    END;
+
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM nouvelles;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT COUNT(*) INTO actifs FROM nouvelles WHERE ACTIF = TRUE;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM anciennes;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT -COUNT(*) INTO actifs FROM anciennes WHERE ACTIF = TRUE;
+        END IF;
+    ELSE
+        -- Modification (RESTAURANT uniquement) : seul le nombre de restaurants actifs change
+        delta := 0;
+        SELECT
+            (SELECT COUNT(*) FROM nouvelles WHERE ACTIF = TRUE)
+            - (SELECT COUNT(*) FROM anciennes WHERE ACTIF = TRUE)
+        INTO actifs;
+    END IF;
+
+    IF delta <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES (nom, delta);
+    END IF;
+
+    IF actifs <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES ('restaurants_actifs', actifs);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Regroupe les différences de chaque compteur en une seule ligne.
+-- Les différences ajoutées pendant le regroupement sont conservées telles quelles.
+CREATE OR REPLACE FUNCTION compact_counters()
+RETURNS VOID AS $$
+BEGIN
+    WITH deleted AS (
+        DELETE FROM COMPTEUR
+        RETURNING NOM, DELTA
+    )
+    INSERT INTO COMPTEUR (NOM, DELTA)
+    SELECT NOM, SUM(DELTA)
+    FROM deleted
+    GROUP BY NOM;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recalcul exact des compteurs (COUNT(*) sur chaque table).
+-- À appeler une fois après la création des déclencheurs, ou pour corriger une dérive.
+CREATE OR REPLACE FUNCTION rebuild_counters()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE COMPTEUR IN EXCLUSIVE MODE;
+
+    DELETE FROM COMPTEUR;
+
+    INSERT INTO COMPTEUR (NOM, DELTA)
+    VALUES
+        ('regions', (SELECT COUNT(*) FROM REGION)),
+        ('restaurants', (SELECT COUNT(*) FROM RESTAURANT)),
+        ('restaurants_actifs', (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE)),
+        ('types_restaurants', (SELECT COUNT(*) FROM TYPE_RESTAURANT)),
+        ('menus', (SELECT COUNT(*) FROM MENU)),
+        ('repas', (SELECT COUNT(*) FROM REPAS)),
+        ('categories', (SELECT COUNT(*) FROM CATEGORIE)),
+        ('plats', (SELECT COUNT(*) FROM PLAT)),
+        ('compositions', (SELECT COUNT(*) FROM COMPOSITION));
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Estimation du nombre de lignes d'une table, à partir des statistiques de l'optimiseur
+-- (pg_class.reltuples, mises à jour par ANALYZE et l'autovacuum). Pour une table partitionnée,
+-- somme des estimations de ses partitions.
+CREATE OR REPLACE FUNCTION estimate_rows(tbl REGCLASS)
+RETURNS BIGINT AS $$
+    SELECT COALESCE(SUM(GREATEST(C.RELTUPLES, 0)), 0)::BIGINT
+    FROM pg_class C
+    WHERE C.OID = tbl
+       OR C.OID IN (SELECT INHRELID FROM pg_inherits WHERE INHPARENT = tbl);
+$$ LANGUAGE sql STABLE;
+
+
+-- Compteurs de lignes, mis à jour à chaque instruction
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REGION
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REGION
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON RESTAURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON RESTAURANT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON TYPE_RESTAURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON TYPE_RESTAURANT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON MENU
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON MENU
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REPAS
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REPAS
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON CATEGORIE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON CATEGORIE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON PLAT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON PLAT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON COMPOSITION
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON COMPOSITION
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsUpdate
+AFTER UPDATE ON RESTAURANT
+REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+
+-- Remplissage initial des compteurs
+SELECT rebuild_counters();
+
+
+DROP MATERIALIZED VIEW IF EXISTS v_stats;
+
+
+-- Compteurs de lignes exacts, à partir des différences enregistrées dans COMPTEUR
+-- (quelques lignes par compteur, au lieu d'un COUNT(*) sur chaque partition)
+CREATE VIEW v_compteurs AS
+SELECT
+    1 AS id,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'regions'), 0)::BIGINT AS regions,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'restaurants'), 0)::BIGINT AS restaurants,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'restaurants_actifs'), 0)::BIGINT AS restaurants_actifs,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'types_restaurants'), 0)::BIGINT AS types_restaurants,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'menus'), 0)::BIGINT AS menus,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'repas'), 0)::BIGINT AS repas,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'categories'), 0)::BIGINT AS categories,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'plats'), 0)::BIGINT AS plats,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'compositions'), 0)::BIGINT AS compositions
+FROM COMPTEUR;
+
+
+-- Estimation des compteurs de lignes, à partir des statistiques de l'optimiseur (voir estimate_rows()).
+-- Instantanée mais approximative : pour l'affichage uniquement.
+CREATE VIEW v_stats_estimation AS
+SELECT
+    1 AS id,
+    estimate_rows('REGION') AS regions,
+    estimate_rows('RESTAURANT') AS restaurants,
+    (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE) AS restaurants_actifs,
+    estimate_rows('TYPE_RESTAURANT') AS types_restaurants,
+    estimate_rows('MENU') AS menus,
+    estimate_rows('REPAS') AS repas,
+    estimate_rows('CATEGORIE') AS categories,
+    estimate_rows('PLAT') AS plats,
+    estimate_rows('COMPOSITION') AS compositions;
+
+
+-- Vue pour les statistiques (lue par l'API), copie des compteurs exacts
+CREATE MATERIALIZED VIEW v_stats AS
+SELECT * FROM v_compteurs
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS v_stats_unique_idx ON v_stats (id);
@@ -0,0 +1,111 @@
+/***************************************************************
+    *  CROUStillant - migrations/011_menu_tree_rid.sql
+    *  Description: RID recopié dans REPAS, CATEGORIE et COMPOSITION, pour filtrer
+    *               l'arbre des menus par restaurant (et permettre le schéma
+    *               co-partitionné, voir CROUStillant/layout.py)
+    *               À appliquer worker arrêté : les lignes existantes sont complétées.
+***************************************************************/
+
+ALTER TABLE REPAS ADD COLUMN IF NOT EXISTS RID INT;
+ALTER TABLE CATEGORIE ADD COLUMN IF NOT EXISTS RID INT;
+ALTER TABLE COMPOSITION ADD COLUMN IF NOT EXISTS RID INT;
+
+ALTER TABLE STAGING_REPAS ADD COLUMN IF NOT EXISTS RID INT;
+ALTER TABLE STAGING_CATEGORIE ADD COLUMN IF NOT EXISTS RID INT;
+ALTER TABLE STAGING_COMPOSITION ADD COLUMN IF NOT EXISTS RID INT;
+
+UPDATE REPAS R
+SET RID = M.RID
+FROM MENU M
+WHERE M.MID = R.MID AND R.RID IS NULL;
+
+UPDATE CATEGORIE C
+SET RID = R.RID
+FROM REPAS R
+WHERE R.RPID = C.RPID AND C.RID IS NULL;
+
+UPDATE COMPOSITION CO
+SET RID = C.RID
+FROM CATEGORIE C
+WHERE C.CATID = CO.CATID AND CO.RID IS NULL;
+
+-- Cible des upserts de MENU (ON CONFLICT (RID, MID)), valable dans les deux schémas
+CREATE UNIQUE INDEX IF NOT EXISTS idx_menu_rid_mid ON MENU (RID, MID);
+
+
+-- Jointures des agrégats sur RID
+-- Mise à jour des agrégats (tables STATS_*) pour les menus donnés.
+-- Les agrégats de chaque jour (RID, DATE) concerné sont recalculés à partir des menus
+-- enregistrés ; les totaux sur tout l'historique sont corrigés de la différence.
+-- Appelée par le worker en fin de chargement, avec les menus écrits pendant le cycle.
+CREATE OR REPLACE FUNCTION rollup_menus(mids INT[])
+RETURNS INT AS $$
+DECLARE
+    rids INT[];
+    dates DATE[];
+BEGIN
+    SELECT ARRAY_AGG(K.RID), ARRAY_AGG(K.DATE)
+    INTO rids, dates
+    FROM (
+        SELECT DISTINCT RID, DATE
+        FROM MENU
+        WHERE MID = ANY(mids)
+    ) K;
+
+    IF rids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Retirer les anciens agrégats des jours concernés des totaux
+    UPDATE STATS_PLAT_RESTAURANT T
+    SET NB = T.NB - D.NB
+    FROM (
+        SELECT J.RID, J.PLATID, SUM(J.NB) AS NB
+        FROM STATS_PLAT_JOUR J
+        JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+        GROUP BY J.RID, J.PLATID
+    ) D
+    WHERE T.RID = D.RID AND T.PLATID = D.PLATID;
+
+    DELETE FROM STATS_PLAT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    DELETE FROM STATS_RESTAURANT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    -- Recalculer les agrégats des jours concernés
+    INSERT INTO STATS_PLAT_JOUR (RID, DATE, PLATID, NB)
+    SELECT M.RID, M.DATE, CO.PLATID, COUNT(*)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE, CO.PLATID;
+
+    INSERT INTO STATS_RESTAURANT_JOUR (RID, DATE, NB_REPAS, NB_CATEGORIES, NB_PLATS)
+    SELECT M.RID, M.DATE, COUNT(DISTINCT RP.RPID), COUNT(DISTINCT C.CATID), COUNT(CO.PLATID)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    LEFT JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE;
+
+    -- Ajouter les nouveaux agrégats aux totaux
+    INSERT INTO STATS_PLAT_RESTAURANT (RID, PLATID, NB)
+    SELECT J.RID, J.PLATID, SUM(J.NB)
+    FROM STATS_PLAT_JOUR J
+    JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+    GROUP BY J.RID, J.PLATID
+    ON CONFLICT (RID, PLATID) DO UPDATE
+    SET NB = STATS_PLAT_RESTAURANT.NB + EXCLUDED.NB;
+
+    DELETE FROM STATS_PLAT_RESTAURANT
+    WHERE RID = ANY(rids) AND NB <= 0;
+
+    RETURN CARDINALITY(rids);
+END;
+$$ LANGUAGE plpgsql;
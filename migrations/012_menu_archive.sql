@@ -0,0 +1,389 @@
+/***************************************************************
+    *  CROUStillant - migrations/012_menu_archive.sql
+    *  Description: Archives des menus des années scolaires passées (tables *_ARCHIVE
+    *               partitionnées par année scolaire), vues v_menus, v_repas, v_categories
+    *               et v_compositions sur tout l'historique
+***************************************************************/
+
+-- Archives des menus (voir archive_menus() et CROUStillant/archive.py)
+-- Les menus des années scolaires passées sont déplacés, avec leurs repas, catégories et
+-- compositions, hors des tables de l'arbre des menus : celles-ci ne contiennent plus que les
+-- années scolaires récentes. Les archives ne sont plus modifiées : elles sont partitionnées par
+-- année scolaire (voir create_archive_partitions()), sans clé étrangère, gelées (VACUUM FREEZE)
+-- et indexées avec des index BRIN sur la date (les lignes sont archivées dans l'ordre des dates).
+-- La date du menu est recopiée dans chaque table, pour partitionner l'arbre de la même façon.
+-- Les vues v_menus, v_repas, v_categories et v_compositions réunissent menus récents et archivés.
+CREATE TABLE IF NOT EXISTS MENU_ARCHIVE(
+    MID INT,
+    DATE DATE NOT NULL,
+    RID INT,
+    MENU_HASH VARCHAR(64),
+    INGESTION_AT TIMESTAMP,
+    LAST_CHECKED TIMESTAMP,
+    CONSTRAINT PK_MENU_ARCHIVE PRIMARY KEY (MID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE IF NOT EXISTS REPAS_ARCHIVE(
+    RPID INT,
+    TPR VARCHAR(10),
+    MID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    REPAS_HASH VARCHAR(64),
+    CONSTRAINT PK_REPAS_ARCHIVE PRIMARY KEY (RPID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE IF NOT EXISTS CATEGORIE_ARCHIVE(
+    CATID INT,
+    TPCAT VARCHAR(500),
+    ORDRE INT,
+    RPID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    CATEGORIE_HASH VARCHAR(64),
+    CONSTRAINT PK_CATEGORIE_ARCHIVE PRIMARY KEY (CATID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE IF NOT EXISTS COMPOSITION_ARCHIVE(
+    CATID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    ORDRE INT,
+    PLATID INT,
+    CONSTRAINT PK_COMPOSITION_ARCHIVE PRIMARY KEY (CATID, PLATID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE INDEX IF NOT EXISTS idx_menu_archive_date ON MENU_ARCHIVE USING BRIN (DATE);
+CREATE INDEX IF NOT EXISTS idx_menu_archive_rid ON MENU_ARCHIVE (RID);
+CREATE INDEX IF NOT EXISTS idx_repas_archive_date ON REPAS_ARCHIVE USING BRIN (DATE);
+CREATE INDEX IF NOT EXISTS idx_repas_archive_mid ON REPAS_ARCHIVE (MID);
+CREATE INDEX IF NOT EXISTS idx_categorie_archive_date ON CATEGORIE_ARCHIVE USING BRIN (DATE);
+CREATE INDEX IF NOT EXISTS idx_categorie_archive_rpid ON CATEGORIE_ARCHIVE (RPID);
+CREATE INDEX IF NOT EXISTS idx_composition_archive_date ON COMPOSITION_ARCHIVE USING BRIN (DATE);
+CREATE INDEX IF NOT EXISTS idx_composition_archive_platid ON COMPOSITION_ARCHIVE (PLATID);
+
+
+-- Menus récents et archivés (voir archive_menus()), pour les requêtes sur tout l'historique
+CREATE OR REPLACE VIEW v_menus AS
+SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED FROM MENU
+UNION ALL
+SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED FROM MENU_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_repas AS
+SELECT RPID, TPR, MID, RID, REPAS_HASH FROM REPAS
+UNION ALL
+SELECT RPID, TPR, MID, RID, REPAS_HASH FROM REPAS_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_categories AS
+SELECT CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH FROM CATEGORIE
+UNION ALL
+SELECT CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH FROM CATEGORIE_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_compositions AS
+SELECT CATID, RID, ORDRE, PLATID FROM COMPOSITION
+UNION ALL
+SELECT CATID, RID, ORDRE, PLATID FROM COMPOSITION_ARCHIVE;
+
+
+-- Création des partitions des archives pour une année scolaire (du 1er septembre au 31 août)
+CREATE OR REPLACE FUNCTION create_archive_partitions(annee INT)
+RETURNS VOID AS $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['menu_archive', 'repas_archive', 'categorie_archive', 'composition_archive'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_tables
+            WHERE schemaname = 'public' AND tablename = tbl || '_' || annee
+        ) THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                tbl || '_' || annee,
+                tbl,
+                MAKE_DATE(annee, 9, 1),
+                MAKE_DATE(annee + 1, 9, 1)
+            );
+            RAISE NOTICE 'Created partition %', tbl || '_' || annee;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Archivage des menus antérieurs à `horizon` (les plus anciens d'abord), avec leurs repas,
+-- catégories et compositions : copie dans les tables *_ARCHIVE puis suppression.
+-- Les jours sont archivés en entier : un lot contient les `lot` menus les plus anciens, complétés
+-- par les autres menus du dernier jour (il peut donc dépasser `lot`). Un jour n'est jamais
+-- partagé entre deux lots, ni entre deux cycles si un lot échoue. Les agrégats (tables STATS_*)
+-- ne sont pas modifiés.
+-- Renvoie le nombre de menus archivés (0 : plus rien à archiver).
+CREATE OR REPLACE FUNCTION archive_menus(horizon DATE, lot INT DEFAULT 1000)
+RETURNS INT AS $$
+DECLARE
+    mids INT[];
+    annee INT;
+BEGIN
+    -- Jusqu'au jour du `lot`-ième menu le plus ancien inclus (tous les menus s'il y en a moins)
+    SELECT ARRAY_AGG(MID)
+    INTO mids
+    FROM MENU
+    WHERE DATE < horizon
+      AND DATE <= COALESCE(
+          (
+              SELECT DATE
+              FROM MENU
+              WHERE DATE < horizon
+              ORDER BY DATE
+              OFFSET GREATEST(lot, 1) - 1
+              LIMIT 1
+          ),
+          horizon
+      );
+
+    IF mids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    FOR annee IN
+        SELECT DISTINCT EXTRACT(YEAR FROM DATE - INTERVAL '8 months')::INT
+        FROM MENU
+        WHERE MID = ANY(mids)
+    LOOP
+        PERFORM create_archive_partitions(annee);
+    END LOOP;
+
+    INSERT INTO MENU_ARCHIVE (MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED)
+    SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED
+    FROM MENU
+    WHERE MID = ANY(mids)
+    ORDER BY DATE;
+
+    INSERT INTO REPAS_ARCHIVE (RPID, TPR, MID, RID, DATE, REPAS_HASH)
+    SELECT RP.RPID, RP.TPR, RP.MID, RP.RID, M.DATE, RP.REPAS_HASH
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    INSERT INTO CATEGORIE_ARCHIVE (CATID, TPCAT, ORDRE, RPID, RID, DATE, CATEGORIE_HASH)
+    SELECT C.CATID, C.TPCAT, C.ORDRE, C.RPID, C.RID, M.DATE, C.CATEGORIE_HASH
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    INSERT INTO COMPOSITION_ARCHIVE (CATID, RID, DATE, ORDRE, PLATID)
+    SELECT CO.CATID, CO.RID, M.DATE, CO.ORDRE, CO.PLATID
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    DELETE FROM COMPOSITION CO
+    USING MENU M, REPAS RP, CATEGORIE C
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID
+      AND C.RID = RP.RID AND C.RPID = RP.RPID
+      AND CO.RID = C.RID AND CO.CATID = C.CATID;
+
+    DELETE FROM CATEGORIE C
+    USING MENU M, REPAS RP
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID
+      AND C.RID = RP.RID AND C.RPID = RP.RPID;
+
+    DELETE FROM REPAS RP
+    USING MENU M
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID;
+
+    DELETE FROM MENU
+    WHERE MID = ANY(mids);
+
+    RETURN CARDINALITY(mids);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recalcul complet des agrégats (tables STATS_*), à partir de tous les menus enregistrés,
+-- récents et archivés.
+-- À appeler une fois après la création des tables, ou pour corriger une dérive.
+CREATE OR REPLACE FUNCTION rebuild_rollups()
+RETURNS INT AS $$
+DECLARE
+    jours INT;
+BEGIN
+    TRUNCATE STATS_PLAT_JOUR, STATS_RESTAURANT_JOUR, STATS_PLAT_RESTAURANT;
+
+    INSERT INTO STATS_PLAT_JOUR (RID, DATE, PLATID, NB)
+    SELECT M.RID, M.DATE, CO.PLATID, COUNT(*)
+    FROM v_menus M
+    JOIN v_repas RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN v_categories C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN v_compositions CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE, CO.PLATID;
+
+    INSERT INTO STATS_RESTAURANT_JOUR (RID, DATE, NB_REPAS, NB_CATEGORIES, NB_PLATS)
+    SELECT M.RID, M.DATE, COUNT(DISTINCT RP.RPID), COUNT(DISTINCT C.CATID), COUNT(CO.PLATID)
+    FROM v_menus M
+    JOIN v_repas RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN v_categories C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    LEFT JOIN v_compositions CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE;
+
+    GET DIAGNOSTICS jours = ROW_COUNT;
+
+    INSERT INTO STATS_PLAT_RESTAURANT (RID, PLATID, NB)
+    SELECT RID, PLATID, SUM(NB)
+    FROM STATS_PLAT_JOUR
+    GROUP BY RID, PLATID;
+
+    RETURN jours;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Mise à jour des compteurs de lignes (table COMPTEUR), par instruction et non par ligne :
+-- les lignes insérées, supprimées ou modifiées sont lues dans les tables de transition.
+CREATE OR REPLACE FUNCTION count_rows()
+RETURNS TRIGGER AS $$
+DECLARE
+    nom TEXT;
+    delta BIGINT;
+    actifs BIGINT := 0;
+BEGIN
+    -- Les archives (tables *_ARCHIVE) sont comptées avec les tables récentes
+    nom := CASE regexp_replace(TG_TABLE_NAME, '_archive$', '')
+        WHEN 'region' THEN 'regions'
+        WHEN 'restaurant' THEN 'restaurants'
+        WHEN 'type_restaurant' THEN 'types_restaurants'
+        WHEN 'menu' THEN 'menus'
+        WHEN 'repas' THEN 'repas'
+        WHEN 'categorie' THEN 'categories'
+        WHEN 'plat' THEN 'plats'
+        WHEN 'composition' THEN 'compositions'
+    END;
+
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM nouvelles;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT COUNT(*) INTO actifs FROM nouvelles WHERE ACTIF = TRUE;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM anciennes;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT -COUNT(*) INTO actifs FROM anciennes WHERE ACTIF = TRUE;
+        END IF;
+    ELSE
+        -- Modification (RESTAURANT uniquement) : seul le nombre de restaurants actifs change
+        delta := 0;
+        SELECT
+            (SELECT COUNT(*) FROM nouvelles WHERE ACTIF = TRUE)
+            - (SELECT COUNT(*) FROM anciennes WHERE ACTIF = TRUE)
+        INTO actifs;
+    END IF;
+
+    IF delta <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES (nom, delta);
+    END IF;
+
+    IF actifs <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES ('restaurants_actifs', actifs);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Les archives sont comptées avec les tables récentes
+CREATE OR REPLACE FUNCTION rebuild_counters()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE COMPTEUR IN EXCLUSIVE MODE;
+
+    DELETE FROM COMPTEUR;
+
+    INSERT INTO COMPTEUR (NOM, DELTA)
+    VALUES
+        ('regions', (SELECT COUNT(*) FROM REGION)),
+        ('restaurants', (SELECT COUNT(*) FROM RESTAURANT)),
+        ('restaurants_actifs', (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE)),
+        ('types_restaurants', (SELECT COUNT(*) FROM TYPE_RESTAURANT)),
+        ('menus', (SELECT COUNT(*) FROM v_menus)),
+        ('repas', (SELECT COUNT(*) FROM v_repas)),
+        ('categories', (SELECT COUNT(*) FROM v_categories)),
+        ('plats', (SELECT COUNT(*) FROM PLAT)),
+        ('compositions', (SELECT COUNT(*) FROM v_compositions));
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON MENU_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON MENU_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REPAS_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REPAS_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON CATEGORIE_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON CATEGORIE_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON COMPOSITION_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON COMPOSITION_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+
+-- Estimation des compteurs de lignes, à partir des statistiques de l'optimiseur (voir estimate_rows()).
+-- Instantanée mais approximative : pour l'affichage uniquement.
+CREATE OR REPLACE VIEW v_stats_estimation AS
+SELECT
+    1 AS id,
+    estimate_rows('REGION') AS regions,
+    estimate_rows('RESTAURANT') AS restaurants,
+    (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE) AS restaurants_actifs,
+    estimate_rows('TYPE_RESTAURANT') AS types_restaurants,
+    estimate_rows('MENU') + estimate_rows('MENU_ARCHIVE') AS menus,
+    estimate_rows('REPAS') + estimate_rows('REPAS_ARCHIVE') AS repas,
+    estimate_rows('CATEGORIE') + estimate_rows('CATEGORIE_ARCHIVE') AS categories,
+    estimate_rows('PLAT') AS plats,
+    estimate_rows('COMPOSITION') + estimate_rows('COMPOSITION_ARCHIVE') AS compositions;
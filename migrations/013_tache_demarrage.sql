@@ -0,0 +1,9 @@
+/***************************************************************
+    *  CROUStillant - migrations/013_tache_demarrage.sql
+    *  Description: Mode de lancement des tâches (unique ou démon), rattrapage, et coût
+    *               de démarrage (secondes écoulées avant le chargement des données)
+***************************************************************/
+
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS MODE VARCHAR(10);
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS RATTRAPAGE BOOLEAN DEFAULT FALSE;
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS DEMARRAGE FLOAT;
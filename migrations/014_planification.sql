@@ -0,0 +1,20 @@
+/***************************************************************
+    *  CROUStillant - migrations/014_planification.sql
+    *  Description: Planification des vérifications des menus par restaurant
+    *               (intervalle appris à partir des changements) et sondage des
+    *               restaurants désactivés
+***************************************************************/
+
+-- Planification des vérifications des menus, par restaurant (voir CROUStillant/planner.py)
+-- INTERVALLE : intervalle entre deux vérifications, en minutes, appris à partir des changements
+-- PROCHAINE  : date à partir de laquelle le restaurant est de nouveau vérifié (ou sondé, s'il est désactivé)
+CREATE TABLE IF NOT EXISTS PLANIFICATION(
+    RID INT PRIMARY KEY,
+    INTERVALLE INT,
+    PROCHAINE TIMESTAMP,
+    DERNIERE_VERIFICATION TIMESTAMP,
+    DERNIER_CHANGEMENT TIMESTAMP,
+    VERIFICATIONS INT DEFAULT 0,
+    CHANGEMENTS INT DEFAULT 0,
+    CONSTRAINT FK_PLANIFICATION_RESTAURANT FOREIGN KEY (RID) REFERENCES RESTAURANT(RID)
+);
@@ -0,0 +1,40 @@
+/***************************************************************
+    *  CROUStillant - migrations/015_tache_shards.sql
+    *  Description: Répartition d'une tâche entre plusieurs workers : cycle de la
+    *               tâche, workers et régions réclamées (baux)
+***************************************************************/
+
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS CYCLE TIMESTAMP;
+
+-- Répartition d'une tâche entre plusieurs workers (voir CROUStillant/shard.py)
+-- TACHE_SHARD  : workers d'une tâche, avec leurs compteurs (cumulés par le dernier worker à terminer)
+-- TACHE_REGION : régions d'une tâche, réclamées par un worker pour un bail (EXPIRATION) renouvelé tant qu'il est actif
+CREATE TABLE IF NOT EXISTS TACHE_SHARD(
+    IDTACHE INT,
+    SHARD VARCHAR(100),
+    PART INT,
+    DEBUT TIMESTAMP,
+    FIN TIMESTAMP,
+    EXPIRATION TIMESTAMP,
+    REGIONS INT,
+    REQUETES INT,
+    RESTAURANTS_ECRITS INT,
+    LIGNES_ECRITES INT,
+    TABLES VARCHAR(50)[],
+    CONSTRAINT PK_TACHE_SHARD PRIMARY KEY (IDTACHE, SHARD),
+    CONSTRAINT FK_TACHE_SHARD_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID)
+);
+
+CREATE TABLE IF NOT EXISTS TACHE_REGION(
+    IDTACHE INT,
+    IDREG INT,
+    SHARD VARCHAR(100),
+    PRISE TIMESTAMP,
+    EXPIRATION TIMESTAMP,
+    FIN TIMESTAMP,
+    CONSTRAINT PK_TACHE_REGION PRIMARY KEY (IDTACHE, IDREG),
+    CONSTRAINT FK_TACHE_REGION_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID),
+    CONSTRAINT FK_TACHE_REGION_REGION FOREIGN KEY (IDREG) REFERENCES REGION(IDREG)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tache_cycle ON TACHE (CYCLE);
@@ -0,0 +1,13 @@
+/***************************************************************
+    *  CROUStillant - migrations/016_tache_statut.sql
+    *  Description: Statut des tâches (terminée, interrompue par le temps alloué, erreur)
+    *               et régions reportées à la tâche suivante
+***************************************************************/
+
+-- STATUT    : terminee, interrompue (temps alloué écoulé), erreur
+-- REPORTEES : régions reportées à la tâche suivante, qui les charge en premier
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS STATUT VARCHAR(12)
+    CONSTRAINT CK_TACHE_STATUT CHECK (STATUT IN ('terminee', 'interrompue', 'erreur'));
+ALTER TABLE TACHE ADD COLUMN IF NOT EXISTS REPORTEES INT[];
+
+ALTER TABLE TACHE_SHARD ADD COLUMN IF NOT EXISTS REPORTEES INT[];
@@ -0,0 +1,20 @@
+/***************************************************************
+    *  CROUStillant - migrations/017_tache_metrique.sql
+    *  Description: Mesures des tâches : durée des phases, latence des requêtes à l'API
+    *               et des requêtes SQL, lignes écrites et accès aux caches
+***************************************************************/
+
+-- Mesures des tâches (voir CROUStillant/metrics.py)
+-- TYPE    : phase, etape (étape du pipeline), api, api_erreurs, sql, sql_erreurs, lignes, cache
+-- NOMBRE  : nombre d'occurrences (requêtes, éléments traités, lignes, accès au cache)
+-- DUREE   : durée totale en secondes, MAXIMUM : durée maximale d'une occurrence
+CREATE TABLE IF NOT EXISTS TACHE_METRIQUE(
+    IDTACHE INT,
+    TYPE VARCHAR(20),
+    NOM VARCHAR(100),
+    NOMBRE BIGINT DEFAULT 0,
+    DUREE FLOAT DEFAULT 0,
+    MAXIMUM FLOAT DEFAULT 0,
+    CONSTRAINT PK_TACHE_METRIQUE PRIMARY KEY (IDTACHE, TYPE, NOM),
+    CONSTRAINT FK_TACHE_METRIQUE_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID)
+);
@@ -0,0 +1,11 @@
+/***************************************************************
+    *  CROUStillant - migrations/018_tache_cloture.sql
+    *  Description: Statut « cloture » des tâches réparties : le dernier worker est désigné
+    *               sans renseigner FIN, renseignée seulement à la fin de la tâche
+***************************************************************/
+
+-- STATUT : terminee, interrompue (temps alloué écoulé), erreur, ou cloture (tâche répartie :
+--          dernier worker désigné, fin de la tâche en cours ; FIN n'est pas encore renseignée)
+ALTER TABLE TACHE DROP CONSTRAINT IF EXISTS CK_TACHE_STATUT;
+ALTER TABLE TACHE ADD CONSTRAINT CK_TACHE_STATUT
+    CHECK (STATUT IN ('terminee', 'interrompue', 'erreur', 'cloture'));
@@ -2,7 +2,7 @@
     *  CROUStillant - schema.sql
     *  Created by: CROUStillant Développement
     *  Created on: 13/11/2023
-    *  Updated on: 12/07/2026
+    *  Updated on: 18/10/2026
     *  Description: SQL database scheme for the CROUStillant project
 ***************************************************************/
 
@@ -24,7 +24,10 @@ CREATE TABLE TYPE_RESTAURANT(
 CREATE TABLE RESTAURANT_IMAGE(
     IMAGE_URL VARCHAR(255) PRIMARY KEY,
     RAW_IMAGE BYTEA,
-    DERNIERE_MODIFICATION TIMESTAMP
+    CONTENT_HASH VARCHAR(64),
+    DERNIERE_MODIFICATION TIMESTAMP,
+    ETAG VARCHAR(255),
+    LAST_MODIFIED VARCHAR(64)
 );
 
 
@@ -50,6 +53,7 @@ CREATE TABLE RESTAURANT(
     AJOUT TIMESTAMP,
     MIS_A_JOUR TIMESTAMP,
     ACTIF BOOLEAN,
+    EMPREINTE VARCHAR(64),
     CONSTRAINT FK_RESTAURANT_REGION FOREIGN KEY (IDREG) REFERENCES REGION(IDREG),
     CONSTRAINT FK_RESTAURANT_TYPE_RESTAURANT FOREIGN KEY (IDTPR) REFERENCES TYPE_RESTAURANT(IDTPR),
     CONSTRAINT FK_RESTAURANT_IMAGE FOREIGN KEY (IMAGE_URL) REFERENCES RESTAURANT_IMAGE(IMAGE_URL)
@@ -114,6 +118,9 @@ $$;
 
 
 -- Menu
+-- Le restaurant (RID) est recopié dans REPAS, CATEGORIE et COMPOSITION, et toutes les requêtes du
+-- worker filtrent sur RID : l'arbre d'un menu peut ainsi être partitionné par restaurant
+-- (schéma co-partitionné, voir CROUStillant/layout.py) sans modifier le worker.
 CREATE TABLE MENU
 (
     MID  INT PRIMARY KEY,
@@ -141,6 +148,8 @@ CREATE TABLE REPAS(
     RPID SERIAL PRIMARY KEY,
     TPR VARCHAR(10),
     MID INT,
+    RID INT,
+    REPAS_HASH VARCHAR(64),
     CONSTRAINT FK_REPAS_MENU FOREIGN KEY (MID) REFERENCES MENU(MID),
     CONSTRAINT CK_REPAS_TPR CHECK (TPR IN ('matin', 'midi', 'soir'))
 ) PARTITION BY HASH(RPID);
@@ -162,6 +171,8 @@ CREATE TABLE CATEGORIE(
     TPCAT VARCHAR(500),
     ORDRE INT,
     RPID INT,
+    RID INT,
+    CATEGORIE_HASH VARCHAR(64),
     CONSTRAINT FK_CATEGORIE_REPAS FOREIGN KEY (RPID) REFERENCES REPAS(RPID)
 ) PARTITION BY HASH(CATID);
 
@@ -196,6 +207,7 @@ $$;
 -- Composition
 CREATE TABLE COMPOSITION(
     CATID INT,
+    RID INT,
     ORDRE INT,
     PLATID INT,
     CONSTRAINT PK_COMPOSITION PRIMARY KEY (CATID, PLATID),
@@ -214,6 +226,134 @@ END;
 $$;
 
 
+-- Tables de transit pour l'écriture des menus par lots (voir CROUStillant/bulk.py)
+-- Non journalisées : leurs lignes sont insérées (COPY) puis supprimées dans la même transaction.
+CREATE UNLOGGED TABLE STAGING_MENU(
+    MID INT,
+    RID INT,
+    DATE DATE,
+    MENU_HASH VARCHAR(64)
+);
+
+CREATE UNLOGGED TABLE STAGING_REPAS(
+    RPID INT,
+    TPR VARCHAR(10),
+    MID INT,
+    RID INT,
+    REPAS_HASH VARCHAR(64)
+);
+
+CREATE UNLOGGED TABLE STAGING_CATEGORIE(
+    CATID INT,
+    TPCAT VARCHAR(500),
+    ORDRE INT,
+    RPID INT,
+    RID INT,
+    CATEGORIE_HASH VARCHAR(64)
+);
+
+CREATE UNLOGGED TABLE STAGING_COMPOSITION(
+    CATID INT,
+    RID INT,
+    ORDRE INT,
+    PLATID INT
+);
+
+
+-- Archives des menus (voir archive_menus() et CROUStillant/archive.py)
+-- Les menus des années scolaires passées sont déplacés, avec leurs repas, catégories et
+-- compositions, hors des tables de l'arbre des menus : celles-ci ne contiennent plus que les
+-- années scolaires récentes. Les archives ne sont plus modifiées : elles sont partitionnées par
+-- année scolaire (voir create_archive_partitions()), sans clé étrangère, gelées (VACUUM FREEZE)
+-- et indexées avec des index BRIN sur la date (les lignes sont archivées dans l'ordre des dates).
+-- La date du menu est recopiée dans chaque table, pour partitionner l'arbre de la même façon.
+-- Les vues v_menus, v_repas, v_categories et v_compositions réunissent menus récents et archivés.
+CREATE TABLE MENU_ARCHIVE(
+    MID INT,
+    DATE DATE NOT NULL,
+    RID INT,
+    MENU_HASH VARCHAR(64),
+    INGESTION_AT TIMESTAMP,
+    LAST_CHECKED TIMESTAMP,
+    CONSTRAINT PK_MENU_ARCHIVE PRIMARY KEY (MID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE REPAS_ARCHIVE(
+    RPID INT,
+    TPR VARCHAR(10),
+    MID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    REPAS_HASH VARCHAR(64),
+    CONSTRAINT PK_REPAS_ARCHIVE PRIMARY KEY (RPID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE CATEGORIE_ARCHIVE(
+    CATID INT,
+    TPCAT VARCHAR(500),
+    ORDRE INT,
+    RPID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    CATEGORIE_HASH VARCHAR(64),
+    CONSTRAINT PK_CATEGORIE_ARCHIVE PRIMARY KEY (CATID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE TABLE COMPOSITION_ARCHIVE(
+    CATID INT,
+    RID INT,
+    DATE DATE NOT NULL,
+    ORDRE INT,
+    PLATID INT,
+    CONSTRAINT PK_COMPOSITION_ARCHIVE PRIMARY KEY (CATID, PLATID, DATE)
+) PARTITION BY RANGE(DATE);
+
+CREATE INDEX idx_menu_archive_date ON MENU_ARCHIVE USING BRIN (DATE);
+CREATE INDEX idx_menu_archive_rid ON MENU_ARCHIVE (RID);
+CREATE INDEX idx_repas_archive_date ON REPAS_ARCHIVE USING BRIN (DATE);
+CREATE INDEX idx_repas_archive_mid ON REPAS_ARCHIVE (MID);
+CREATE INDEX idx_categorie_archive_date ON CATEGORIE_ARCHIVE USING BRIN (DATE);
+CREATE INDEX idx_categorie_archive_rpid ON CATEGORIE_ARCHIVE (RPID);
+CREATE INDEX idx_composition_archive_date ON COMPOSITION_ARCHIVE USING BRIN (DATE);
+CREATE INDEX idx_composition_archive_platid ON COMPOSITION_ARCHIVE (PLATID);
+
+
+-- Agrégats des menus, maintenus de façon incrémentale par rollup_menus() à partir des menus
+-- écrits à chaque cycle d'ingestion. Les vues v_restaurant_insights_summary et v_plats_top
+-- sont calculées à partir de ces tables, sans parcourir PLAT -> COMPOSITION -> CATEGORIE ->
+-- REPAS -> MENU.
+
+-- Nombre d'occurrences de chaque plat, par restaurant et par jour
+CREATE TABLE STATS_PLAT_JOUR(
+    RID INT,
+    DATE DATE,
+    PLATID INT,
+    NB INT,
+    CONSTRAINT PK_STATS_PLAT_JOUR PRIMARY KEY (RID, DATE, PLATID)
+);
+
+-- Richesse des menus, par restaurant et par jour (repas et catégories non vides, plats)
+CREATE TABLE STATS_RESTAURANT_JOUR(
+    RID INT,
+    DATE DATE,
+    NB_REPAS INT,
+    NB_CATEGORIES INT,
+    NB_PLATS INT,
+    CONSTRAINT PK_STATS_RESTAURANT_JOUR PRIMARY KEY (RID, DATE)
+);
+
+-- Nombre d'occurrences de chaque plat, par restaurant, sur tout l'historique
+CREATE TABLE STATS_PLAT_RESTAURANT(
+    RID INT,
+    PLATID INT,
+    NB INT,
+    CONSTRAINT PK_STATS_PLAT_RESTAURANT PRIMARY KEY (RID, PLATID)
+);
+
+CREATE INDEX idx_stats_plat_jour_date ON STATS_PLAT_JOUR (DATE);
+CREATE INDEX idx_stats_restaurant_jour_date ON STATS_RESTAURANT_JOUR (DATE);
+
+
 -- Traitement des plats (résultat du classifier : classification + libellé nettoyé)
 -- CLASSIFICATION :  1 = plat réel, 0 = pas un plat (métadonnée, prix, horaire...)
 -- LIBELLE_NET    :  libellé nettoyé (parenthèses supprimées), NULL si CLASSIFICATION = -1
@@ -328,6 +468,9 @@ $$;
 
 
 -- Tâche
+-- STATUT    : terminee, interrompue (temps alloué écoulé), erreur, ou cloture (tâche répartie :
+--             dernier worker désigné, fin de la tâche en cours ; FIN n'est pas encore renseignée)
+-- REPORTEES : régions reportées à la tâche suivante, qui les charge en premier
 CREATE TABLE TACHE(
     ID SERIAL PRIMARY KEY,
     DEBUT TIMESTAMP,
@@ -351,6 +494,14 @@ CREATE TABLE TACHE(
     FIN_COMPOSITIONS INT,
     FIN_ACTIFS INT,
     REQUETES INT,
+    RESTAURANTS_ECRITS INT,
+    LIGNES_ECRITES INT,
+    MODE VARCHAR(10),
+    RATTRAPAGE BOOLEAN DEFAULT FALSE,
+    DEMARRAGE FLOAT,
+    CYCLE TIMESTAMP,
+    STATUT VARCHAR(12),
+    REPORTEES INT[],
     CONSTRAINT CK_STATISTIQUES CHECK (
         DEBUT_REGIONS <= FIN_REGIONS AND 
         DEBUT_RESTAURANTS <= FIN_RESTAURANTS AND 
@@ -359,7 +510,8 @@ CREATE TABLE TACHE(
         DEBUT_PLATS <= FIN_PLATS AND
         DEBUT <= FIN
     ),
-    CONSTRAINT CK_STATISTIQUES_REQUETES CHECK (REQUETES >= 0)
+    CONSTRAINT CK_STATISTIQUES_REQUETES CHECK (REQUETES >= 0),
+    CONSTRAINT CK_TACHE_STATUT CHECK (STATUT IN ('terminee', 'interrompue', 'erreur', 'cloture'))
 ) PARTITION BY HASH(ID);
 
 -- Création des partitions pour la table TACHE
@@ -377,6 +529,8 @@ $$;
 CREATE TABLE TACHE_LOG(
     RID INT,
     IDTACHE INT,
+    ECHECS INT DEFAULT 0,
+    ERREUR VARCHAR(500),
     CONSTRAINT PK_TACHE_LOG PRIMARY KEY (RID, IDTACHE),
     CONSTRAINT FK_TACHE_LOG_RESTAURANT FOREIGN KEY (RID) REFERENCES RESTAURANT(RID),
     CONSTRAINT FK_TACHE_LOG_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID)
@@ -393,6 +547,98 @@ END;
 $$;
 
 
+-- Mesures des tâches (voir CROUStillant/metrics.py)
+-- TYPE    : phase, etape (étape du pipeline), api, api_erreurs, sql, sql_erreurs, lignes, cache
+-- NOMBRE  : nombre d'occurrences (requêtes, éléments traités, lignes, accès au cache)
+-- DUREE   : durée totale en secondes, MAXIMUM : durée maximale d'une occurrence
+CREATE TABLE TACHE_METRIQUE(
+    IDTACHE INT,
+    TYPE VARCHAR(20),
+    NOM VARCHAR(100),
+    NOMBRE BIGINT DEFAULT 0,
+    DUREE FLOAT DEFAULT 0,
+    MAXIMUM FLOAT DEFAULT 0,
+    CONSTRAINT PK_TACHE_METRIQUE PRIMARY KEY (IDTACHE, TYPE, NOM),
+    CONSTRAINT FK_TACHE_METRIQUE_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID)
+);
+
+
+-- Répartition d'une tâche entre plusieurs workers (voir CROUStillant/shard.py)
+-- TACHE_SHARD  : workers d'une tâche, avec leurs compteurs (cumulés par le dernier worker à terminer)
+-- TACHE_REGION : régions d'une tâche, réclamées par un worker pour un bail (EXPIRATION) renouvelé tant qu'il est actif
+CREATE TABLE TACHE_SHARD(
+    IDTACHE INT,
+    SHARD VARCHAR(100),
+    PART INT,
+    DEBUT TIMESTAMP,
+    FIN TIMESTAMP,
+    EXPIRATION TIMESTAMP,
+    REGIONS INT,
+    REQUETES INT,
+    RESTAURANTS_ECRITS INT,
+    LIGNES_ECRITES INT,
+    TABLES VARCHAR(50)[],
+    REPORTEES INT[],
+    CONSTRAINT PK_TACHE_SHARD PRIMARY KEY (IDTACHE, SHARD),
+    CONSTRAINT FK_TACHE_SHARD_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID)
+);
+
+CREATE TABLE TACHE_REGION(
+    IDTACHE INT,
+    IDREG INT,
+    SHARD VARCHAR(100),
+    PRISE TIMESTAMP,
+    EXPIRATION TIMESTAMP,
+    FIN TIMESTAMP,
+    CONSTRAINT PK_TACHE_REGION PRIMARY KEY (IDTACHE, IDREG),
+    CONSTRAINT FK_TACHE_REGION_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID),
+    CONSTRAINT FK_TACHE_REGION_REGION FOREIGN KEY (IDREG) REFERENCES REGION(IDREG)
+);
+
+CREATE INDEX idx_tache_cycle ON TACHE (CYCLE);
+
+
+-- Planification des vérifications des menus, par restaurant (voir CROUStillant/planner.py)
+-- INTERVALLE : intervalle entre deux vérifications, en minutes, appris à partir des changements
+-- PROCHAINE  : date à partir de laquelle le restaurant est de nouveau vérifié (ou sondé, s'il est désactivé)
+CREATE TABLE PLANIFICATION(
+    RID INT PRIMARY KEY,
+    INTERVALLE INT,
+    PROCHAINE TIMESTAMP,
+    DERNIERE_VERIFICATION TIMESTAMP,
+    DERNIER_CHANGEMENT TIMESTAMP,
+    VERIFICATIONS INT DEFAULT 0,
+    CHANGEMENTS INT DEFAULT 0,
+    CONSTRAINT FK_PLANIFICATION_RESTAURANT FOREIGN KEY (RID) REFERENCES RESTAURANT(RID)
+);
+
+
+-- Rafraîchissements des vues matérialisées (voir CROUStillant/refresh.py)
+-- STATUT : ok (effectué), differe (repoussé par la cadence de la vue), erreur
+-- DUREE  : durée du rafraîchissement en secondes (NULL s'il a été différé)
+CREATE TABLE VUE_RAFRAICHISSEMENT(
+    ID SERIAL PRIMARY KEY,
+    IDTACHE INT,
+    VUE VARCHAR(100),
+    DEBUT TIMESTAMP,
+    DUREE FLOAT,
+    STATUT VARCHAR(10),
+    CONSTRAINT FK_VUE_RAFRAICHISSEMENT_TACHE FOREIGN KEY (IDTACHE) REFERENCES TACHE(ID),
+    CONSTRAINT CK_VUE_RAFRAICHISSEMENT_STATUT CHECK (STATUT IN ('ok', 'differe', 'erreur'))
+);
+
+
+-- Compteurs de lignes (voir count_rows() et v_compteurs)
+-- Chaque instruction qui insère ou supprime des lignes ajoute une ligne de différence (DELTA) :
+-- les transactions concurrentes n'attendent jamais sur une même ligne. Les différences sont
+-- regroupées par compact_counters() en fin de cycle d'ingestion.
+CREATE TABLE COMPTEUR(
+    ID BIGSERIAL PRIMARY KEY,
+    NOM VARCHAR(50),
+    DELTA BIGINT
+);
+
+
 -- Bucket
 CREATE TABLE BUCKET(
     KEY VARCHAR(50) PRIMARY KEY,
@@ -462,6 +708,7 @@ CREATE TABLE GEO_DATA(
 -- Indexes
 CREATE INDEX idx_menu_date ON MENU (DATE);
 CREATE INDEX idx_menu_rid_date ON MENU (RID, DATE);
+CREATE UNIQUE INDEX idx_menu_rid_mid ON MENU (RID, MID);
 CREATE INDEX idx_repas_tpr ON REPAS (TPR);
 CREATE INDEX idx_repas_mid ON REPAS (MID);
 CREATE INDEX idx_categorie_rpid ON CATEGORIE (RPID);
@@ -469,6 +716,7 @@ CREATE INDEX idx_categorie_tpcat ON CATEGORIE (TPCAT);
 CREATE INDEX idx_plat_libelle ON PLAT (LIBELLE);
 CREATE INDEX idx_tache_debut ON TACHE (DEBUT);
 CREATE INDEX idx_tache_fin ON TACHE (FIN);
+CREATE INDEX idx_vue_rafraichissement_vue_debut ON VUE_RAFRAICHISSEMENT (VUE, DEBUT);
 CREATE INDEX idx_bucket_key ON BUCKET (KEY);
 CREATE INDEX idx_requests_logs_key ON REQUESTS_LOGS (KEY);
 CREATE INDEX idx_requests_logs_created_at ON REQUESTS_LOGS (CREATED_AT);
@@ -509,6 +757,352 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- Mise à jour des agrégats (tables STATS_*) pour les menus donnés.
+-- Les agrégats de chaque jour (RID, DATE) concerné sont recalculés à partir des menus
+-- enregistrés ; les totaux sur tout l'historique sont corrigés de la différence.
+-- Appelée par le worker en fin de chargement, avec les menus écrits pendant le cycle.
+CREATE OR REPLACE FUNCTION rollup_menus(mids INT[])
+RETURNS INT AS $$
+DECLARE
+    rids INT[];
+    dates DATE[];
+BEGIN
+    SELECT ARRAY_AGG(K.RID), ARRAY_AGG(K.DATE)
+    INTO rids, dates
+    FROM (
+        SELECT DISTINCT RID, DATE
+        FROM MENU
+        WHERE MID = ANY(mids)
+    ) K;
+
+    IF rids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Retirer les anciens agrégats des jours concernés des totaux
+    UPDATE STATS_PLAT_RESTAURANT T
+    SET NB = T.NB - D.NB
+    FROM (
+        SELECT J.RID, J.PLATID, SUM(J.NB) AS NB
+        FROM STATS_PLAT_JOUR J
+        JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+        GROUP BY J.RID, J.PLATID
+    ) D
+    WHERE T.RID = D.RID AND T.PLATID = D.PLATID;
+
+    DELETE FROM STATS_PLAT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    DELETE FROM STATS_RESTAURANT_JOUR J
+    USING UNNEST(rids, dates) AS K(RID, DATE)
+    WHERE K.RID = J.RID AND K.DATE = J.DATE;
+
+    -- Recalculer les agrégats des jours concernés
+    INSERT INTO STATS_PLAT_JOUR (RID, DATE, PLATID, NB)
+    SELECT M.RID, M.DATE, CO.PLATID, COUNT(*)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE, CO.PLATID;
+
+    INSERT INTO STATS_RESTAURANT_JOUR (RID, DATE, NB_REPAS, NB_CATEGORIES, NB_PLATS)
+    SELECT M.RID, M.DATE, COUNT(DISTINCT RP.RPID), COUNT(DISTINCT C.CATID), COUNT(CO.PLATID)
+    FROM UNNEST(rids, dates) AS K(RID, DATE)
+    JOIN MENU M ON M.RID = K.RID AND M.DATE = K.DATE
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    LEFT JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE;
+
+    -- Ajouter les nouveaux agrégats aux totaux
+    INSERT INTO STATS_PLAT_RESTAURANT (RID, PLATID, NB)
+    SELECT J.RID, J.PLATID, SUM(J.NB)
+    FROM STATS_PLAT_JOUR J
+    JOIN UNNEST(rids, dates) AS K(RID, DATE) ON K.RID = J.RID AND K.DATE = J.DATE
+    GROUP BY J.RID, J.PLATID
+    ON CONFLICT (RID, PLATID) DO UPDATE
+    SET NB = STATS_PLAT_RESTAURANT.NB + EXCLUDED.NB;
+
+    DELETE FROM STATS_PLAT_RESTAURANT
+    WHERE RID = ANY(rids) AND NB <= 0;
+
+    RETURN CARDINALITY(rids);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recalcul complet des agrégats (tables STATS_*), à partir de tous les menus enregistrés,
+-- récents et archivés.
+-- À appeler une fois après la création des tables, ou pour corriger une dérive.
+CREATE OR REPLACE FUNCTION rebuild_rollups()
+RETURNS INT AS $$
+DECLARE
+    jours INT;
+BEGIN
+    TRUNCATE STATS_PLAT_JOUR, STATS_RESTAURANT_JOUR, STATS_PLAT_RESTAURANT;
+
+    INSERT INTO STATS_PLAT_JOUR (RID, DATE, PLATID, NB)
+    SELECT M.RID, M.DATE, CO.PLATID, COUNT(*)
+    FROM v_menus M
+    JOIN v_repas RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN v_categories C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN v_compositions CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE, CO.PLATID;
+
+    INSERT INTO STATS_RESTAURANT_JOUR (RID, DATE, NB_REPAS, NB_CATEGORIES, NB_PLATS)
+    SELECT M.RID, M.DATE, COUNT(DISTINCT RP.RPID), COUNT(DISTINCT C.CATID), COUNT(CO.PLATID)
+    FROM v_menus M
+    JOIN v_repas RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN v_categories C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    LEFT JOIN v_compositions CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    GROUP BY M.RID, M.DATE;
+
+    GET DIAGNOSTICS jours = ROW_COUNT;
+
+    INSERT INTO STATS_PLAT_RESTAURANT (RID, PLATID, NB)
+    SELECT RID, PLATID, SUM(NB)
+    FROM STATS_PLAT_JOUR
+    GROUP BY RID, PLATID;
+
+    RETURN jours;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Création des partitions des archives pour une année scolaire (du 1er septembre au 31 août)
+CREATE OR REPLACE FUNCTION create_archive_partitions(annee INT)
+RETURNS VOID AS $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['menu_archive', 'repas_archive', 'categorie_archive', 'composition_archive'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_tables
+            WHERE schemaname = 'public' AND tablename = tbl || '_' || annee
+        ) THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                tbl || '_' || annee,
+                tbl,
+                MAKE_DATE(annee, 9, 1),
+                MAKE_DATE(annee + 1, 9, 1)
+            );
+            RAISE NOTICE 'Created partition %', tbl || '_' || annee;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Archivage des menus antérieurs à `horizon` (les plus anciens d'abord), avec leurs repas,
+-- catégories et compositions : copie dans les tables *_ARCHIVE puis suppression.
+-- Les jours sont archivés en entier : un lot contient les `lot` menus les plus anciens, complétés
+-- par les autres menus du dernier jour (il peut donc dépasser `lot`). Un jour n'est jamais
+-- partagé entre deux lots, ni entre deux cycles si un lot échoue. Les agrégats (tables STATS_*)
+-- ne sont pas modifiés.
+-- Renvoie le nombre de menus archivés (0 : plus rien à archiver).
+CREATE OR REPLACE FUNCTION archive_menus(horizon DATE, lot INT DEFAULT 1000)
+RETURNS INT AS $$
+DECLARE
+    mids INT[];
+    annee INT;
+BEGIN
+    -- Jusqu'au jour du `lot`-ième menu le plus ancien inclus (tous les menus s'il y en a moins)
+    SELECT ARRAY_AGG(MID)
+    INTO mids
+    FROM MENU
+    WHERE DATE < horizon
+      AND DATE <= COALESCE(
+          (
+              SELECT DATE
+              FROM MENU
+              WHERE DATE < horizon
+              ORDER BY DATE
+              OFFSET GREATEST(lot, 1) - 1
+              LIMIT 1
+          ),
+          horizon
+      );
+
+    IF mids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    FOR annee IN
+        SELECT DISTINCT EXTRACT(YEAR FROM DATE - INTERVAL '8 months')::INT
+        FROM MENU
+        WHERE MID = ANY(mids)
+    LOOP
+        PERFORM create_archive_partitions(annee);
+    END LOOP;
+
+    INSERT INTO MENU_ARCHIVE (MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED)
+    SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED
+    FROM MENU
+    WHERE MID = ANY(mids)
+    ORDER BY DATE;
+
+    INSERT INTO REPAS_ARCHIVE (RPID, TPR, MID, RID, DATE, REPAS_HASH)
+    SELECT RP.RPID, RP.TPR, RP.MID, RP.RID, M.DATE, RP.REPAS_HASH
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    INSERT INTO CATEGORIE_ARCHIVE (CATID, TPCAT, ORDRE, RPID, RID, DATE, CATEGORIE_HASH)
+    SELECT C.CATID, C.TPCAT, C.ORDRE, C.RPID, C.RID, M.DATE, C.CATEGORIE_HASH
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    INSERT INTO COMPOSITION_ARCHIVE (CATID, RID, DATE, ORDRE, PLATID)
+    SELECT CO.CATID, CO.RID, M.DATE, CO.ORDRE, CO.PLATID
+    FROM MENU M
+    JOIN REPAS RP ON RP.RID = M.RID AND RP.MID = M.MID
+    JOIN CATEGORIE C ON C.RID = RP.RID AND C.RPID = RP.RPID
+    JOIN COMPOSITION CO ON CO.RID = C.RID AND CO.CATID = C.CATID
+    WHERE M.MID = ANY(mids)
+    ORDER BY M.DATE;
+
+    DELETE FROM COMPOSITION CO
+    USING MENU M, REPAS RP, CATEGORIE C
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID
+      AND C.RID = RP.RID AND C.RPID = RP.RPID
+      AND CO.RID = C.RID AND CO.CATID = C.CATID;
+
+    DELETE FROM CATEGORIE C
+    USING MENU M, REPAS RP
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID
+      AND C.RID = RP.RID AND C.RPID = RP.RPID;
+
+    DELETE FROM REPAS RP
+    USING MENU M
+    WHERE M.MID = ANY(mids)
+      AND RP.RID = M.RID AND RP.MID = M.MID;
+
+    DELETE FROM MENU
+    WHERE MID = ANY(mids);
+
+    RETURN CARDINALITY(mids);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Mise à jour des compteurs de lignes (table COMPTEUR), par instruction et non par ligne :
+-- les lignes insérées, supprimées ou modifiées sont lues dans les tables de transition.
+CREATE OR REPLACE FUNCTION count_rows()
+RETURNS TRIGGER AS $$
+DECLARE
+    nom TEXT;
+    delta BIGINT;
+    actifs BIGINT := 0;
+BEGIN
+    -- Les archives (tables *_ARCHIVE) sont comptées avec les tables récentes
+    nom := CASE regexp_replace(TG_TABLE_NAME, '_archive$', '')
+        WHEN 'region' THEN 'regions'
+        WHEN 'restaurant' THEN 'restaurants'
+        WHEN 'type_restaurant' THEN 'types_restaurants'
+        WHEN 'menu' THEN 'menus'
+        WHEN 'repas' THEN 'repas'
+        WHEN 'categorie' THEN 'categories'
+        WHEN 'plat' THEN 'plats'
+        WHEN 'composition' THEN 'compositions'
+    END;
+
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM nouvelles;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT COUNT(*) INTO actifs FROM nouvelles WHERE ACTIF = TRUE;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM anciennes;
+
+        IF TG_TABLE_NAME = 'restaurant' THEN
+            SELECT -COUNT(*) INTO actifs FROM anciennes WHERE ACTIF = TRUE;
+        END IF;
+    ELSE
+        -- Modification (RESTAURANT uniquement) : seul le nombre de restaurants actifs change
+        delta := 0;
+        SELECT
+            (SELECT COUNT(*) FROM nouvelles WHERE ACTIF = TRUE)
+            - (SELECT COUNT(*) FROM anciennes WHERE ACTIF = TRUE)
+        INTO actifs;
+    END IF;
+
+    IF delta <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES (nom, delta);
+    END IF;
+
+    IF actifs <> 0 THEN
+        INSERT INTO COMPTEUR (NOM, DELTA) VALUES ('restaurants_actifs', actifs);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Regroupe les différences de chaque compteur en une seule ligne.
+-- Les différences ajoutées pendant le regroupement sont conservées telles quelles.
+CREATE OR REPLACE FUNCTION compact_counters()
+RETURNS VOID AS $$
+BEGIN
+    WITH deleted AS (
+        DELETE FROM COMPTEUR
+        RETURNING NOM, DELTA
+    )
+    INSERT INTO COMPTEUR (NOM, DELTA)
+    SELECT NOM, SUM(DELTA)
+    FROM deleted
+    GROUP BY NOM;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recalcul exact des compteurs (COUNT(*) sur chaque table).
+-- À appeler une fois après la création des déclencheurs, ou pour corriger une dérive.
+CREATE OR REPLACE FUNCTION rebuild_counters()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE COMPTEUR IN EXCLUSIVE MODE;
+
+    DELETE FROM COMPTEUR;
+
+    INSERT INTO COMPTEUR (NOM, DELTA)
+    VALUES
+        ('regions', (SELECT COUNT(*) FROM REGION)),
+        ('restaurants', (SELECT COUNT(*) FROM RESTAURANT)),
+        ('restaurants_actifs', (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE)),
+        ('types_restaurants', (SELECT COUNT(*) FROM TYPE_RESTAURANT)),
+        ('menus', (SELECT COUNT(*) FROM v_menus)),
+        ('repas', (SELECT COUNT(*) FROM v_repas)),
+        ('categories', (SELECT COUNT(*) FROM v_categories)),
+        ('plats', (SELECT COUNT(*) FROM PLAT)),
+        ('compositions', (SELECT COUNT(*) FROM v_compositions));
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Estimation du nombre de lignes d'une table, à partir des statistiques de l'optimiseur
+-- (pg_class.reltuples, mises à jour par ANALYZE et l'autovacuum). Pour une table partitionnée,
+-- somme des estimations de ses partitions.
+CREATE OR REPLACE FUNCTION estimate_rows(tbl REGCLASS)
+RETURNS BIGINT AS $$
+    SELECT COALESCE(SUM(GREATEST(C.RELTUPLES, 0)), 0)::BIGINT
+    FROM pg_class C
+    WHERE C.OID = tbl
+       OR C.OID IN (SELECT INHRELID FROM pg_inherits WHERE INHPARENT = tbl);
+$$ LANGUAGE sql STABLE;
+
+
 -- Listener
 CREATE OR REPLACE FUNCTION notifyOnInsert()
 RETURNS TRIGGER AS $$
@@ -534,6 +1128,12 @@ RETURNS TRIGGER AS $$
 DECLARE
     payload TEXT;
 BEGIN
+    -- Désactivation groupée (worker) : une seule notification récapitulative est envoyée
+    -- sur le canal actif_change_summary
+    IF current_setting('croustillant.bulk_actif', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
     IF OLD.ACTIF IS DISTINCT FROM NEW.ACTIF THEN
         payload := row_to_json(NEW)::text;
         PERFORM pg_notify('actif_change', payload);
@@ -549,19 +1149,216 @@ FOR EACH ROW
 EXECUTE FUNCTION notifyOnActifChange();
 
 
--- Vue pour les statistiques
-CREATE MATERIALIZED VIEW v_stats AS
+-- Compteurs de lignes, mis à jour à chaque instruction
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REGION
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REGION
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON RESTAURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON RESTAURANT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON TYPE_RESTAURANT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON TYPE_RESTAURANT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON MENU
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON MENU
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REPAS
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REPAS
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON CATEGORIE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON CATEGORIE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON PLAT
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON PLAT
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON COMPOSITION
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON COMPOSITION
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON MENU_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON MENU_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON REPAS_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON REPAS_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON CATEGORIE_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON CATEGORIE_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsInsert
+AFTER INSERT ON COMPOSITION_ARCHIVE
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsDelete
+AFTER DELETE ON COMPOSITION_ARCHIVE
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+CREATE OR REPLACE TRIGGER countRowsUpdate
+AFTER UPDATE ON RESTAURANT
+REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT
+EXECUTE FUNCTION count_rows();
+
+
+-- Menus récents et archivés (voir archive_menus()), pour les requêtes sur tout l'historique
+CREATE OR REPLACE VIEW v_menus AS
+SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED FROM MENU
+UNION ALL
+SELECT MID, DATE, RID, MENU_HASH, INGESTION_AT, LAST_CHECKED FROM MENU_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_repas AS
+SELECT RPID, TPR, MID, RID, REPAS_HASH FROM REPAS
+UNION ALL
+SELECT RPID, TPR, MID, RID, REPAS_HASH FROM REPAS_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_categories AS
+SELECT CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH FROM CATEGORIE
+UNION ALL
+SELECT CATID, TPCAT, ORDRE, RPID, RID, CATEGORIE_HASH FROM CATEGORIE_ARCHIVE;
+
+CREATE OR REPLACE VIEW v_compositions AS
+SELECT CATID, RID, ORDRE, PLATID FROM COMPOSITION
+UNION ALL
+SELECT CATID, RID, ORDRE, PLATID FROM COMPOSITION_ARCHIVE;
+
+
+-- Compteurs de lignes exacts, à partir des différences enregistrées dans COMPTEUR
+-- (quelques lignes par compteur, au lieu d'un COUNT(*) sur chaque partition)
+CREATE VIEW v_compteurs AS
+SELECT
+    1 AS id,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'regions'), 0)::BIGINT AS regions,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'restaurants'), 0)::BIGINT AS restaurants,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'restaurants_actifs'), 0)::BIGINT AS restaurants_actifs,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'types_restaurants'), 0)::BIGINT AS types_restaurants,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'menus'), 0)::BIGINT AS menus,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'repas'), 0)::BIGINT AS repas,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'categories'), 0)::BIGINT AS categories,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'plats'), 0)::BIGINT AS plats,
+    COALESCE(SUM(DELTA) FILTER (WHERE NOM = 'compositions'), 0)::BIGINT AS compositions
+FROM COMPTEUR;
+
+
+-- Estimation des compteurs de lignes, à partir des statistiques de l'optimiseur (voir estimate_rows()).
+-- Instantanée mais approximative : pour l'affichage uniquement.
+CREATE VIEW v_stats_estimation AS
 SELECT
     1 AS id,
-    (SELECT COUNT(*) FROM REGION) AS regions,
-    (SELECT COUNT(*) FROM RESTAURANT) AS restaurants,
+    estimate_rows('REGION') AS regions,
+    estimate_rows('RESTAURANT') AS restaurants,
     (SELECT COUNT(*) FROM RESTAURANT WHERE ACTIF = TRUE) AS restaurants_actifs,
-    (SELECT COUNT(*) FROM TYPE_RESTAURANT) AS types_restaurants,
-    (SELECT COUNT(*) FROM MENU) AS menus,
-    (SELECT COUNT(*) FROM REPAS) AS repas,
-    (SELECT COUNT(*) FROM CATEGORIE) AS categories,
-    (SELECT COUNT(*) FROM PLAT) AS plats,
-    (SELECT COUNT(*) FROM COMPOSITION) AS compositions
+    estimate_rows('TYPE_RESTAURANT') AS types_restaurants,
+    estimate_rows('MENU') + estimate_rows('MENU_ARCHIVE') AS menus,
+    estimate_rows('REPAS') + estimate_rows('REPAS_ARCHIVE') AS repas,
+    estimate_rows('CATEGORIE') + estimate_rows('CATEGORIE_ARCHIVE') AS categories,
+    estimate_rows('PLAT') AS plats,
+    estimate_rows('COMPOSITION') + estimate_rows('COMPOSITION_ARCHIVE') AS compositions;
+
+
+-- Vue pour les statistiques (lue par l'API), copie des compteurs exacts
+CREATE MATERIALIZED VIEW v_stats AS
+SELECT * FROM v_compteurs
 WITH DATA;
 
 CREATE UNIQUE INDEX IF NOT EXISTS v_stats_unique_idx ON v_stats (id);
@@ -570,16 +1367,14 @@ CREATE UNIQUE INDEX IF NOT EXISTS v_stats_unique_idx ON v_stats (id);
 -- Vue pour les insights des restaurants (couverture, variété, richesse, plats fréquents)
 -- sur l'année scolaire en cours (du 1er septembre à hier).
 --
--- Ces agrégats traversent PLAT -> COMPOSITION -> CATEGORIE -> REPAS -> MENU, quatre tables
--- partitionnées par HASH sur leur propre clé primaire (non alignée avec les clés de jointure) :
--- calculées en direct par restaurant sur une période aussi large, ces jointures dégénèrent en
--- boucles imbriquées qui parcourent les 30 partitions de chaque table pour chaque ligne de MENU
--- (plusieurs secondes par restaurant). Cette vue matérialisée fait le calcul une seule fois pour
--- tous les restaurants ; l'API n'a plus qu'à lire une ligne par RID.
+-- Calculée à partir des agrégats par jour (STATS_RESTAURANT_JOUR, STATS_PLAT_JOUR), maintenus
+-- par rollup_menus() : la vue ne traverse plus PLAT -> COMPOSITION -> CATEGORIE -> REPAS -> MENU,
+-- quatre tables partitionnées par HASH sur leur propre clé primaire. L'API n'a plus qu'à lire une
+-- ligne par RID.
 --
--- Rafraîchie une fois par cycle d'ingestion (voir CROUStillant/__main__.py, juste après le
--- rafraîchissement de v_stats) : les chiffres sont donc à jour "à la dernière ingestion", ce qui
--- convient pour des statistiques qui ne changent qu'une fois par jour au plus.
+-- Rafraîchie en fin de cycle d'ingestion (voir CROUStillant/__main__.py), seulement si des menus
+-- ont été écrits ou si la période a changé (nouveau jour) : les chiffres sont donc à jour "à la
+-- dernière ingestion", ce qui convient pour des statistiques qui ne changent qu'une fois par jour au plus.
 CREATE MATERIALIZED VIEW v_restaurant_insights_summary AS
 WITH bounds AS (
     SELECT
@@ -590,38 +1385,34 @@ WITH bounds AS (
         END) AS periode_debut,
         (CURRENT_DATE - 1) AS periode_fin
 ),
-base AS (
+richness AS (
     SELECT
-        M.RID,
-        RP.RPID,
-        C.CATID,
-        CO.PLATID
-    FROM MENU M
+        S.RID,
+        SUM(S.NB_REPAS) AS nb_repas,
+        SUM(S.NB_CATEGORIES) AS nb_categories,
+        SUM(S.NB_PLATS) AS nb_plats
+    FROM STATS_RESTAURANT_JOUR S
     CROSS JOIN bounds B
-    JOIN REPAS RP ON RP.MID = M.MID
-    JOIN CATEGORIE C ON C.RPID = RP.RPID
-    LEFT JOIN COMPOSITION CO ON CO.CATID = C.CATID
-    WHERE M.DATE BETWEEN B.periode_debut AND B.periode_fin
+    WHERE S.DATE BETWEEN B.periode_debut AND B.periode_fin
+    GROUP BY S.RID
 ),
-richness AS (
+dishes AS (
     SELECT
-        RID,
-        COUNT(DISTINCT RPID) AS nb_repas,
-        COUNT(DISTINCT CATID) AS nb_categories,
-        COUNT(PLATID) AS nb_plats,
-        COUNT(DISTINCT PLATID) AS plats_uniques
-    FROM base
-    GROUP BY RID
+        S.RID,
+        S.PLATID,
+        SUM(S.NB) AS nb
+    FROM STATS_PLAT_JOUR S
+    CROSS JOIN bounds B
+    WHERE S.DATE BETWEEN B.periode_debut AND B.periode_fin
+    GROUP BY S.RID, S.PLATID
 ),
 ranked_dishes AS (
     SELECT
         RID,
         PLATID,
-        COUNT(*) AS nb,
-        ROW_NUMBER() OVER (PARTITION BY RID ORDER BY COUNT(*) DESC) AS rn
-    FROM base
-    WHERE PLATID IS NOT NULL
-    GROUP BY RID, PLATID
+        NB,
+        ROW_NUMBER() OVER (PARTITION BY RID ORDER BY NB DESC) AS rn
+    FROM dishes
 ),
 top_dishes AS (
     SELECT
@@ -634,6 +1425,11 @@ top_dishes AS (
     JOIN PLAT P ON P.PLATID = RD.PLATID
     WHERE RD.RN <= 20
     GROUP BY RD.RID
+),
+unique_dishes AS (
+    SELECT RID, COUNT(*) AS plats_uniques
+    FROM dishes
+    GROUP BY RID
 )
 SELECT
     R.RID AS rid,
@@ -642,10 +1438,11 @@ SELECT
     COALESCE(RI.nb_repas, 0) AS nb_repas,
     COALESCE(RI.nb_categories, 0) AS nb_categories,
     COALESCE(RI.nb_plats, 0) AS nb_plats,
-    COALESCE(RI.plats_uniques, 0) AS plats_uniques,
+    COALESCE(UD.plats_uniques, 0) AS plats_uniques,
     COALESCE(TD.plats_frequents, '[]'::jsonb) AS plats_frequents
 FROM RESTAURANT R
 LEFT JOIN richness RI ON RI.RID = R.RID
+LEFT JOIN unique_dishes UD ON UD.RID = R.RID
 LEFT JOIN top_dishes TD ON TD.RID = R.RID
 WHERE R.ACTIF = TRUE
 WITH DATA;
@@ -654,21 +1451,17 @@ CREATE UNIQUE INDEX IF NOT EXISTS v_restaurant_insights_summary_rid_idx ON v_res
 
 
 -- Vue pour le top 100 des plats les plus populaires (tous restaurants de type CROUS, IDTPR = 1).
--- Même jointure PLAT -> COMPOSITION -> CATEGORIE -> REPAS -> MENU -> RESTAURANT que `/plats/top`
--- calculait en direct à chaque requête ; précalculée ici et rafraîchie au même rythme que les
--- autres vues (voir CROUStillant/__main__.py).
+-- Calculée à partir des totaux par restaurant (STATS_PLAT_RESTAURANT), maintenus par
+-- rollup_menus(), et rafraîchie seulement si des menus ont été écrits (voir CROUStillant/__main__.py).
 CREATE MATERIALIZED VIEW v_plats_top AS
 SELECT
     P.PLATID AS platid,
     P.LIBELLE AS libelle,
-    COUNT(*) AS nb,
-    ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC) AS rang
-FROM PLAT P
-JOIN COMPOSITION CO ON P.PLATID = CO.PLATID
-JOIN CATEGORIE C ON C.CATID = CO.CATID
-JOIN REPAS RP ON RP.RPID = C.RPID
-JOIN MENU M ON M.MID = RP.MID
-JOIN RESTAURANT R ON R.RID = M.RID AND R.IDTPR = 1
+    SUM(S.NB) AS nb,
+    ROW_NUMBER() OVER (ORDER BY SUM(S.NB) DESC) AS rang
+FROM STATS_PLAT_RESTAURANT S
+JOIN RESTAURANT R ON R.RID = S.RID AND R.IDTPR = 1
+JOIN PLAT P ON P.PLATID = S.PLATID
 GROUP BY P.PLATID, P.LIBELLE
 ORDER BY nb DESC
 LIMIT 100